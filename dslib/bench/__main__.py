@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+
+# throughput and latency of dslib messaging between node processes over real sockets,
+# patterns: pingpong (node00 serves others), broadcast (node00 sends to others), alltoall
+# usage: python -m dslib.bench --sizes 64,1024 --nodes 2,4 -o results.json
+
+import argparse
+import json
+import logging
+import os
+import platform
+import queue
+import subprocess
+import sys
+import threading
+import time
+
+from dslib.bench.node import bench_message
+from dslib.stats import percentile
+from dslib.transport import MAX_DATAGRAM_SIZE
+
+
+APIS = ['runtime', 'communicator']
+PATTERNS = ['pingpong', 'broadcast', 'alltoall']
+TRANSPORTS = ['udp']
+
+
+def case_targets(pattern, addrs):
+    if pattern == 'pingpong':
+        return [[]] + [[addrs[0]] for _ in addrs[1:]]
+    if pattern == 'broadcast':
+        return [addrs[1:]] + [[] for _ in addrs[1:]]
+    if pattern == 'alltoall':
+        return [[a for a in addrs if a != addr] for addr in addrs]
+    raise ValueError("unknown pattern: %s" % pattern)
+
+
+class Node:
+    def __init__(self, args, api, name, addr, targets, size):
+        env = os.environ.copy()
+        root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        env['PYTHONPATH'] = os.pathsep.join(filter(None, [root, env.get('PYTHONPATH')]))
+        env.pop('TEST_SERVER', None)
+        cmd = [sys.executable, '-m', 'dslib.bench.node', '--api', api, '--name', name, '--addr', addr,
+               '--targets', ','.join(targets), '--count', str(args.count), '--size', str(size),
+               '--window', str(args.window), '--timeout', str(args.timeout)]
+        if args.debug:
+            cmd.append('-d')
+        self.name = name
+        self.targets = targets
+        self._process = subprocess.Popen(
+            cmd, env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=None if args.debug else subprocess.DEVNULL, universal_newlines=True)
+        self._lines = queue.Queue()
+        threading.Thread(target=self._read_output, daemon=True).start()
+
+    def wait_line(self, timeout):
+        try:
+            return self._lines.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def send_command(self, command):
+        self._process.stdin.write(command + '\n')
+        self._process.stdin.flush()
+
+    def stop(self):
+        self._process.terminate()
+        try:
+            self._process.wait(2)
+        except subprocess.TimeoutExpired:
+            self._process.kill()
+            self._process.wait()
+
+    def _read_output(self):
+        for line in self._process.stdout:
+            self._lines.put(line.strip())
+        self._lines.put(None)
+
+
+def run_case(args, api, pattern, nodes, size):
+    case = {'api': api, 'transport': args.transport, 'pattern': pattern, 'nodes': nodes, 'size': size}
+    addrs = ['%s:%d' % (args.host, args.base_port + i) for i in range(nodes)]
+
+    raw_size = len(bench_message(args.count, size).marshall(addrs[-1], 'node%02d-m%d' % (nodes, args.count)))
+    if raw_size > MAX_DATAGRAM_SIZE:
+        case['skipped'] = "message of %d bytes exceeds UDP datagram limit" % raw_size
+        return case
+
+    procs = []
+    try:
+        for i, targets in enumerate(case_targets(pattern, addrs)):
+            procs.append(Node(args, api, 'node%02d' % i, addrs[i], targets, size))
+        for proc in procs:
+            if proc.wait_line(10) != 'READY':
+                case['error'] = "%s failed to start" % proc.name
+                return case
+        # give receiver threads a moment to start polling sockets
+        time.sleep(.1)
+
+        senders = [proc for proc in procs if len(proc.targets) > 0]
+        for proc in senders:
+            proc.send_command('START')
+
+        results = []
+        deadline = time.time() + args.case_timeout
+        for proc in senders:
+            line = proc.wait_line(max(deadline - time.time(), 0))
+            if line is None:
+                case['error'] = "%s did not finish in time" % proc.name
+                return case
+            results.append(json.loads(line))
+    finally:
+        for proc in procs:
+            proc.stop()
+
+    latencies = [l for r in results for l in r['latencies']]
+    acked = sum(r['acked'] for r in results)
+    elapsed = max(r['end'] for r in results) - min(r['start'] for r in results)
+    case.update({
+        'messages': sum(r['sent'] for r in results),
+        'lost': sum(r['lost'] for r in results),
+        'elapsed': elapsed,
+        'throughput': acked / elapsed if elapsed > 0 else None,
+        'latency_p50_ms': percentile(latencies, 50),
+        'latency_p99_ms': percentile(latencies, 99),
+    })
+    return case
+
+
+def case_key(case):
+    return (case['api'], case['transport'], case['pattern'], case['nodes'], case['size'])
+
+
+def compare(results, baseline, threshold):
+    # returns descriptions of cases that got worse than baseline by more than threshold
+    base = {case_key(c): c for c in baseline['results']}
+    regressions = []
+    for case in results:
+        old = base.get(case_key(case))
+        if old is None or case.get('throughput') is None or old.get('throughput') is None:
+            continue
+        if case['throughput'] < old['throughput'] * (1 - threshold):
+            regressions.append("%s: throughput %.0f -> %.0f msg/s" % (
+                format_case(case), old['throughput'], case['throughput']))
+        # there is no latency without acknowledged messages
+        if case['latency_p99_ms'] is None or old['latency_p99_ms'] is None:
+            if case['latency_p99_ms'] is None and old['latency_p99_ms'] is not None:
+                regressions.append("%s: no acknowledged messages" % format_case(case))
+            continue
+        if case['latency_p99_ms'] > old['latency_p99_ms'] * (1 + threshold):
+            regressions.append("%s: p99 latency %.3f -> %.3f ms" % (
+                format_case(case), old['latency_p99_ms'], case['latency_p99_ms']))
+    return regressions
+
+
+def format_case(case):
+    return "%s/%s %s nodes=%d size=%d" % (case['api'], case['transport'], case['pattern'], case['nodes'], case['size'])
+
+
+def format_result(case):
+    if 'skipped' in case:
+        return "%s: skipped (%s)" % (format_case(case), case['skipped'])
+    if 'error' in case:
+        return "%s: error (%s)" % (format_case(case), case['error'])
+    return "%s: %.0f msg/s, p50 %.3f ms, p99 %.3f ms, lost %d" % (
+        format_case(case), case['throughput'] or 0, case['latency_p50_ms'] or 0,
+        case['latency_p99_ms'] or 0, case['lost'])
+
+
+def _list(value, cast=str):
+    return [cast(v) for v in value.split(',') if v]
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m dslib.bench')
+    parser.add_argument('--api', default=','.join(APIS), help='comma-separated: %s' % ', '.join(APIS))
+    parser.add_argument('--transport', default='udp', choices=TRANSPORTS)
+    parser.add_argument('--pattern', default=','.join(PATTERNS), help='comma-separated: %s' % ', '.join(PATTERNS))
+    parser.add_argument('--sizes', default='64,1024,16384,65000', help='comma-separated payload sizes in bytes')
+    parser.add_argument('--nodes', default='2,4', help='comma-separated node counts')
+    parser.add_argument('--count', type=int, default=1000, help='messages per sender and target')
+    parser.add_argument('--window', type=int, default=1, help='max unacknowledged messages per target')
+    parser.add_argument('--timeout', type=float, default=1, help='message loss timeout in seconds')
+    parser.add_argument('--case-timeout', type=float, default=120, help='max duration of a case in seconds')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--base-port', type=int, default=9800)
+    parser.add_argument('-o', dest='output', help='write JSON results to file instead of stdout')
+    parser.add_argument('--baseline', help='JSON results to compare with, exit with 1 on regressions')
+    parser.add_argument('--threshold', type=float, default=.2, help='allowed relative regression')
+    parser.add_argument('-d', dest='debug', action='store_true', help='print debugging info')
+    args = parser.parse_args()
+    logging.basicConfig(format="%(asctime)s - %(message)s", level=logging.DEBUG if args.debug else logging.INFO)
+
+    for name, values, allowed in [('api', _list(args.api), APIS), ('pattern', _list(args.pattern), PATTERNS)]:
+        for value in values:
+            if value not in allowed:
+                parser.error("unknown %s: %s" % (name, value))
+
+    results = []
+    for api in _list(args.api):
+        for pattern in _list(args.pattern):
+            for nodes in _list(args.nodes, int):
+                if nodes < 2:
+                    continue
+                for size in _list(args.sizes, int):
+                    case = run_case(args, api, pattern, nodes, size)
+                    logging.info(format_result(case))
+                    results.append(case)
+
+    report = {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'count': args.count,
+            'window': args.window,
+            'timeout': args.timeout,
+        },
+        'results': results,
+    }
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for r in regressions:
+            logging.warning("regression: %s", r)
+        if len(regressions) > 0:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
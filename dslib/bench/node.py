@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import logging
+import sys
+import threading
+import time
+
+from dslib import Communicator, Message, Process, Runtime
+
+
+def bench_message(seq, size):
+    return Message('BENCH', {'seq': seq, 'data': 'x' * size})
+
+
+class Sender:
+    # closed-loop load: at most `window` unacknowledged messages per target,
+    # messages not acknowledged within `timeout` are counted as lost
+
+    def __init__(self, targets, count, window, timeout):
+        self._targets = targets
+        self._count = count
+        self._window = window
+        self._timeout = timeout
+        self._next_seq = {target: 0 for target in targets}
+        self._outstanding = {}
+        self._latencies = []
+        self._lost = 0
+        self._start = None
+        self._end = None
+
+    @property
+    def timeout(self):
+        return self._timeout
+
+    @property
+    def done(self):
+        return self._end is not None
+
+    def start(self):
+        self._start = time.time()
+        to_send = []
+        for target in self._targets:
+            for _ in range(self._window):
+                to_send.extend(self._next(target))
+        self._check_done()
+        return to_send
+
+    def on_ack(self, target, seq):
+        sent = self._outstanding.pop((target, seq), None)
+        if sent is None:
+            # acknowledgement of a message already counted as lost
+            return []
+        self._latencies.append((time.perf_counter() - sent) * 1000)
+        to_send = self._next(target)
+        self._check_done()
+        return to_send
+
+    def expire(self):
+        now = time.perf_counter()
+        to_send = []
+        for (target, seq), sent in list(self._outstanding.items()):
+            if now - sent > self._timeout:
+                del self._outstanding[(target, seq)]
+                self._lost += 1
+                to_send.extend(self._next(target))
+        self._check_done()
+        return to_send
+
+    def result(self):
+        return {
+            'sent': sum(self._next_seq.values()),
+            'acked': len(self._latencies),
+            'lost': self._lost,
+            'latencies': self._latencies,
+            'start': self._start,
+            'end': self._end,
+        }
+
+    def _next(self, target):
+        seq = self._next_seq[target]
+        if seq >= self._count:
+            return []
+        self._next_seq[target] = seq + 1
+        self._outstanding[(target, seq)] = time.perf_counter()
+        return [(target, seq)]
+
+    def _check_done(self):
+        if self._end is None and len(self._outstanding) == 0 and \
+                all(seq >= self._count for seq in self._next_seq.values()):
+            self._end = time.time()
+
+
+class BenchProcess(Process):
+    def __init__(self, name, sender, size, done):
+        super().__init__(name)
+        self._sender = sender
+        self._size = size
+        self._done = done
+        # timers fire in their own threads
+        self._lock = threading.Lock()
+
+    def receive(self, ctx, msg):
+        with self._lock:
+            self._receive(ctx, msg)
+
+    def on_timer(self, ctx, timer):
+        with self._lock:
+            self._send(ctx, self._sender.expire())
+            if not self._sender.done:
+                ctx.set_timer('check', self._sender.timeout / 2)
+
+    def _receive(self, ctx, msg):
+        if msg.type == 'BENCH':
+            ctx.send(Message('ACK', {'seq': msg.body['seq']}), msg.sender)
+
+        elif msg.type == 'ACK':
+            self._send(ctx, self._sender.on_ack(msg.sender, msg.body['seq']))
+
+        elif msg.type == 'START':
+            self._send(ctx, self._sender.start())
+            ctx.set_timer('check', self._sender.timeout / 2)
+
+    def _send(self, ctx, to_send):
+        for target, seq in to_send:
+            ctx.send(bench_message(seq, self._size), target)
+        if self._sender.done:
+            self._done.set()
+
+
+def run_runtime(args, sender):
+    done = threading.Event()
+    proc = BenchProcess(args.name, sender, args.size, done)
+    Runtime(proc, args.addr).start()
+    print('READY', flush=True)
+    done.wait()
+    print(json.dumps(sender.result()), flush=True)
+    # keep acknowledging messages of other senders until stopped
+
+
+def run_communicator(args, sender):
+    comm = Communicator(args.name, args.addr)
+    print('READY', flush=True)
+    started = False
+    reported = False
+    last_check = time.time()
+    while True:
+        msg = comm.recv(timeout=sender.timeout / 2 if started else None)
+        to_send = []
+        if started and time.time() - last_check >= sender.timeout / 2:
+            to_send = sender.expire()
+            last_check = time.time()
+        if msg is None:
+            pass
+        elif msg.type == 'BENCH':
+            comm.send(Message('ACK', {'seq': msg.body['seq']}), msg.sender)
+        elif msg.type == 'ACK':
+            to_send.extend(sender.on_ack(msg.sender, msg.body['seq']))
+        elif msg.type == 'START':
+            started = True
+            last_check = time.time()
+            to_send = sender.start()
+        for target, seq in to_send:
+            comm.send(bench_message(seq, args.size), target)
+        if started and sender.done and not reported:
+            print(json.dumps(sender.result()), flush=True)
+            reported = True
+            started = False
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--api', choices=['runtime', 'communicator'], default='runtime')
+    parser.add_argument('--name', required=True)
+    parser.add_argument('--addr', required=True, metavar='host:port')
+    parser.add_argument('--targets', default='', help='comma-separated addresses to send messages to')
+    parser.add_argument('--count', type=int, default=1000, help='messages per target')
+    parser.add_argument('--size', type=int, default=64, help='payload size in bytes')
+    parser.add_argument('--window', type=int, default=1, help='max unacknowledged messages per target')
+    parser.add_argument('--timeout', type=float, default=1, help='message loss timeout in seconds')
+    parser.add_argument('-d', dest='log_level', action='store_const', const=logging.DEBUG,
+                        help='print debugging info', default=logging.WARNING)
+    args = parser.parse_args()
+    logging.basicConfig(format="%(asctime)s - %(message)s", level=args.log_level, stream=sys.stderr)
+
+    targets = [t for t in args.targets.split(',') if t]
+    sender = Sender(targets, args.count, args.window, args.timeout)
+    if args.api == 'runtime':
+        run_runtime(args, sender)
+    else:
+        run_communicator(args, sender)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+# build time, memory, lookup throughput, load deviation and moved keys on join and leave
+# of key placement strategies for sharded storages
+# usage: python -m dslib.bench.placement --nodes 5,10,100,1000 --keys 20000 -o results.json
+
+import argparse
+import json
+import logging
+import math
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+from dslib.loadgen import make_keys, skewed_alphabet_weights
+from dslib.ring import PLACEMENTS, make_placement
+from dslib.stats import DistributionStats
+
+
+def node_names(count):
+    return ['node%04d' % (i + 1) for i in range(count)]
+
+
+def moved_share(before, after):
+    return sum(1 for a, b in zip(before, after) if a != b) / len(before)
+
+
+def run_case(args, name, nodes, keys):
+    case = {'placement': name, 'nodes': nodes, 'keys': len(keys)}
+    kwargs = {'vnodes': args.vnodes} if name == 'ring' else {}
+    members = node_names(nodes)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    placement = make_placement(name, members, **kwargs)
+    case['build_ms'] = (time.perf_counter() - start) * 1000
+    case['memory_bytes'] = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    owners = placement.lookup_many(keys)
+    elapsed = time.perf_counter() - start
+    case['lookups_per_sec'] = len(keys) / elapsed if elapsed > 0 else None
+
+    stats = DistributionStats(members)
+    by_node = {}
+    for key, owner in zip(keys, owners):
+        by_node.setdefault(owner, []).append(key)
+    for node, node_keys in by_node.items():
+        stats.add(node, node_keys)
+    deviations = stats.deviations(len(keys)).values()
+    case['avg_deviation'] = sum(deviations) / nodes
+    case['max_deviation'] = max(deviations)
+    # relative standard deviation of a node count caused by sampling of keys alone
+    case['sampling_noise'] = math.sqrt((nodes - 1) / len(keys))
+
+    placement.add('node%04d' % (nodes + 1))
+    case['moved_on_join'] = moved_share(owners, placement.lookup_many(keys))
+    case['ideal_moved_on_join'] = 1 / (nodes + 1)
+    placement.remove('node%04d' % (nodes + 1))
+    placement.remove(members[0])
+    case['moved_on_leave'] = moved_share(owners, placement.lookup_many(keys))
+    case['ideal_moved_on_leave'] = 1 / nodes
+    return case
+
+
+def format_result(case):
+    return ("%-10s nodes=%-5d %9.0f lookups/s, %8.1f KiB, build %7.1f ms, deviation avg %5.1f%% max %5.1f%%, "
+            "moved on join %5.1f%% (ideal %.1f%%), on leave %5.1f%% (ideal %.1f%%)") % (
+        case['placement'], case['nodes'], case['lookups_per_sec'] or 0, case['memory_bytes'] / 1024,
+        case['build_ms'], case['avg_deviation'] * 100, case['max_deviation'] * 100,
+        case['moved_on_join'] * 100, case['ideal_moved_on_join'] * 100,
+        case['moved_on_leave'] * 100, case['ideal_moved_on_leave'] * 100)
+
+
+def _list(value, cast=str):
+    return [cast(v) for v in value.split(',') if v]
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m dslib.bench.placement')
+    parser.add_argument('--placement', default=','.join(PLACEMENTS),
+                        help='comma-separated: %s' % ', '.join(PLACEMENTS))
+    parser.add_argument('--nodes', default='5,10,100,1000', help='comma-separated node counts')
+    parser.add_argument('--keys', type=int, default=20000, help='number of keys')
+    parser.add_argument('--skewed-keys', action='store_true', help='draw key letters with skewed weights as tests do')
+    parser.add_argument('--vnodes', type=int, default=512, help='virtual nodes per member of the ring')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', dest='output', help='write JSON results to file instead of stdout')
+    args = parser.parse_args()
+    logging.basicConfig(format="%(asctime)s - %(message)s", level=logging.INFO)
+
+    for name in _list(args.placement):
+        if name not in PLACEMENTS:
+            parser.error("unknown placement: %s" % name)
+
+    rng = random.Random(args.seed)
+    weights = skewed_alphabet_weights(rng) if args.skewed_keys else None
+    keys = make_keys(rng, args.keys, weights=weights)
+
+    results = []
+    for name in _list(args.placement):
+        for nodes in _list(args.nodes, int):
+            case = run_case(args, name, nodes, keys)
+            logging.info(format_result(case))
+            results.append(case)
+
+    report = {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'keys': args.keys,
+            'skewed_keys': args.skewed_keys,
+            'vnodes': args.vnodes,
+            'seed': args.seed,
+        },
+        'results': results,
+    }
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+
+# throughput, commit latency and records per fsync of the write-ahead log
+# with group commit against fsync per operation, each writer thread waits for the commit of its record
+# usage: python -m dslib.bench.wal --threads 1,4,16,64 --ops 2000 -o results.json
+
+import argparse
+import json
+import logging
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from dslib.stats import percentile
+from dslib.wal import WriteAheadLog
+
+
+MODES = ['group', 'per-op']
+
+
+def run_case(args, mode, threads):
+    case = {'mode': mode, 'threads': threads, 'size': args.size}
+    path = tempfile.mkdtemp(prefix='wal-bench-', dir=args.dir)
+    try:
+        log = WriteAheadLog(path, group_commit=mode == 'group')
+        per_thread = max(args.ops // threads, 1)
+        latencies = [[] for _ in range(threads)]
+        value = 'x' * args.size
+        start_barrier = threading.Barrier(threads + 1)
+
+        def writer(i):
+            start_barrier.wait()
+            for n in range(per_thread):
+                started = time.perf_counter()
+                seq = log.append(['put', 'key%d-%d' % (i, n), value])
+                log.commit(seq)
+                latencies[i].append((time.perf_counter() - started) * 1000)
+
+        workers = [threading.Thread(target=writer, args=(i,)) for i in range(threads)]
+        for worker in workers:
+            worker.start()
+        start_barrier.wait()
+        start = time.perf_counter()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+        stats = log.stats()
+        log.close()
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+    all_latencies = [l for thread_latencies in latencies for l in thread_latencies]
+    case.update({
+        'ops': stats['records'],
+        'elapsed': elapsed,
+        'ops_per_sec': stats['records'] / elapsed if elapsed > 0 else None,
+        'syncs': stats['syncs'],
+        'records_per_sync': stats['records'] / stats['syncs'] if stats['syncs'] > 0 else None,
+        'latency_p50_ms': percentile(all_latencies, 50),
+        'latency_p99_ms': percentile(all_latencies, 99),
+    })
+    return case
+
+
+def format_result(case):
+    return "%-6s threads=%-3d %8.0f ops/s, %6.1f records/fsync, p50 %.3f ms, p99 %.3f ms" % (
+        case['mode'], case['threads'], case['ops_per_sec'] or 0, case['records_per_sync'] or 0,
+        case['latency_p50_ms'] or 0, case['latency_p99_ms'] or 0)
+
+
+def _list(value, cast=str):
+    return [cast(v) for v in value.split(',') if v]
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m dslib.bench.wal')
+    parser.add_argument('--mode', default=','.join(MODES), help='comma-separated: %s' % ', '.join(MODES))
+    parser.add_argument('--threads', default='1,4,16,64', help='comma-separated numbers of writer threads')
+    parser.add_argument('--ops', type=int, default=2000, help='number of operations in a case')
+    parser.add_argument('--size', type=int, default=100, help='size of a value in bytes')
+    parser.add_argument('--dir', help='directory for logs (on the disk to measure), a temporary one by default')
+    parser.add_argument('-o', dest='output', help='write JSON results to file instead of stdout')
+    args = parser.parse_args()
+    logging.basicConfig(format="%(asctime)s - %(message)s", level=logging.INFO)
+
+    for mode in _list(args.mode):
+        if mode not in MODES:
+            parser.error("unknown mode: %s" % mode)
+
+    results = []
+    for mode in _list(args.mode):
+        for threads in _list(args.threads, int):
+            case = run_case(args, mode, threads)
+            logging.info(format_result(case))
+            results.append(case)
+
+    report = {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'ops': args.ops,
+            'size': args.size,
+        },
+        'results': results,
+    }
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -11,6 +11,8 @@ import threading
 from google.protobuf.any_pb2 import Any
 
 from .message import Message
+from .sim import ProcessCrashed, current_simulation
+from .test_server import GRPC_OPTIONS
 from .transport import UDPTransport
 
 from .proto import test_server_pb2 as pb
@@ -32,7 +34,7 @@ class Communicator:
             self._runtime = runtime
 
         def start(self):
-            tserver = rpc.TestServerStub(grpc.insecure_channel(self._server_addr))
+            tserver = rpc.TestServerStub(grpc.insecure_channel(self._server_addr, options=GRPC_OPTIONS))
             self._command_stream = tserver.AttachProcess(iter(self._events.get, None))
             threading.Thread(target=self._process_commands).start()
 
@@ -42,8 +44,10 @@ class Communicator:
         def on_process_stopped(self):
             self._send_event(pb.ProcessStoppedEvent())
 
-        def on_new_message(self, message_id, recepient, raw_message):
-            self._send_event(pb.NewMessageEvent(message_id=message_id, recepient=recepient, message=raw_message))
+        def on_new_message(self, message_id, recepient, raw_message, message_type, sender):
+            self._send_event(pb.NewMessageEvent(
+                message_id=message_id, recepient=recepient, message=raw_message,
+                message_type=message_type, is_local=(sender == 'local'), sender=sender))
 
         def on_message_received(self, message_id, raw_message=None):
             if raw_message is None:
@@ -51,8 +55,8 @@ class Communicator:
             else:
                 self._send_event(pb.MessageDataReceivedEvent(message_id=message_id, message=raw_message))
 
-        def on_message_processed(self, message_id):
-            self._send_event(pb.MessageProcessedEvent(message_id=message_id))
+        def on_message_processed(self, message_id, digest=''):
+            self._send_event(pb.MessageProcessedEvent(message_id=message_id, digest=digest))
 
         def on_new_timer(self, timer_id, name, interval):
             self._send_event(pb.NewTimerEvent(timer_id=timer_id, name=name, interval=interval))
@@ -60,12 +64,18 @@ class Communicator:
         def on_timer_fired(self, timer_id):
             self._send_event(pb.TimerFiredEvent(timer_id=timer_id))
 
-        def on_timer_processed(self, timer_id):
-            self._send_event(pb.TimerProcessedEvent(timer_id=timer_id))
+        def on_timer_processed(self, timer_id, digest=''):
+            self._send_event(pb.TimerProcessedEvent(timer_id=timer_id, digest=digest))
 
         def on_timer_canceled(self, timer_id):
             self._send_event(pb.TimerCanceledEvent(timer_id=timer_id))
 
+        def on_snapshot_taken(self, snapshot_id, state=None, error=None):
+            self._send_event(pb.SnapshotTakenEvent(snapshot_id=snapshot_id, state=state, error=error))
+
+        def on_state_restored(self, snapshot_id, error=None):
+            self._send_event(pb.StateRestoredEvent(snapshot_id=snapshot_id, error=error))
+
         def _process_commands(self):
             try:
                 for c in self._command_stream:
@@ -86,6 +96,16 @@ class Communicator:
 
                     if c.Is(pb.CrashCommand.DESCRIPTOR):
                         self._runtime._handle_crash()
+
+                    if c.Is(pb.SnapshotCommand.DESCRIPTOR):
+                        command = pb.SnapshotCommand()
+                        c.Unpack(command)
+                        self._runtime._handle_snapshot(command.snapshot_id)
+
+                    if c.Is(pb.RestoreCommand.DESCRIPTOR):
+                        command = pb.RestoreCommand()
+                        c.Unpack(command)
+                        self._runtime._handle_restore(command.snapshot_id, command.state)
             except grpc.RpcError as e:
                 logging.debug("grpc error %s", e)
                 self._events.put(None)
@@ -98,27 +118,36 @@ class Communicator:
 
     def __init__(self, name, addr=None, read_stdin=True):
         self._name = name
-        self._addr = addr
-        self._trans = UDPTransport(addr)
-        self._addr = self._trans.addr
         self._read_stdin = read_stdin
-
         self._inbox = queue.Queue()
 
-        signal.signal(signal.SIGINT, self._stop_signal)
-        signal.signal(signal.SIGTERM, self._stop_signal)
-
-        if os.environ.get('TEST_SERVER') is None:
-            self._testing = False
-        else:
+        self._simulation = current_simulation()
+        if self._simulation is not None:
+            # program runs as a task of the test process, no sockets and signal handlers
+            self._trans = None
+            self._addr = addr or self._simulation.new_addr()
             self._testing = True
-            self._tserver_addr = os.environ['TEST_SERVER']
-            self._tserver_client = Communicator.TestServerClient(self._tserver_addr, self)
-            self._test_mode = os.getenv('TEST_MODE', TestMode.CONTROL)
+            self._tserver_client = self._simulation.client(self)
+            self._test_mode = TestMode.CONTROL
+        else:
+            self._trans = UDPTransport(addr)
+            self._addr = self._trans.addr
+            signal.signal(signal.SIGINT, self._stop_signal)
+            signal.signal(signal.SIGTERM, self._stop_signal)
+            self._testing = os.environ.get('TEST_SERVER') is not None
+            if self._testing:
+                self._tserver_addr = os.environ['TEST_SERVER']
+                self._tserver_client = Communicator.TestServerClient(self._tserver_addr, self)
+                self._test_mode = os.getenv('TEST_MODE', TestMode.CONTROL)
+
+        if self._testing:
             self._message_count = 0
             self._timer_count = 0
             self._prev_message = None
             self._prev_timer = None
+            self._digest = ''
+            # request id of the last received local message, see send_local
+            self._request_id = None
 
         self._start()
 
@@ -138,19 +167,31 @@ class Communicator:
             self._message_count += 1
             message_id = "%s-m%d" % (self._name, self._message_count)
             raw = message.marshall(self._addr, message_id)
-            self._tserver_client.on_new_message(message_id, recepient, raw)
+            self._tserver_client.on_new_message(message_id, recepient, raw, message.type, self._addr)
         else:
             raw = message.marshall(self._addr)
 
         if not self._testing or self._test_mode == TestMode.WATCH:
             self._trans.send(raw, recepient)
 
-    def send_local(self, message):
-        print('>>', message)
+    def send_local(self, message, request_id=None):
+        # replies to the last received local message by default, pass request_id to reply to another one
+        if self._simulation is None or self._simulation.debug:
+            print('>>', message)
         if self._testing:
             message_id = sender = 'local'
+            if request_id is None:
+                request_id = self._request_id
+            if request_id is not None:
+                message = message.with_request_id(request_id)
             raw = message.marshall(sender, message_id)
-            self._tserver_client.on_new_message(message_id, sender, raw)
+            self._tserver_client.on_new_message(message_id, sender, raw, message.type, sender)
+
+    def set_digest(self, digest):
+        # cheap JSON-serializable summary of the state (see Process.digest),
+        # it is reported to the test server when the current event is processed
+        if self._testing:
+            self._digest = json.dumps(digest, sort_keys=True) if digest is not None else ''
 
     def recv(self, timeout=None):
         if self._testing:
@@ -160,11 +201,11 @@ class Communicator:
                 self._tserver_client.on_new_timer(timer_id, 'recv', timeout)
 
             if self._prev_message is not None:
-                self._tserver_client.on_message_processed(self._prev_message)
+                self._tserver_client.on_message_processed(self._prev_message, self._digest)
                 self._prev_message = None
 
             if self._prev_timer is not None:
-                self._tserver_client.on_timer_processed(self._prev_timer)
+                self._tserver_client.on_timer_processed(self._prev_timer, self._digest)
                 self._prev_timer = None
 
         if not self._testing or self._test_mode == TestMode.WATCH:
@@ -174,6 +215,9 @@ class Communicator:
                 message = None
         else:
             message = self._inbox.get()
+            if message is None:
+                # crashed or stopped by the in-process test server
+                raise ProcessCrashed()
 
         if self._testing and timeout is not None:
             if ((self._test_mode == TestMode.WATCH and message is None) or
@@ -193,6 +237,8 @@ class Communicator:
                 else:
                     self._tserver_client.on_message_received(message._id)
                 self._prev_message = message._id
+                if message.is_local():
+                    self._request_id = message.request_id
 
         return message
 
@@ -204,7 +250,7 @@ class Communicator:
             else:
                 logging.debug("%s dropped message from %s: %s %s", self._name, message.sender, message.type, message.body)
                 if self._testing:
-                    self._tserver_client.on_message_processed(self._prev_message)
+                    self._tserver_client.on_message_processed(self._prev_message, self._digest)
                     self._prev_message = None
 
     # Private
@@ -249,7 +295,8 @@ class Communicator:
             self._tserver_client.on_process_stopped()
             # make sure test server received our goodbye
             time.sleep(0.01)
-        self._trans.destroy()
+        if self._trans is not None:
+            self._trans.destroy()
 
     # Test Server Command Handlers
 
@@ -265,4 +312,14 @@ class Communicator:
         self._inbox.put(Message('TIMER', timer_id))
 
     def _handle_crash(self):
-        os._exit(1)
\ No newline at end of file
+        if self._simulation is not None:
+            self._simulation.crash(self)
+            return
+        os._exit(1)
+
+    def _handle_snapshot(self, snapshot_id):
+        # the state of a blocking program includes its stack and cannot be captured
+        self._tserver_client.on_snapshot_taken(snapshot_id, error='snapshots are not supported by Communicator')
+
+    def _handle_restore(self, snapshot_id, raw_state):
+        self._tserver_client.on_state_restored(snapshot_id, error='snapshots are not supported by Communicator')
\ No newline at end of file
@@ -0,0 +1,317 @@
+import abc
+import copy
+import hashlib
+import logging
+import multiprocessing
+import os
+
+from .schedule import Action, ScheduleRecorder
+from .test_server import Event
+
+
+class Model:
+    # system whose schedules are explored, instances are pickled and sent to worker processes,
+    # so subclasses should be defined at module level and keep only plain data
+
+    @abc.abstractmethod
+    def setup(self, worker):
+        # type: (int) -> TestServer
+        # starts the test server and processes and applies the initial commands,
+        # addresses should depend on the worker index, since workers run concurrently
+        pass
+
+    @abc.abstractmethod
+    def teardown(self, ts):
+        # type: (TestServer) -> None
+        pass
+
+    @abc.abstractmethod
+    def check(self, ts):
+        # type: (TestServer) -> None
+        # checks the state at the end of a schedule, raises AssertionError on violation
+        pass
+
+    def state_hash(self, ts, history):
+        # type: (TestServer, dict) -> str
+        # override to return a digest of the reached state, by default it is identified by
+        # the events delivered to each process, which is exact for deterministic processes
+        return None
+
+
+class Violation:
+    def __init__(self, schedule, error, path=None):
+        self.schedule = schedule
+        self.error = error
+        self.path = path
+
+    def __str__(self):
+        out = "%s after %s" % (self.error, ' '.join(self.schedule))
+        if self.path is not None:
+            out += " (schedule saved to %s)" % self.path
+        return out
+
+
+class ExplorationResult:
+    def __init__(self):
+        self.schedules = 0
+        self.steps = 0
+        self.pruned = 0
+        self.violations = []
+
+    def merge(self, other):
+        self.schedules += other.schedules
+        self.steps += other.steps
+        self.pruned += other.pruned
+        self.violations.extend(other.violations)
+
+    def __str__(self):
+        return "explored %d schedules (%d steps, %d pruned), found %d violations" % (
+            self.schedules, self.steps, self.pruned, len(self.violations))
+
+
+class Explorer:
+    # enumerates delivery interleavings of a model replaying schedule prefixes (or rolling back to
+    # snapshots), pruned with sleep sets and visited state hashes, subtrees run in worker processes
+
+    def __init__(self, model, max_depth=20, workers=1, step_timeout=1,
+                 max_schedules=None, stop_on_violation=True, schedule_dir=None, use_snapshots=False):
+        self._model = model
+        self._max_depth = max_depth
+        self._workers = workers
+        self._step_timeout = step_timeout
+        self._max_schedules = max_schedules
+        self._stop_on_violation = stop_on_violation
+        self._schedule_dir = schedule_dir
+        # branch from process snapshots instead of re-executing schedule prefixes,
+        # this also makes state hashing use the actual process states
+        self._use_snapshots = use_snapshots
+
+    def run(self):
+        if self._workers <= 1:
+            return _Search(self, 0).explore([([], [])])
+
+        # split the search tree between workers by expanding it breadth first
+        result = ExplorationResult()
+        search = _Search(self, 0)
+        frontier = [([], [])]
+        while 0 < len(frontier) < self._workers * 4:
+            level = []
+            for prefix, sleep in frontier:
+                level.extend(search.expand(prefix, sleep, result))
+            if len(level) == 0 or (self._stop_on_violation and len(result.violations) > 0):
+                break
+            frontier = level
+        if self._stop_on_violation and len(result.violations) > 0:
+            return result
+
+        # grpc does not survive fork, so workers are spawned as fresh interpreters
+        mp = multiprocessing.get_context('spawn')
+        chunks = [frontier[i::self._workers] for i in range(self._workers)]
+        worker_ids = mp.Queue()
+        for i in range(self._workers):
+            worker_ids.put(i + 1)
+        with mp.Pool(self._workers, _init_worker, (worker_ids,)) as pool:
+            for r in pool.imap_unordered(_explore_chunk, [(self, chunk) for chunk in chunks if chunk]):
+                result.merge(r)
+        return result
+
+
+_worker_id = 0
+
+
+def _init_worker(worker_ids):
+    global _worker_id
+    _worker_id = worker_ids.get()
+
+
+def _explore_chunk(args):
+    explorer, chunk = args
+    return _Search(explorer, _worker_id).explore(chunk)
+
+
+def _target(event):
+    if event.type == Event.MESSAGE:
+        return event.recepient
+    return event.process_id
+
+
+class _Search:
+    def __init__(self, explorer, worker):
+        self._explorer = explorer
+        self._model = explorer._model
+        self._worker = worker
+        # state hash -> sleep set it was explored with
+        self._visited = {}
+        self._actions = {}
+        self._ts = None
+        # schedule prefix -> [snapshot, history, number of branches left to explore]
+        self._snapshots = {}
+
+    def explore(self, stack):
+        result = ExplorationResult()
+        stack = list(reversed(stack))
+        try:
+            while len(stack) > 0:
+                if self._explorer._max_schedules is not None and result.schedules >= self._explorer._max_schedules:
+                    break
+                prefix, sleep = stack.pop()
+                branches = self._run(prefix, sleep, result, extend=True)
+                stack.extend(reversed(branches))
+                if self._explorer._stop_on_violation and len(result.violations) > 0:
+                    break
+        finally:
+            self._close()
+        return result
+
+    def expand(self, prefix, sleep, result):
+        try:
+            return self._run(prefix, sleep, result, extend=False)
+        finally:
+            self._close()
+
+    def _run(self, prefix, sleep, result, extend):
+        # executes the prefix and then (if extend) follows the first enabled event until
+        # quiescence or the depth bound, returning the unexplored sibling branches
+        branches = []
+        schedule = []
+        history = {}
+        use_snapshots = self._explorer._use_snapshots
+        try:
+            ts = self._prepare(prefix, schedule, history, result)
+            if ts is None:
+                return []
+
+            sleep = list(sleep)
+            while len(schedule) < self._explorer._max_depth:
+                pending = self._pending(ts)
+                if len(pending) == 0:
+                    break
+                snapshot = ts.snapshot() if use_snapshots and extend else None
+                state = self._state_hash(ts, history, pending, snapshot)
+                sleeping = set(event_id for event_id, _ in sleep)
+                visited = self._visited.get(state)
+                if visited is not None and visited <= sleeping:
+                    result.pruned += 1
+                    return branches
+                if visited is not None:
+                    # events awake at the first visit were explored from this state then,
+                    # only the ones asleep then and awake now are left
+                    done = [(e.id, _target(e)) for e in pending.values()
+                            if e.id not in visited and e.id not in sleeping]
+                    self._visited[state] = visited & sleeping
+                    sleep = sleep + done
+                    sleeping.update(event_id for event_id, _ in done)
+                else:
+                    self._visited[state] = frozenset(sleeping)
+
+                candidates = [e for e in sorted(pending.values(), key=lambda e: e.id) if e.id not in sleeping]
+                if len(candidates) == 0:
+                    result.pruned += 1
+                    return branches
+
+                level = []
+                explored = list(sleep)
+                for event in candidates:
+                    branch_sleep = [s for s in explored if s[1] != _target(event)]
+                    explored.append((event.id, _target(event)))
+                    level.append((schedule + [event.id], branch_sleep))
+                if not extend:
+                    return level
+                if snapshot is not None and len(level) > 1:
+                    self._snapshots[tuple(schedule)] = [snapshot, copy.deepcopy(history), len(level) - 1]
+
+                # follow the first branch in this execution
+                next_schedule, sleep = level[0]
+                branches.extend(level[1:])
+                if not self._step(ts, pending[next_schedule[-1]], schedule, history, result):
+                    self._report(schedule, "step timeout", result)
+                    self._close()
+                    return branches
+
+            result.schedules += 1
+            try:
+                self._model.check(ts)
+            except AssertionError as e:
+                self._report(schedule, str(e), result)
+            return branches
+        finally:
+            if not use_snapshots:
+                self._close()
+
+    def _prepare(self, prefix, schedule, history, result):
+        # brings the system to the state after the prefix, restoring the snapshot
+        # taken at the branching point if there is one
+        saved = self._snapshots.get(tuple(prefix[:-1])) if len(prefix) > 0 else None
+        if saved is not None:
+            snapshot, saved_history, left = saved
+            if left <= 1:
+                del self._snapshots[tuple(prefix[:-1])]
+            else:
+                saved[2] -= 1
+            if self._ts is None:
+                self._ts = self._model.setup(self._worker)
+            self._ts.restore(snapshot)
+            schedule.extend(prefix[:-1])
+            history.update(copy.deepcopy(saved_history))
+            replay = prefix[-1:]
+        else:
+            self._close()
+            self._ts = self._model.setup(self._worker)
+            replay = prefix
+
+        for event_id in replay:
+            event = self._pending(self._ts).get(event_id)
+            if event is None or not self._step(self._ts, event, schedule, history, result):
+                logging.debug("schedule prefix diverged at %s", event_id)
+                result.pruned += 1
+                self._close()
+                return None
+        return self._ts
+
+    def _close(self):
+        if self._ts is not None:
+            self._model.teardown(self._ts)
+            self._ts = None
+
+    def _pending(self, ts):
+        return {e.id: e for e in ts.pending_events()}
+
+    def _step(self, ts, event, schedule, history, result):
+        schedule.append(event.id)
+        history.setdefault(_target(event), []).append(event.id)
+        self._actions[event.id] = Action.DELIVER if event.type == Event.MESSAGE else Action.FIRE
+        result.steps += 1
+        return ts.step_event(event.id, self._explorer._step_timeout)
+
+    def _state_hash(self, ts, history, pending, snapshot):
+        state = self._model.state_hash(ts, history)
+        if state is None:
+            h = hashlib.sha1()
+            if snapshot is not None:
+                for process_id in sorted(snapshot.processes):
+                    h.update(process_id.encode('utf-8'))
+                    h.update(snapshot.processes[process_id])
+                    # local messages already sent by the process are part of the state too
+                    for message in snapshot.local_messages.get(process_id, []):
+                        h.update(str(message).encode('utf-8'))
+            else:
+                for process_id in sorted(history):
+                    h.update(process_id.encode('utf-8'))
+                    h.update(b'\0'.join(e.encode('utf-8') for e in history[process_id]))
+                    h.update(b'\1')
+            h.update(b'\0'.join(e.encode('utf-8') for e in sorted(pending)))
+            state = h.hexdigest()
+        return state
+
+    def _report(self, schedule, error, result):
+        path = None
+        if self._explorer._schedule_dir is not None:
+            path = os.path.join(self._explorer._schedule_dir,
+                                'violation-%d-%d.jsonl' % (self._worker, len(result.violations)))
+            recorder = ScheduleRecorder(path)
+            for event_id in schedule:
+                recorder.record(event_id, self._actions[event_id])
+            recorder.close()
+        violation = Violation(list(schedule), error, path)
+        logging.info("violation: %s", violation)
+        result.violations.append(violation)
@@ -0,0 +1,91 @@
+import collections
+
+
+class HintLog:
+    # hinted handoff: writes accepted on behalf of unavailable nodes in a log per target, values of a key
+    # are merged, an ack truncates the log up to its batch and repeated keys trigger compaction
+
+    def __init__(self, merge=None, compact_ratio=2):
+        self._merge = merge if merge is not None else (lambda old, new: new)
+        self._compact_ratio = compact_ratio
+        # target -> deque of (seq, key)
+        self._logs = {}
+        # target -> key -> [value, number of entries in the log]
+        self._values = {}
+        self._seq = 0
+        self._appended = 0
+        self._acked = 0
+        self._compactions = 0
+
+    def append(self, target, key, value):
+        self._seq += 1
+        self._appended += 1
+        log = self._logs.setdefault(target, collections.deque())
+        values = self._values.setdefault(target, {})
+        log.append((self._seq, key))
+        if key in values:
+            values[key][0] = self._merge(values[key][0], value)
+            values[key][1] += 1
+        else:
+            values[key] = [value, 1]
+        if len(log) > self._compact_ratio * len(values) + 16:
+            self._compact(target)
+
+    def get(self, key):
+        # hinted values of the key for all targets
+        return [values[key][0] for values in self._values.values() if key in values]
+
+    def batch(self, target, limit):
+        # oldest keys of the target with their values and the sequence number acknowledging them
+        records = {}
+        seq = None
+        values = self._values.get(target, {})
+        for entry_seq, key in self._logs.get(target, ()):
+            if key not in records:
+                if len(records) == limit:
+                    break
+                records[key] = values[key][0]
+            seq = entry_seq
+        return seq, records
+
+    def ack(self, target, seq):
+        log = self._logs.get(target)
+        if log is None:
+            return
+        values = self._values[target]
+        while len(log) > 0 and log[0][0] <= seq:
+            _, key = log.popleft()
+            values[key][1] -= 1
+            if values[key][1] == 0:
+                del values[key]
+                self._acked += 1
+        if len(log) == 0:
+            del self._logs[target]
+            del self._values[target]
+
+    def drop(self, target):
+        # removes all hints of the target, e.g. when it leaves, and returns their values
+        self._logs.pop(target, None)
+        return {key: value for key, (value, _) in self._values.pop(target, {}).items()}
+
+    def targets(self):
+        return list(self._logs)
+
+    def backlog(self):
+        # number of keys waiting for each target
+        return {target: len(values) for target, values in self._values.items()}
+
+    def stats(self):
+        return {'appended': self._appended, 'acked': self._acked, 'compactions': self._compactions,
+                'log_entries': sum(len(log) for log in self._logs.values()), 'keys': len(self)}
+
+    def _compact(self, target):
+        values = self._values[target]
+        latest = {key: seq for seq, key in self._logs[target]}
+        self._logs[target] = collections.deque(sorted((seq, key) for key, seq in latest.items()))
+        for key in values:
+            values[key][1] = 1
+        self._compactions += 1
+
+    def __len__(self):
+        return sum(len(values) for values in self._values.values())
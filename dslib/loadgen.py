@@ -0,0 +1,341 @@
+import bisect
+import itertools
+import logging
+import string
+import time
+from collections import defaultdict
+
+from .message import Message
+from .stats import percentile
+from .test_server import TestServer
+
+
+def random_str(rng, length=8, weights=None):
+    return ''.join(rng.choices(string.ascii_lowercase, weights=weights, k=length))
+
+
+def skewed_alphabet_weights(rng):
+    # the skewed letter weights used by kv tests to produce keys clustered in the hash space
+    weights = [rng.randint(0, i ^ 2) for i in range(len(string.ascii_lowercase))]
+    rng.shuffle(weights)
+    return weights
+
+
+def make_keys(rng, count, length=8, weights=None):
+    # `count` unique random keys, letters are drawn with given weights
+    keys = set()
+    while len(keys) < count:
+        keys.add(random_str(rng, length, weights))
+    keys = sorted(keys)
+    rng.shuffle(keys)
+    return keys
+
+
+class KeyDistribution:
+    # chooses request keys from a fixed key space, 'uniform' or 'zipf' where the key of rank k
+    # (in the order of keys) is popular proportionally to 1 / k^s
+
+    def __init__(self, keys, distribution='uniform', s=1.0):
+        if len(keys) == 0:
+            raise ValueError("key space is empty")
+        if distribution == 'uniform':
+            weights = None
+        elif distribution == 'zipf':
+            weights = [1 / (k ** s) for k in range(1, len(keys) + 1)]
+        else:
+            raise ValueError("unknown key distribution: %s" % distribution)
+        self._keys = list(keys)
+        self._distribution = distribution
+        self._cum_weights = list(itertools.accumulate(weights)) if weights is not None else None
+
+    @property
+    def keys(self):
+        return self._keys
+
+    @property
+    def distribution(self):
+        return self._distribution
+
+    def choose(self, rng):
+        if self._cum_weights is None:
+            return self._keys[rng.randrange(len(self._keys))]
+        x = rng.random() * self._cum_weights[-1]
+        return self._keys[bisect.bisect_right(self._cum_weights, x)]
+
+
+class ShardingApi:
+    # requests of the kv-sharding node API
+
+    operations = ('GET', 'PUT', 'DELETE')
+
+    def request(self, op, key, value=None):
+        if op == 'PUT':
+            return Message('PUT', '%s=%s' % (key, value))
+        return Message(op, key)
+
+    def is_reply(self, op, message):
+        return message.type == op + '_RESP'
+
+
+class ReplicationApi:
+    # requests of the kv-replication node API, writes are issued without metadata
+
+    operations = ('GET', 'PUT')
+
+    def __init__(self, quorum=2):
+        self._quorum = quorum
+
+    def request(self, op, key, value=None):
+        if op == 'PUT':
+            return Message('PUT', {'key': key, 'value': value, 'quorum': self._quorum})
+        if op == 'GET':
+            return Message('GET', {'key': key, 'quorum': self._quorum})
+        raise ValueError("unsupported operation: %s" % op)
+
+    def is_reply(self, op, message):
+        return message.type == op + '_RESP'
+
+
+def preload(ts, nodes, api, keys, value_length=8, timeout=1, batch_size=1000):
+    # stores a value for every key through randomly chosen nodes using pipelined
+    # batches of local messages, returns the number of failed writes
+    failed = 0
+    for i in range(0, len(keys), batch_size):
+        batch = [(ts.random.choice(nodes), api.request('PUT', key, random_str(ts.random, value_length)))
+                 for key in keys[i:i + batch_size]]
+        pending = ts.send_local_messages(batch, timeout + len(batch) / 1000)
+        ts.step_until_resolved(pending, timeout + len(batch) / 100)
+        for future in pending:
+            if not future.done() or future.exception() is not None or not api.is_reply('PUT', future.result()):
+                failed += 1
+    return failed
+
+
+def parse_mix(spec):
+    # "GET=0.8,PUT=0.2" -> {'GET': 0.8, 'PUT': 0.2}
+    mix = {}
+    for part in spec.split(','):
+        op, weight = part.split('=')
+        mix[op.strip().upper()] = float(weight)
+    return mix
+
+
+class _Client:
+    __slots__ = ('id', 'node', 'next_send', 'op', 'key', 'sent', 'future')
+
+    def __init__(self, client_id, node, next_send):
+        self.id = client_id
+        self.node = node
+        self.next_send = next_send
+        self.op = None
+        self.sent = None
+        self.future = None
+
+
+class LoadGenerator:
+    # drives kv nodes through the test server by closed-loop clients (or paced open-loop with rate),
+    # replies are matched by request ids, latencies are measured by the test server clock
+
+    def __init__(self, ts, nodes, api, keys, clients=1, mix=None, rate=None,
+                 request_timeout=1, step_timeout=1, value_length=8):
+        if mix is None:
+            mix = {'GET': 0.8, 'PUT': 0.2}
+        for op in mix:
+            if op not in api.operations:
+                raise ValueError("operation %s is not supported by the API" % op)
+        self._ts = ts
+        self._nodes = list(nodes)
+        self._api = api
+        self._keys = keys
+        self._clients_count = clients
+        self._ops = list(mix)
+        self._op_weights = list(itertools.accumulate(mix[op] for op in self._ops))
+        self._rate = rate
+        self._request_timeout = request_timeout
+        self._step_timeout = step_timeout
+        self._value_length = value_length
+
+    def run(self, duration):
+        ts = self._ts
+        rng = ts.random
+        start = ts.now()
+        end = start + duration
+        # with target rate client starts are spread over the first interval
+        interval = self._clients_count / self._rate if self._rate else 0
+        clients = [_Client(i, self._nodes[i % len(self._nodes)], start + interval * i / self._clients_count)
+                   for i in range(self._clients_count)]
+        latencies = defaultdict(list)
+        counters = defaultdict(lambda: defaultdict(int))
+        other = defaultdict(int)
+        wall_start = time.time()
+
+        while True:
+            now = ts.now()
+            if now >= end and all(client.op is None for client in clients):
+                break
+
+            # send requests of clients which are due
+            running = set(ts.running_processes())
+            for client in clients:
+                if client.op is not None or client.next_send > now or now >= end:
+                    continue
+                if client.node not in running:
+                    continue
+                client.op = self._ops[bisect.bisect_right(self._op_weights, rng.random() * self._op_weights[-1])]
+                client.key = self._keys.choose(rng)
+                value = random_str(rng, self._value_length) if client.op == 'PUT' else None
+                client.sent = now
+                counters[client.op]['sent'] += 1
+                request = self._api.request(client.op, client.key, value)
+                client.future = ts.send_local_messages([(client.node, request)], self._step_timeout)[0]
+
+            # collect replies, replies without request ids which match no pending request are counted
+            for node in running:
+                unexpected = ts.drain_local_messages(node)
+                if len(unexpected) > 0:
+                    other['unexpected_replies'] += len(unexpected)
+            for client in clients:
+                if client.op is None:
+                    continue
+                if client.future.done():
+                    message = client.future.result() if client.future.exception() is None else None
+                    if message is not None and self._api.is_reply(client.op, message):
+                        latencies[client.op].append(now - client.sent)
+                        counters[client.op]['ok'] += 1
+                    else:
+                        logging.debug("loadgen: unexpected reply to %s %s from %s: %s",
+                                      client.op, client.key, client.node, message)
+                        counters[client.op]['errors'] += 1
+                    self._complete(client, interval, now)
+                elif now - client.sent >= self._request_timeout:
+                    # a late reply resolves the abandoned future and is not taken for the next one
+                    counters[client.op]['timeouts'] += 1
+                    self._complete(client, interval, now)
+
+            # advance to the next event or to the moment when something is due,
+            # events are stepped one by one to observe replies as soon as they appear
+            deadlines = [client.sent + self._request_timeout for client in clients if client.op is not None]
+            deadlines += [max(client.next_send, now) for client in clients
+                          if client.op is None and client.node in running]
+            deadline = min(deadlines + [max(end, now)])
+            next_time = ts.next_event_time()
+            if next_time is not None and next_time <= deadline:
+                if not ts.step(self._step_timeout):
+                    other['step_timeouts'] += 1
+            elif deadline > now:
+                ts.step_until_time(deadline, self._step_timeout)
+            elif all(client.op is None for client in clients) and now >= end:
+                break
+
+        return LoadReport(ts.now() - start, time.time() - wall_start, counters, latencies, other)
+
+    def _complete(self, client, interval, now):
+        client.op = None
+        client.future = None
+        client.next_send = max(client.next_send + interval, now) if interval else now
+
+
+class LoadReport:
+    # throughput and latency percentiles per operation type
+
+    def __init__(self, elapsed, wall_time, counters, latencies, other=None):
+        self._elapsed = elapsed
+        self._wall_time = wall_time
+        self._counters = counters
+        self._latencies = latencies
+        self._other = dict(other or {})
+
+    @property
+    def elapsed(self):
+        return self._elapsed
+
+    def to_dict(self):
+        span = self._elapsed or 1
+        ops = {}
+        for op, counters in sorted(self._counters.items()):
+            latencies = self._latencies.get(op, [])
+            stats = dict(counters)
+            stats['throughput'] = counters['ok'] / span if 'ok' in counters else 0
+            for p in (50, 95, 99):
+                value = percentile(latencies, p)
+                stats['latency_p%d_ms' % p] = value * 1000 if value is not None else None
+            ops[op] = stats
+        return {'elapsed': self._elapsed, 'wall_time': self._wall_time, 'operations': ops, 'other': self._other}
+
+    def __str__(self):
+        report = self.to_dict()
+        lines = ["%.1fs of test time (%.1fs wall time)" % (report['elapsed'], report['wall_time']),
+                 "  %-8s %8s %8s %8s %8s %10s %10s %10s %10s" % (
+                     'op', 'sent', 'ok', 'errors', 'timeouts', 'ops/s', 'p50 ms', 'p95 ms', 'p99 ms')]
+        for op, stats in report['operations'].items():
+            lines.append("  %-8s %8d %8d %8d %8d %10.1f %10s %10s %10s" % (
+                op, stats['sent'], stats.get('ok', 0), stats.get('errors', 0), stats.get('timeouts', 0),
+                stats['throughput'],
+                *('-' if stats[k] is None else '%.1f' % stats[k]
+                  for k in ('latency_p50_ms', 'latency_p95_ms', 'latency_p99_ms'))))
+        if len(report['other']) > 0:
+            lines.append("  " + ", ".join("%s: %d" % item for item in sorted(report['other'].items())))
+        return '\n'.join(lines)
+
+
+def add_load_arguments(parser, mix):
+    # options of load runs shared by harnesses of key-value storages, mix is the default operation weights
+    parser.add_argument('--load', type=float, metavar='SECONDS',
+                        help="instead of tests run client load against the cluster for given time")
+    parser.add_argument('-n', dest='node_count', type=int, default=5,
+                        help="number of nodes for load run")
+    parser.add_argument('--clients', type=int, default=5,
+                        help="number of concurrent clients")
+    parser.add_argument('--rate', type=float,
+                        help="target request rate per second, by default clients send requests back to back")
+    parser.add_argument('--mix', default=mix,
+                        help="operation weights")
+    parser.add_argument('--keys', type=int, default=1000,
+                        help="number of keys")
+    parser.add_argument('--key-dist', choices=['uniform', 'zipf'], default='uniform',
+                        help="popularity of keys")
+    parser.add_argument('--zipf-s', type=float, default=1.0,
+                        help="exponent of zipf distribution")
+    parser.add_argument('--skewed-keys', action='store_true',
+                        help="draw key letters with skewed weights as tests do")
+    parser.add_argument('--warmup', type=float, default=5,
+                        help="seconds to let nodes join before the load")
+
+
+def run_load(args, start_node, api, ts_addr):
+    # starts args.node_count nodes with start_node(name, addr) returning their processes,
+    # joins them into a cluster, preloads the keys and runs the load for args.load seconds
+    ts = TestServer(ts_addr)
+    ts.start()
+    nodes = ['node%02d' % (i+1) for i in range(args.node_count)]
+    processes = []
+    try:
+        for i, node in enumerate(nodes):
+            processes.append(start_node(node, '127.0.0.1:%d' % (9701 + i)))
+        if not ts.wait_processes(len(nodes), len(nodes)):
+            logging.error("Startup timeout")
+            return 1
+        seed_addr = ts.get_process_addr(nodes[0])
+        for node in nodes:
+            ts.send_local_message(node, Message('JOIN', seed_addr))
+        ts.step_until_time(ts.now() + args.warmup, 1)
+
+        weights = skewed_alphabet_weights(ts.random) if args.skewed_keys else None
+        keys = make_keys(ts.random, args.keys, weights=weights)
+        failed = preload(ts, nodes, api, keys)
+        if failed > 0:
+            logging.warning("%d of %d keys were not stored", failed, len(keys))
+        generator = LoadGenerator(
+            ts, nodes, api, KeyDistribution(keys, args.key_dist, args.zipf_s),
+            clients=args.clients, mix=parse_mix(args.mix), rate=args.rate)
+        report = generator.run(args.load)
+        logging.info("load finished: %s", report)
+    finally:
+        for process in processes:
+            process.terminate()
+        ts.stop(wait_processes=False)
+        for process in processes:
+            try:
+                process.kill()
+            except OSError:
+                pass
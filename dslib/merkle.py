@@ -0,0 +1,61 @@
+from .ring import TOKEN_BITS, hash_key
+
+
+class MerkleTree:
+    # merkle tree over 2**depth equal token ranges of keys, node hashes are XOR of record hashes
+    # below them, so updates are incremental and replicas descend only into differing children
+
+    def __init__(self, depth=10):
+        self._depth = depth
+        # levels[0] is the root, levels[depth] are leaves
+        self._levels = [[0] * (1 << level) for level in range(depth + 1)]
+        # leaf -> key -> hash of the record
+        self._leaves = {}
+
+    @property
+    def depth(self):
+        return self._depth
+
+    def root(self):
+        return self._levels[0][0]
+
+    def leaf(self, key):
+        return hash_key(key) >> (TOKEN_BITS - self._depth)
+
+    def set(self, key, digest):
+        # digest is a string describing the contents of the record, None removes the record
+        leaf = self.leaf(key)
+        records = self._leaves.setdefault(leaf, {})
+        old = records.pop(key, 0)
+        new = hash_key(key + '\0' + digest) if digest is not None else 0
+        if new != 0:
+            records[key] = new
+        elif len(records) == 0:
+            del self._leaves[leaf]
+        change = old ^ new
+        if change == 0:
+            return
+        index = leaf
+        for level in range(self._depth, -1, -1):
+            self._levels[level][index] ^= change
+            index >>= 1
+
+    def remove(self, key):
+        self.set(key, None)
+
+    def hash(self, level, index):
+        return self._levels[level][index]
+
+    def children(self, level, indexes):
+        # hashes of children of the given nodes as [index, hash] pairs
+        return [[child, self._levels[level + 1][child]] for i in indexes for child in (2 * i, 2 * i + 1)]
+
+    def differ(self, level, hashes):
+        # indexes of nodes at the level whose hashes differ from the given [index, hash] pairs
+        return [index for index, value in hashes if self._levels[level][index] != value]
+
+    def keys(self, leaves):
+        return [key for leaf in leaves for key in self._leaves.get(leaf, ())]
+
+    def __len__(self):
+        return sum(len(records) for records in self._leaves.values())
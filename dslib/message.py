@@ -1,6 +1,11 @@
 import json
 
 
+# header of local requests sent by the test server, replies carry it back
+# so that pipelined requests are matched to their replies
+REQUEST_ID = 'request_id'
+
+
 class Message:
 
     def __init__(self, message_type, body=None, headers=None, sender=None, message_id=None):
@@ -26,6 +31,10 @@ class Message:
     def sender(self):
         return self._sender
 
+    @property
+    def request_id(self):
+        return self._headers.get(REQUEST_ID) if self._headers is not None else None
+
     def is_local(self):
         return self._sender is not None and self._sender == 'local'
 
@@ -46,6 +55,18 @@ class Message:
             message['id'] = self._id
         return json.dumps(message).encode('utf-8')
 
+    def with_request_id(self, request_id):
+        # copy of the message with the id of the local request it replies to
+        headers = dict(self._headers or {})
+        headers[REQUEST_ID] = request_id
+        return Message(self._type, self._body, headers, self._sender, self._id)
+
+    def without_request_id(self):
+        if self.request_id is None:
+            return self
+        headers = {k: v for k, v in self._headers.items() if k != REQUEST_ID}
+        return Message(self._type, self._body, headers or None, self._sender, self._id)
+
     @staticmethod
     def unmarshall(raw_bytes):
         message = json.loads(raw_bytes.decode('utf-8'))
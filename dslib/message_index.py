@@ -0,0 +1,128 @@
+import threading
+from collections import OrderedDict
+
+
+class MessageState:
+    PENDING = 'pending'
+    DELIVERED = 'delivered'
+    DROPPED = 'dropped'
+    DISCARDED = 'discarded'
+
+
+class MessageIndex:
+    # messages seen by the test server by id, raw bytes are kept only while a message is pending,
+    # bounded in entries and pending bytes (least recently updated are evicted), all operations are locked
+
+    def __init__(self, max_entries=100000, max_bytes=64 * 2**20):
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {
+            'added': 0,
+            'duplicate_ids': 0,
+            'delivered': 0,
+            'redelivered': 0,
+            'dropped': 0,
+            'discarded': 0,
+            'evicted': 0,
+            'evicted_pending': 0,
+        }
+
+    def add(self, message_id, raw_message, sender=None):
+        # returns False if the id was already seen
+        with self._lock:
+            if message_id in self._entries:
+                self._counters['duplicate_ids'] += 1
+                return False
+            self._entries[message_id] = [MessageState.PENDING, raw_message, sender]
+            self._bytes += len(raw_message)
+            self._counters['added'] += 1
+            self._evict()
+            return True
+
+    def get(self, message_id):
+        # returns raw bytes of a pending message
+        with self._lock:
+            entry = self._entries.get(message_id)
+            if entry is None:
+                return None
+            return entry[1]
+
+    def state(self, message_id):
+        with self._lock:
+            entry = self._entries.get(message_id)
+            if entry is None:
+                return None
+            return entry[0]
+
+    def mark_delivered(self, message_id):
+        with self._lock:
+            entry = self._entries.get(message_id)
+            if entry is not None and entry[0] == MessageState.DELIVERED:
+                self._counters['redelivered'] += 1
+            self._finish(message_id, MessageState.DELIVERED)
+
+    def mark_dropped(self, message_id):
+        with self._lock:
+            self._finish(message_id, MessageState.DROPPED)
+
+    def mark_discarded(self, message_id):
+        with self._lock:
+            self._finish(message_id, MessageState.DISCARDED)
+
+    def forget_sender(self, sender):
+        # message ids come from counters of the sender, which start over when it restarts,
+        # so its old entries are removed not to be taken for duplicates of new messages
+        with self._lock:
+            for message_id in [i for i, entry in self._entries.items() if entry[2] == sender]:
+                _, raw_message, _ = self._entries.pop(message_id)
+                if raw_message is not None:
+                    self._bytes -= len(raw_message)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['entries'] = len(self._entries)
+            stats['pending'] = sum(1 for entry in self._entries.values() if entry[0] == MessageState.PENDING)
+            stats['pending_bytes'] = self._bytes
+        return stats
+
+    def copy(self):
+        index = MessageIndex(self._max_entries, self._max_bytes)
+        with self._lock:
+            index._entries = OrderedDict((message_id, list(entry)) for message_id, entry in self._entries.items())
+            index._bytes = self._bytes
+            index._counters = dict(self._counters)
+        return index
+
+    def __contains__(self, message_id):
+        with self._lock:
+            return message_id in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def _finish(self, message_id, state):
+        entry = self._entries.get(message_id)
+        if entry is None:
+            # evicted or unknown, still count the outcome
+            self._counters[state] += 1
+            return
+        if entry[1] is not None:
+            self._bytes -= len(entry[1])
+        if entry[0] != MessageState.DELIVERED or state != MessageState.DELIVERED:
+            self._counters[state] += 1
+        entry[0] = state
+        entry[1] = None
+        self._entries.move_to_end(message_id)
+
+    def _evict(self):
+        while len(self._entries) > self._max_entries or self._bytes > self._max_bytes:
+            _, (state, raw_message, _) = self._entries.popitem(last=False)
+            self._counters['evicted'] += 1
+            if state == MessageState.PENDING:
+                self._counters['evicted_pending'] += 1
+                self._bytes -= len(raw_message)
@@ -0,0 +1,139 @@
+import re
+
+
+def parse_time(value):
+    # accepts seconds as number or strings like "2s", "500ms"
+    if isinstance(value, str):
+        value = value.strip()
+        if value.endswith('ms'):
+            return float(value[:-2]) / 1000
+        if value.endswith('s'):
+            return float(value[:-1])
+    return float(value)
+
+
+def parse_rate(value):
+    # accepts rates as number or strings like "20%"
+    if isinstance(value, str) and value.strip().endswith('%'):
+        return float(value.strip()[:-1]) / 100
+    return float(value)
+
+
+# units are case-sensitive: B is a byte, b or bit is a bit
+_BANDWIDTH_PREFIXES = {'': 1, 'k': 1e3, 'K': 1e3, 'M': 1e6, 'G': 1e9}
+_BANDWIDTH_UNITS = {'B/s': 1, 'b/s': 1 / 8, 'bit/s': 1 / 8}
+
+
+def parse_bandwidth(value):
+    # accepts bytes per second as number or strings like "10MB/s", "100Mb/s", "100Mbit/s"
+    if isinstance(value, str):
+        match = re.match(r'^\s*([0-9.]+)\s*([kKMG]?)(B/s|b/s|bit/s)\s*$', value)
+        if match is None:
+            raise ValueError("bad bandwidth: %s" % value)
+        return float(match.group(1)) * _BANDWIDTH_PREFIXES[match.group(2)] * _BANDWIDTH_UNITS[match.group(3)]
+    return float(value)
+
+
+class LinkModel:
+    # delivery of a link: latency and jitter in seconds (jitter is +-jitter for 'uniform', standard deviation
+    # for 'normal', mean of the tail for 'exponential'), bandwidth in bytes per second, loss probability
+
+    def __init__(self, latency=.1, jitter=0, distribution='uniform', bandwidth=None, loss=0):
+        if distribution not in ('uniform', 'normal', 'exponential'):
+            raise ValueError("unknown latency distribution: %s" % distribution)
+        self.latency = latency
+        self.jitter = jitter
+        self.distribution = distribution
+        self.bandwidth = bandwidth
+        self.loss = loss
+
+    def sample_latency(self, rng):
+        if self.jitter == 0:
+            return self.latency
+        if self.distribution == 'uniform':
+            delay = self.latency + rng.uniform(-self.jitter, self.jitter)
+        elif self.distribution == 'normal':
+            delay = rng.gauss(self.latency, self.jitter)
+        else:
+            delay = self.latency + rng.expovariate(1 / self.jitter)
+        return max(delay, 0)
+
+    @staticmethod
+    def from_dict(data):
+        return LinkModel(
+            latency=parse_time(data.get('latency', .1)),
+            jitter=parse_time(data.get('jitter', 0)),
+            distribution=data.get('distribution', 'uniform'),
+            bandwidth=parse_bandwidth(data['bandwidth']) if 'bandwidth' in data else None,
+            loss=parse_rate(data.get('loss', 0)))
+
+
+class NetworkModel:
+    # links are looked up for the pair of processes, then for the pair of their groups (e.g. datacenters),
+    # then the default one is used, a busy link queues messages when its bandwidth is limited
+
+    def __init__(self, default=None):
+        self._default = default if default is not None else LinkModel()
+        self._groups = {}
+        self._links = {}
+        self._group_links = {}
+        self._busy_until = {}
+
+    def set_group(self, group, processes):
+        for process_id in processes:
+            self._groups[process_id] = group
+
+    def group(self, process_id):
+        return self._groups.get(process_id)
+
+    def set_link(self, src, dst, link, symmetric=True):
+        self._links[(src, dst)] = link
+        if symmetric:
+            self._links[(dst, src)] = link
+
+    def set_group_link(self, src_group, dst_group, link, symmetric=True):
+        self._group_links[(src_group, dst_group)] = link
+        if symmetric:
+            self._group_links[(dst_group, src_group)] = link
+
+    def link(self, src, dst):
+        link = self._links.get((src, dst))
+        if link is None:
+            link = self._group_links.get((self._groups.get(src), self._groups.get(dst)))
+        if link is None:
+            link = self._default
+        return link
+
+    def delay(self, src, dst, size, send_time, rng):
+        # returns the time from sending the message to its delivery
+        if src == dst:
+            return 0
+        link = self.link(src, dst)
+        departure = send_time
+        if link.bandwidth is not None:
+            departure = max(send_time, self._busy_until.get((src, dst), send_time)) + size / link.bandwidth
+            self._busy_until[(src, dst)] = departure
+        return departure - send_time + link.sample_latency(rng)
+
+    def is_lost(self, src, dst, rng):
+        if src == dst:
+            return False
+        link = self.link(src, dst)
+        return link.loss > 0 and rng.uniform(0, 1) < link.loss
+
+    @staticmethod
+    def from_dict(data):
+        # config format is described in readme.md, link endpoints are group or process names
+        model = NetworkModel(LinkModel.from_dict(data.get('default', {})))
+        groups = data.get('groups', {})
+        for group, processes in groups.items():
+            model.set_group(group, processes)
+        for item in data.get('links', []):
+            src, dst = item['between']
+            link = LinkModel.from_dict(item)
+            symmetric = item.get('symmetric', True)
+            if src in groups and dst in groups:
+                model.set_group_link(src, dst, link, symmetric)
+            else:
+                model.set_link(src, dst, link, symmetric)
+        return model
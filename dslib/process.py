@@ -1,4 +1,5 @@
 import abc
+import pickle
 
 
 class Context(object):
@@ -13,8 +14,10 @@ class Context(object):
         pass
 
     @abc.abstractmethod
-    def send_local(self, message):
-        # type: Message -> None
+    def send_local(self, message, request_id=None):
+        # type: (Message, object) -> None
+        # replies to the local message being handled carry its request id, deferred replies
+        # should pass the id of the request (message.request_id) they answer
         pass
 
     @abc.abstractmethod
@@ -44,3 +47,19 @@ class Process:
     def on_timer(self, ctx, timer):
         # type: (Context, str) -> None
         pass
+
+    def digest(self):
+        # type: () -> object
+        # override to return a cheap JSON-serializable summary of the state (e.g. sorted members),
+        # it is reported to the test server after each handled event to detect convergence
+        return None
+
+    def snapshot(self):
+        # type: () -> bytes
+        # override if process state is not picklable or can be captured cheaper
+        return pickle.dumps(self.__dict__)
+
+    def restore(self, state):
+        # type: (bytes) -> None
+        self.__dict__.clear()
+        self.__dict__.update(pickle.loads(state))
@@ -0,0 +1,133 @@
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import defaultdict
+
+
+class _Phase:
+    __slots__ = ('_profiler', '_name', '_detail', '_start')
+
+    def __init__(self, profiler, name, detail):
+        self._profiler = profiler
+        self._name = name
+        self._detail = detail
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self._start
+        name = self._name
+        if self._detail is not None:
+            # protobuf type urls and other dotted names are shortened to the last part
+            name = "%s %s" % (name, self._detail.replace('/', '.').rsplit('.', 1)[-1])
+        self._profiler.add(name, elapsed)
+        return False
+
+
+class _NullPhase:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_PHASE = _NullPhase()
+
+
+class _ProfiledBlock:
+    __slots__ = ('_cprofile',)
+
+    def __init__(self, cprofile):
+        self._cprofile = cprofile
+
+    def __enter__(self):
+        self._cprofile.enable()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._cprofile.disable()
+        return False
+
+
+class Profiler:
+    # wall time of named phases of the test machinery, enabled by DSLIB_PROFILE (inherited by
+    # processes started from tests) or explicitly, phases may be entered from several threads
+
+    def __init__(self, enabled=None):
+        if enabled is None:
+            enabled = bool(os.environ.get('DSLIB_PROFILE'))
+        self._enabled = enabled
+        self._lock = threading.Lock()
+        self._totals = defaultdict(float)
+        self._counts = defaultdict(int)
+        self._cprofile = None
+        self._cprofile_path = None
+
+    @property
+    def enabled(self):
+        return self._enabled
+
+    def enable(self, cprofile=False, cprofile_path=None):
+        # cprofile additionally collects call statistics inside profiled() blocks,
+        # they are printed with the summary or dumped to cprofile_path for pstats/snakeviz
+        self._enabled = True
+        if cprofile or cprofile_path is not None:
+            self._cprofile = cProfile.Profile()
+            self._cprofile_path = cprofile_path
+
+    def phase(self, name, detail=None):
+        if not self._enabled:
+            return _NULL_PHASE
+        return _Phase(self, name, detail)
+
+    def profiled(self):
+        if self._cprofile is None:
+            return _NULL_PHASE
+        return _ProfiledBlock(self._cprofile)
+
+    def add(self, name, elapsed):
+        with self._lock:
+            self._totals[name] += elapsed
+            self._counts[name] += 1
+
+    def stats(self):
+        # type: () -> dict
+        with self._lock:
+            return {name: (self._counts[name], self._totals[name]) for name in self._totals}
+
+    def reset(self):
+        with self._lock:
+            self._totals.clear()
+            self._counts.clear()
+        if self._cprofile is not None:
+            self._cprofile = cProfile.Profile()
+
+    def summary(self, title):
+        stats = self.stats()
+        lines = ["%s profile:" % title, "  %-36s %10s %12s %12s" % ('phase', 'count', 'total ms', 'mean us')]
+        for name, (count, total) in sorted(stats.items(), key=lambda item: -item[1][1]):
+            lines.append("  %-36s %10d %12.1f %12.1f" % (name, count, total * 1e3, total / count * 1e6))
+        return '\n'.join(lines)
+
+    def report(self, title, out=None):
+        if not self._enabled:
+            return
+        out = out or sys.stderr
+        if len(self._totals) > 0:
+            out.write(self.summary(title) + '\n')
+        if self._cprofile is not None:
+            if self._cprofile_path is not None:
+                self._cprofile.dump_stats(self._cprofile_path)
+                out.write("%s cProfile stats saved to %s\n" % (title, self._cprofile_path))
+            else:
+                s = io.StringIO()
+                pstats.Stats(self._cprofile, stream=s).sort_stats('cumulative').print_stats(25)
+                out.write(s.getvalue())
+        out.flush()
@@ -20,7 +20,7 @@ DESCRIPTOR = _descriptor.FileDescriptor(
   syntax='proto3',
   serialized_options=None,
   create_key=_descriptor._internal_create_key,
-  serialized_pb=b'\n\x11test_server.proto\x1a\x19google/protobuf/any.proto\":\n\x13ProcessStartedEvent\x12\x12\n\nprocess_id\x18\x01 \x01(\t\x12\x0f\n\x07\x61\x64\x64ress\x18\x02 \x01(\t\"\x15\n\x13ProcessStoppedEvent\"I\n\x0fNewMessageEvent\x12\x12\n\nmessage_id\x18\x01 \x01(\t\x12\x11\n\trecepient\x18\x02 \x01(\t\x12\x0f\n\x07message\x18\x03 \x01(\x0c\"*\n\x14MessageReceivedEvent\x12\x12\n\nmessage_id\x18\x01 \x01(\t\"?\n\x18MessageDataReceivedEvent\x12\x12\n\nmessage_id\x18\x01 \x01(\t\x12\x0f\n\x07message\x18\x02 \x01(\x0c\"+\n\x15MessageProcessedEvent\x12\x12\n\nmessage_id\x18\x01 \x01(\t\"A\n\rNewTimerEvent\x12\x10\n\x08timer_id\x18\x01 \x01(\t\x12\x0c\n\x04name\x18\x02 \x01(\t\x12\x10\n\x08interval\x18\x03 \x01(\x02\"#\n\x0fTimerFiredEvent\x12\x10\n\x08timer_id\x18\x01 \x01(\t\"\'\n\x13TimerProcessedEvent\x12\x10\n\x08timer_id\x18\x01 \x01(\t\"&\n\x12TimerCanceledEvent\x12\x10\n\x08timer_id\x18\x01 \x01(\t\"-\n\x1aReceiveLocalMessageCommand\x12\x0f\n\x07message\x18\x01 \x01(\x0c\"L\n\x15ReceiveMessageCommand\x12\x12\n\nmessage_id\x18\x01 \x01(\t\x12\x0e\n\x06sender\x18\x02 \x01(\t\x12\x0f\n\x07message\x18\x03 \x01(\x0c\"$\n\x10\x46ireTimerCommand\x12\x10\n\x08timer_id\x18\x01 \x01(\t\"\x0e\n\x0c\x43rashCommand2O\n\nTestServer\x12\x41\n\rAttachProcess\x12\x14.google.protobuf.Any\x1a\x14.google.protobuf.Any\"\x00(\x01\x30\x01\x62\x06proto3'
+  serialized_pb=b'\n\x11test_server.proto\x1a\x19google/protobuf/any.proto\":\n\x13ProcessStartedEvent\x12\x12\n\nprocess_id\x18\x01 \x01(\t\x12\x0f\n\x07\x61\x64\x64ress\x18\x02 \x01(\t\"\x15\n\x13ProcessStoppedEvent\"\x81\x01\n\x0fNewMessageEvent\x12\x12\n\nmessage_id\x18\x01 \x01(\t\x12\x11\n\trecepient\x18\x02 \x01(\t\x12\x0f\n\x07message\x18\x03 \x01(\x0c\x12\x14\n\x0cmessage_type\x18\x04 \x01(\t\x12\x10\n\x08is_local\x18\x05 \x01(\x08\x12\x0e\n\x06sender\x18\x06 \x01(\t\"*\n\x14MessageReceivedEvent\x12\x12\n\nmessage_id\x18\x01 \x01(\t\"?\n\x18MessageDataReceivedEvent\x12\x12\n\nmessage_id\x18\x01 \x01(\t\x12\x0f\n\x07message\x18\x02 \x01(\x0c\";\n\x15MessageProcessedEvent\x12\x12\n\nmessage_id\x18\x01 \x01(\t\x12\x0e\n\x06\x64igest\x18\x02 \x01(\t\"A\n\rNewTimerEvent\x12\x10\n\x08timer_id\x18\x01 \x01(\t\x12\x0c\n\x04name\x18\x02 \x01(\t\x12\x10\n\x08interval\x18\x03 \x01(\x02\"#\n\x0fTimerFiredEvent\x12\x10\n\x08timer_id\x18\x01 \x01(\t\"7\n\x13TimerProcessedEvent\x12\x10\n\x08timer_id\x18\x01 \x01(\t\x12\x0e\n\x06\x64igest\x18\x02 \x01(\t\"&\n\x12TimerCanceledEvent\x12\x10\n\x08timer_id\x18\x01 \x01(\t\"G\n\x12SnapshotTakenEvent\x12\x13\n\x0bsnapshot_id\x18\x01 \x01(\t\x12\r\n\x05state\x18\x02 \x01(\x0c\x12\r\n\x05\x65rror\x18\x03 \x01(\t\"8\n\x12StateRestoredEvent\x12\x13\n\x0bsnapshot_id\x18\x01 \x01(\t\x12\r\n\x05\x65rror\x18\x02 \x01(\t\"-\n\x1aReceiveLocalMessageCommand\x12\x0f\n\x07message\x18\x01 \x01(\x0c\"L\n\x15ReceiveMessageCommand\x12\x12\n\nmessage_id\x18\x01 \x01(\t\x12\x0e\n\x06sender\x18\x02 \x01(\t\x12\x0f\n\x07message\x18\x03 \x01(\x0c\"$\n\x10\x46ireTimerCommand\x12\x10\n\x08timer_id\x18\x01 \x01(\t\"\x0e\n\x0c\x43rashCommand\"&\n\x0fSnapshotCommand\x12\x13\n\x0bsnapshot_id\x18\x01 \x01(\t\"4\n\x0eRestoreCommand\x12\x13\n\x0bsnapshot_id\x18\x01 \x01(\t\x12\r\n\x05state\x18\x02 \x01(\x0c\x32O\n\nTestServer\x12\x41\n\rAttachProcess\x12\x14.google.protobuf.Any\x1a\x14.google.protobuf.Any\"\x00(\x01\x30\x01\x62\x06proto3'
   ,
   dependencies=[google_dot_protobuf_dot_any__pb2.DESCRIPTOR,])
 
@@ -120,6 +120,27 @@ _NEWMESSAGEEVENT = _descriptor.Descriptor(
       message_type=None, enum_type=None, containing_type=None,
       is_extension=False, extension_scope=None,
       serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
+    _descriptor.FieldDescriptor(
+      name='message_type', full_name='NewMessageEvent.message_type', index=3,
+      number=4, type=9, cpp_type=9, label=1,
+      has_default_value=False, default_value=b"".decode('utf-8'),
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
+    _descriptor.FieldDescriptor(
+      name='is_local', full_name='NewMessageEvent.is_local', index=4,
+      number=5, type=8, cpp_type=7, label=1,
+      has_default_value=False, default_value=False,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
+    _descriptor.FieldDescriptor(
+      name='sender', full_name='NewMessageEvent.sender', index=5,
+      number=6, type=9, cpp_type=9, label=1,
+      has_default_value=False, default_value=b"".decode('utf-8'),
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
   ],
   extensions=[
   ],
@@ -132,8 +153,8 @@ _NEWMESSAGEEVENT = _descriptor.Descriptor(
   extension_ranges=[],
   oneofs=[
   ],
-  serialized_start=131,
-  serialized_end=204,
+  serialized_start=132,
+  serialized_end=261,
 )
 
 
@@ -164,8 +185,8 @@ _MESSAGERECEIVEDEVENT = _descriptor.Descriptor(
   extension_ranges=[],
   oneofs=[
   ],
-  serialized_start=206,
-  serialized_end=248,
+  serialized_start=263,
+  serialized_end=305,
 )
 
 
@@ -203,8 +224,8 @@ _MESSAGEDATARECEIVEDEVENT = _descriptor.Descriptor(
   extension_ranges=[],
   oneofs=[
   ],
-  serialized_start=250,
-  serialized_end=313,
+  serialized_start=307,
+  serialized_end=370,
 )
 
 
@@ -223,6 +244,13 @@ _MESSAGEPROCESSEDEVENT = _descriptor.Descriptor(
       message_type=None, enum_type=None, containing_type=None,
       is_extension=False, extension_scope=None,
       serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
+    _descriptor.FieldDescriptor(
+      name='digest', full_name='MessageProcessedEvent.digest', index=1,
+      number=2, type=9, cpp_type=9, label=1,
+      has_default_value=False, default_value=b"".decode('utf-8'),
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
   ],
   extensions=[
   ],
@@ -235,8 +263,8 @@ _MESSAGEPROCESSEDEVENT = _descriptor.Descriptor(
   extension_ranges=[],
   oneofs=[
   ],
-  serialized_start=315,
-  serialized_end=358,
+  serialized_start=372,
+  serialized_end=431,
 )
 
 
@@ -281,8 +309,8 @@ _NEWTIMEREVENT = _descriptor.Descriptor(
   extension_ranges=[],
   oneofs=[
   ],
-  serialized_start=360,
-  serialized_end=425,
+  serialized_start=433,
+  serialized_end=498,
 )
 
 
@@ -313,8 +341,8 @@ _TIMERFIREDEVENT = _descriptor.Descriptor(
   extension_ranges=[],
   oneofs=[
   ],
-  serialized_start=427,
-  serialized_end=462,
+  serialized_start=500,
+  serialized_end=535,
 )
 
 
@@ -333,6 +361,13 @@ _TIMERPROCESSEDEVENT = _descriptor.Descriptor(
       message_type=None, enum_type=None, containing_type=None,
       is_extension=False, extension_scope=None,
       serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
+    _descriptor.FieldDescriptor(
+      name='digest', full_name='TimerProcessedEvent.digest', index=1,
+      number=2, type=9, cpp_type=9, label=1,
+      has_default_value=False, default_value=b"".decode('utf-8'),
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
   ],
   extensions=[
   ],
@@ -345,8 +380,8 @@ _TIMERPROCESSEDEVENT = _descriptor.Descriptor(
   extension_ranges=[],
   oneofs=[
   ],
-  serialized_start=464,
-  serialized_end=503,
+  serialized_start=537,
+  serialized_end=592,
 )
 
 
@@ -377,8 +412,93 @@ _TIMERCANCELEDEVENT = _descriptor.Descriptor(
   extension_ranges=[],
   oneofs=[
   ],
-  serialized_start=505,
-  serialized_end=543,
+  serialized_start=594,
+  serialized_end=632,
+)
+
+
+_SNAPSHOTTAKENEVENT = _descriptor.Descriptor(
+  name='SnapshotTakenEvent',
+  full_name='SnapshotTakenEvent',
+  filename=None,
+  file=DESCRIPTOR,
+  containing_type=None,
+  create_key=_descriptor._internal_create_key,
+  fields=[
+    _descriptor.FieldDescriptor(
+      name='snapshot_id', full_name='SnapshotTakenEvent.snapshot_id', index=0,
+      number=1, type=9, cpp_type=9, label=1,
+      has_default_value=False, default_value=b"".decode('utf-8'),
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
+    _descriptor.FieldDescriptor(
+      name='state', full_name='SnapshotTakenEvent.state', index=1,
+      number=2, type=12, cpp_type=9, label=1,
+      has_default_value=False, default_value=b"",
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
+    _descriptor.FieldDescriptor(
+      name='error', full_name='SnapshotTakenEvent.error', index=2,
+      number=3, type=9, cpp_type=9, label=1,
+      has_default_value=False, default_value=b"".decode('utf-8'),
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
+  ],
+  extensions=[
+  ],
+  nested_types=[],
+  enum_types=[
+  ],
+  serialized_options=None,
+  is_extendable=False,
+  syntax='proto3',
+  extension_ranges=[],
+  oneofs=[
+  ],
+  serialized_start=634,
+  serialized_end=705,
+)
+
+
+_STATERESTOREDEVENT = _descriptor.Descriptor(
+  name='StateRestoredEvent',
+  full_name='StateRestoredEvent',
+  filename=None,
+  file=DESCRIPTOR,
+  containing_type=None,
+  create_key=_descriptor._internal_create_key,
+  fields=[
+    _descriptor.FieldDescriptor(
+      name='snapshot_id', full_name='StateRestoredEvent.snapshot_id', index=0,
+      number=1, type=9, cpp_type=9, label=1,
+      has_default_value=False, default_value=b"".decode('utf-8'),
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
+    _descriptor.FieldDescriptor(
+      name='error', full_name='StateRestoredEvent.error', index=1,
+      number=2, type=9, cpp_type=9, label=1,
+      has_default_value=False, default_value=b"".decode('utf-8'),
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
+  ],
+  extensions=[
+  ],
+  nested_types=[],
+  enum_types=[
+  ],
+  serialized_options=None,
+  is_extendable=False,
+  syntax='proto3',
+  extension_ranges=[],
+  oneofs=[
+  ],
+  serialized_start=707,
+  serialized_end=763,
 )
 
 
@@ -409,8 +529,8 @@ _RECEIVELOCALMESSAGECOMMAND = _descriptor.Descriptor(
   extension_ranges=[],
   oneofs=[
   ],
-  serialized_start=545,
-  serialized_end=590,
+  serialized_start=765,
+  serialized_end=810,
 )
 
 
@@ -455,8 +575,8 @@ _RECEIVEMESSAGECOMMAND = _descriptor.Descriptor(
   extension_ranges=[],
   oneofs=[
   ],
-  serialized_start=592,
-  serialized_end=668,
+  serialized_start=812,
+  serialized_end=888,
 )
 
 
@@ -487,8 +607,8 @@ _FIRETIMERCOMMAND = _descriptor.Descriptor(
   extension_ranges=[],
   oneofs=[
   ],
-  serialized_start=670,
-  serialized_end=706,
+  serialized_start=890,
+  serialized_end=926,
 )
 
 
@@ -512,8 +632,79 @@ _CRASHCOMMAND = _descriptor.Descriptor(
   extension_ranges=[],
   oneofs=[
   ],
-  serialized_start=708,
-  serialized_end=722,
+  serialized_start=928,
+  serialized_end=942,
+)
+
+
+_SNAPSHOTCOMMAND = _descriptor.Descriptor(
+  name='SnapshotCommand',
+  full_name='SnapshotCommand',
+  filename=None,
+  file=DESCRIPTOR,
+  containing_type=None,
+  create_key=_descriptor._internal_create_key,
+  fields=[
+    _descriptor.FieldDescriptor(
+      name='snapshot_id', full_name='SnapshotCommand.snapshot_id', index=0,
+      number=1, type=9, cpp_type=9, label=1,
+      has_default_value=False, default_value=b"".decode('utf-8'),
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
+  ],
+  extensions=[
+  ],
+  nested_types=[],
+  enum_types=[
+  ],
+  serialized_options=None,
+  is_extendable=False,
+  syntax='proto3',
+  extension_ranges=[],
+  oneofs=[
+  ],
+  serialized_start=944,
+  serialized_end=982,
+)
+
+
+_RESTORECOMMAND = _descriptor.Descriptor(
+  name='RestoreCommand',
+  full_name='RestoreCommand',
+  filename=None,
+  file=DESCRIPTOR,
+  containing_type=None,
+  create_key=_descriptor._internal_create_key,
+  fields=[
+    _descriptor.FieldDescriptor(
+      name='snapshot_id', full_name='RestoreCommand.snapshot_id', index=0,
+      number=1, type=9, cpp_type=9, label=1,
+      has_default_value=False, default_value=b"".decode('utf-8'),
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
+    _descriptor.FieldDescriptor(
+      name='state', full_name='RestoreCommand.state', index=1,
+      number=2, type=12, cpp_type=9, label=1,
+      has_default_value=False, default_value=b"",
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
+  ],
+  extensions=[
+  ],
+  nested_types=[],
+  enum_types=[
+  ],
+  serialized_options=None,
+  is_extendable=False,
+  syntax='proto3',
+  extension_ranges=[],
+  oneofs=[
+  ],
+  serialized_start=984,
+  serialized_end=1036,
 )
 
 DESCRIPTOR.message_types_by_name['ProcessStartedEvent'] = _PROCESSSTARTEDEVENT
@@ -526,10 +717,14 @@ DESCRIPTOR.message_types_by_name['NewTimerEvent'] = _NEWTIMEREVENT
 DESCRIPTOR.message_types_by_name['TimerFiredEvent'] = _TIMERFIREDEVENT
 DESCRIPTOR.message_types_by_name['TimerProcessedEvent'] = _TIMERPROCESSEDEVENT
 DESCRIPTOR.message_types_by_name['TimerCanceledEvent'] = _TIMERCANCELEDEVENT
+DESCRIPTOR.message_types_by_name['SnapshotTakenEvent'] = _SNAPSHOTTAKENEVENT
+DESCRIPTOR.message_types_by_name['StateRestoredEvent'] = _STATERESTOREDEVENT
 DESCRIPTOR.message_types_by_name['ReceiveLocalMessageCommand'] = _RECEIVELOCALMESSAGECOMMAND
 DESCRIPTOR.message_types_by_name['ReceiveMessageCommand'] = _RECEIVEMESSAGECOMMAND
 DESCRIPTOR.message_types_by_name['FireTimerCommand'] = _FIRETIMERCOMMAND
 DESCRIPTOR.message_types_by_name['CrashCommand'] = _CRASHCOMMAND
+DESCRIPTOR.message_types_by_name['SnapshotCommand'] = _SNAPSHOTCOMMAND
+DESCRIPTOR.message_types_by_name['RestoreCommand'] = _RESTORECOMMAND
 _sym_db.RegisterFileDescriptor(DESCRIPTOR)
 
 ProcessStartedEvent = _reflection.GeneratedProtocolMessageType('ProcessStartedEvent', (_message.Message,), {
@@ -602,6 +797,20 @@ TimerCanceledEvent = _reflection.GeneratedProtocolMessageType('TimerCanceledEven
   })
 _sym_db.RegisterMessage(TimerCanceledEvent)
 
+SnapshotTakenEvent = _reflection.GeneratedProtocolMessageType('SnapshotTakenEvent', (_message.Message,), {
+  'DESCRIPTOR' : _SNAPSHOTTAKENEVENT,
+  '__module__' : 'test_server_pb2'
+  # @@protoc_insertion_point(class_scope:SnapshotTakenEvent)
+  })
+_sym_db.RegisterMessage(SnapshotTakenEvent)
+
+StateRestoredEvent = _reflection.GeneratedProtocolMessageType('StateRestoredEvent', (_message.Message,), {
+  'DESCRIPTOR' : _STATERESTOREDEVENT,
+  '__module__' : 'test_server_pb2'
+  # @@protoc_insertion_point(class_scope:StateRestoredEvent)
+  })
+_sym_db.RegisterMessage(StateRestoredEvent)
+
 ReceiveLocalMessageCommand = _reflection.GeneratedProtocolMessageType('ReceiveLocalMessageCommand', (_message.Message,), {
   'DESCRIPTOR' : _RECEIVELOCALMESSAGECOMMAND,
   '__module__' : 'test_server_pb2'
@@ -630,6 +839,20 @@ CrashCommand = _reflection.GeneratedProtocolMessageType('CrashCommand', (_messag
   })
 _sym_db.RegisterMessage(CrashCommand)
 
+SnapshotCommand = _reflection.GeneratedProtocolMessageType('SnapshotCommand', (_message.Message,), {
+  'DESCRIPTOR' : _SNAPSHOTCOMMAND,
+  '__module__' : 'test_server_pb2'
+  # @@protoc_insertion_point(class_scope:SnapshotCommand)
+  })
+_sym_db.RegisterMessage(SnapshotCommand)
+
+RestoreCommand = _reflection.GeneratedProtocolMessageType('RestoreCommand', (_message.Message,), {
+  'DESCRIPTOR' : _RESTORECOMMAND,
+  '__module__' : 'test_server_pb2'
+  # @@protoc_insertion_point(class_scope:RestoreCommand)
+  })
+_sym_db.RegisterMessage(RestoreCommand)
+
 
 
 _TESTSERVER = _descriptor.ServiceDescriptor(
@@ -639,8 +862,8 @@ _TESTSERVER = _descriptor.ServiceDescriptor(
   index=0,
   serialized_options=None,
   create_key=_descriptor._internal_create_key,
-  serialized_start=724,
-  serialized_end=803,
+  serialized_start=1038,
+  serialized_end=1117,
   methods=[
   _descriptor.MethodDescriptor(
     name='AttachProcess',
@@ -0,0 +1,384 @@
+import bisect
+import hashlib
+import math
+from collections import namedtuple
+
+
+TOKEN_BITS = 64
+RING_SIZE = 2 ** TOKEN_BITS
+_MASK = RING_SIZE - 1
+
+
+def hash_key(key):
+    # stable across processes, unlike the builtin hash() of strings
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+
+def _mix(x):
+    # splitmix64 finalizer, much cheaper than md5 for combining already hashed values
+    x = ((x ^ (x >> 30)) * 0xbf58476d1ce4e5b9) & _MASK
+    x = ((x ^ (x >> 27)) * 0x94d049bb133111eb) & _MASK
+    return x ^ (x >> 31)
+
+
+class Range(namedtuple('Range', ['start', 'end', 'source', 'target'])):
+    # tokens in (start, end] on the ring moved from source to target member, start >= end wraps
+    # around zero, source is None for an empty ring and target is None when the last member leaves
+
+    __slots__ = ()
+
+    def contains(self, token):
+        if self.start < self.end:
+            return self.start < token <= self.end
+        return token > self.start or token <= self.end
+
+
+class HashRing:
+    # consistent hash ring with vnodes * weight tokens per member in a sorted array,
+    # membership changes return the ranges of tokens which changed their owner
+
+    def __init__(self, vnodes=128, members=None):
+        self._vnodes = vnodes
+        self._tokens = []
+        self._owners = []
+        self._weights = {}
+        if members:
+            # a single update instead of one per member
+            self._weights = {member: 1 for member in members}
+            self._update({member: self._member_tokens(member, 1) for member in self._weights}, (), diff=False)
+
+    @property
+    def vnodes(self):
+        return self._vnodes
+
+    @property
+    def members(self):
+        return list(self._weights)
+
+    def weight(self, member):
+        return self._weights.get(member)
+
+    def tokens(self, member=None):
+        if member is None:
+            return list(self._tokens)
+        return [t for t, m in zip(self._tokens, self._owners) if m == member]
+
+    def add(self, member, weight=1):
+        if member in self._weights:
+            return self.set_weight(member, weight)
+        self._weights[member] = weight
+        return self._update({member: self._member_tokens(member, weight)}, ())
+
+    def remove(self, member):
+        if member not in self._weights:
+            return []
+        del self._weights[member]
+        return self._update({}, (member,))
+
+    def set_weight(self, member, weight):
+        if member not in self._weights:
+            return self.add(member, weight)
+        self._weights[member] = weight
+        return self._update({member: self._member_tokens(member, weight)}, (member,))
+
+    def lookup(self, key):
+        return self.lookup_token(hash_key(key))
+
+    def lookup_token(self, token):
+        if len(self._tokens) == 0:
+            return None
+        i = bisect.bisect_left(self._tokens, token)
+        return self._owners[i % len(self._tokens)]
+
+    def lookup_many(self, keys):
+        # owners of a batch of keys, avoids per-key attribute lookups and calls
+        if len(self._tokens) == 0:
+            return [None] * len(keys)
+        tokens, owners, n = self._tokens, self._owners, len(self._tokens)
+        bisect_left = bisect.bisect_left
+        return [owners[bisect_left(tokens, hash_key(key)) % n] for key in keys]
+
+    def preference_list(self, key, count):
+        # first `count` distinct members clockwise from the key
+        if len(self._tokens) == 0:
+            return []
+        count = min(count, len(self._weights))
+        i = bisect.bisect_left(self._tokens, hash_key(key))
+        result = []
+        for j in range(len(self._tokens)):
+            owner = self._owners[(i + j) % len(self._tokens)]
+            if owner not in result:
+                result.append(owner)
+                if len(result) == count:
+                    break
+        return result
+
+    def ranges(self, member=None):
+        # (start, end] ranges of tokens owned by the member or by all members
+        result = []
+        n = len(self._tokens)
+        for i in range(n):
+            if member is None or self._owners[i] == member:
+                result.append(Range(self._tokens[i - 1] if n > 1 else self._tokens[i], self._tokens[i],
+                                    self._owners[i], self._owners[i]))
+        return result
+
+    def ownership(self):
+        # fraction of the ring owned by each member
+        shares = {member: 0 for member in self._weights}
+        n = len(self._tokens)
+        if n == 0:
+            return shares
+        for i in range(n):
+            shares[self._owners[i]] += ((self._tokens[i] - self._tokens[i - 1]) % RING_SIZE or RING_SIZE) / RING_SIZE
+        return shares
+
+    def __contains__(self, member):
+        return member in self._weights
+
+    def __len__(self):
+        return len(self._weights)
+
+    def _member_tokens(self, member, weight):
+        count = max(int(round(self._vnodes * weight)), 1 if weight > 0 else 0)
+        return [hash_key('%s#%d' % (member, i)) for i in range(count)]
+
+    def _update(self, added, removed, diff=True):
+        old_tokens, old_owners = self._tokens, self._owners
+        entries = [(t, m) for t, m in zip(old_tokens, old_owners) if m not in removed and m not in added]
+        for member, tokens in added.items():
+            entries.extend((t, member) for t in tokens)
+        # token collisions are resolved by member name to keep all rings identical
+        entries.sort()
+        self._tokens = [t for t, _ in entries]
+        self._owners = [m for _, m in entries]
+        if not diff:
+            return None
+        return _diff(old_tokens, old_owners, self._tokens, self._owners)
+
+
+def _diff(old_tokens, old_owners, new_tokens, new_owners):
+    # ranges between consecutive boundaries of both rings have a single owner in each ring,
+    # owners of the boundaries are found by a single merge-like pass over both rings
+    boundaries = sorted(set(old_tokens) | set(new_tokens))
+    if len(boundaries) == 0:
+        return []
+    moved = []
+    i = j = 0
+    n_old, n_new = len(old_tokens), len(new_tokens)
+    for k, end in enumerate(boundaries):
+        while i < n_old and old_tokens[i] < end:
+            i += 1
+        while j < n_new and new_tokens[j] < end:
+            j += 1
+        source = old_owners[i % n_old] if n_old > 0 else None
+        target = new_owners[j % n_new] if n_new > 0 else None
+        if source == target:
+            continue
+        start = boundaries[k - 1]
+        if moved and moved[-1].end == start and moved[-1].source == source and moved[-1].target == target:
+            # merge adjacent ranges with the same transfer
+            moved[-1] = moved[-1]._replace(end=end)
+        else:
+            moved.append(Range(start, end, source, target))
+    if (len(moved) > 1 and moved[0].start == moved[-1].end
+            and moved[0].source == moved[-1].source and moved[0].target == moved[-1].target):
+        # the first and the last ranges are adjacent across zero
+        moved[0] = moved[0]._replace(start=moved.pop().start)
+    return moved
+
+
+class RendezvousHash:
+    # rendezvous (highest random weight) hashing, lookups take O(N) and add() and remove()
+    # return None, since placement is not based on token ranges
+
+    def __init__(self, members=None):
+        self._weights = {}
+        # (seed, member, weight) per member
+        self._seeds = []
+        self._weighted = False
+        if members:
+            self._weights = {member: 1 for member in members}
+            self._update()
+
+    @property
+    def members(self):
+        return list(self._weights)
+
+    def weight(self, member):
+        return self._weights.get(member)
+
+    def add(self, member, weight=1):
+        self._weights[member] = weight
+        self._update()
+
+    def remove(self, member):
+        if self._weights.pop(member, None) is not None:
+            self._update()
+
+    def set_weight(self, member, weight):
+        self.add(member, weight)
+
+    def lookup(self, key):
+        return self.lookup_many([key])[0]
+
+    def lookup_many(self, keys):
+        if len(self._seeds) == 0:
+            return [None] * len(keys)
+        seeds = self._seeds
+        mix = _mix
+        result = []
+        if not self._weighted:
+            for key in keys:
+                h = hash_key(key)
+                result.append(max(seeds, key=lambda s: mix(h ^ s[0]))[1])
+        else:
+            for key in keys:
+                h = hash_key(key)
+                result.append(max(seeds, key=lambda s: s[2] / -math.log((mix(h ^ s[0]) + 1) / RING_SIZE))[1])
+        return result
+
+    def preference_list(self, key, count):
+        h = hash_key(key)
+        scores = sorted(((self._score(h, seed, weight), member) for seed, member, weight in self._seeds),
+                        reverse=True)
+        return [member for _, member in scores[:count]]
+
+    def __contains__(self, member):
+        return member in self._weights
+
+    def __len__(self):
+        return len(self._weights)
+
+    def _score(self, h, seed, weight):
+        if not self._weighted:
+            return _mix(h ^ seed)
+        return weight / -math.log((_mix(h ^ seed) + 1) / RING_SIZE)
+
+    def _update(self):
+        self._seeds = [(hash_key(member), member, weight) for member, weight in sorted(self._weights.items())]
+        self._weighted = any(weight != 1 for weight in self._weights.values())
+
+
+class JumpHash:
+    # jump consistent hashing (Lamping and Veach) over a list of bucket slots, weights are not supported.
+    # New members take the next slot, a removed member is replaced by the last one, so about 2/N of keys
+    # move. Slots depend on the order of changes, add() and remove() return None as there are no ranges.
+
+    def __init__(self, members=None):
+        # slot -> member, members given at once take slots in sorted order
+        self._buckets = sorted(members or ())
+        self._slots = {member: i for i, member in enumerate(self._buckets)}
+
+    @property
+    def members(self):
+        return list(self._buckets)
+
+    def weight(self, member):
+        return 1 if member in self._slots else None
+
+    def add(self, member, weight=1):
+        if weight != 1:
+            raise ValueError("jump hashing does not support weights")
+        if member not in self._slots:
+            self._slots[member] = len(self._buckets)
+            self._buckets.append(member)
+
+    def remove(self, member):
+        slot = self._slots.pop(member, None)
+        if slot is None:
+            return
+        last = self._buckets.pop()
+        if last != member:
+            # keys of the last slot are spread over the others as jump hashing expects,
+            # the last member takes over the freed slot
+            self._buckets[slot] = last
+            self._slots[last] = slot
+
+    def set_weight(self, member, weight):
+        self.add(member, weight)
+
+    def lookup(self, key):
+        if len(self._buckets) == 0:
+            return None
+        return self._buckets[_jump(hash_key(key), len(self._buckets))]
+
+    def lookup_many(self, keys):
+        buckets, n = self._buckets, len(self._buckets)
+        if n == 0:
+            return [None] * len(keys)
+        return [buckets[_jump(hash_key(key), n)] for key in keys]
+
+    def preference_list(self, key, count):
+        # following buckets after the primary one
+        n = len(self._buckets)
+        if n == 0:
+            return []
+        i = _jump(hash_key(key), n)
+        return [self._buckets[(i + j) % n] for j in range(min(count, n))]
+
+    def __contains__(self, member):
+        return member in self._slots
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+def _jump(key, buckets):
+    b, j = -1, 0
+    while j < buckets:
+        b = j
+        key = (key * 2862933555777941757 + 1) & _MASK
+        j = int((b + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return b
+
+
+class BoundedLoad:
+    # consistent hashing with bounded loads: a new key goes to the first of its candidates within
+    # (1 + epsilon) times the average load or to the least loaded one, so readers have to check all candidates
+
+    def __init__(self, placement, epsilon=0.25, choices=2):
+        self._placement = placement
+        self._epsilon = epsilon
+        self._choices = choices
+
+    @property
+    def placement(self):
+        return self._placement
+
+    @property
+    def epsilon(self):
+        return self._epsilon
+
+    def candidates(self, key):
+        return self._placement.preference_list(key, self._choices)
+
+    def limit(self, loads):
+        # capacity of a member after placing one more key
+        if len(loads) == 0:
+            return 1
+        return math.ceil((1 + self._epsilon) * (sum(loads.values()) + 1) / len(loads))
+
+    def choose(self, key, loads):
+        candidates = self.candidates(key)
+        if len(candidates) == 0:
+            return None
+        limit = self.limit(loads)
+        for candidate in candidates:
+            if loads.get(candidate, 0) < limit:
+                return candidate
+        return min(candidates, key=lambda c: loads.get(c, 0))
+
+
+PLACEMENTS = {
+    'ring': HashRing,
+    'rendezvous': RendezvousHash,
+    'jump': JumpHash,
+}
+
+
+def make_placement(name, members=None, **kwargs):
+    # placement strategy by name, kwargs are passed to its constructor (e.g. vnodes of the ring)
+    if name not in PLACEMENTS:
+        raise ValueError("unknown placement: %s" % name)
+    return PLACEMENTS[name](members=members, **kwargs)
@@ -2,6 +2,7 @@ import grpc
 import json
 import logging
 import os
+import pickle
 import queue
 import signal
 import sys
@@ -12,6 +13,8 @@ from google.protobuf.any_pb2 import Any
 
 from .message import Message
 from .process import Context
+from .profiler import Profiler
+from .test_server import GRPC_OPTIONS
 from .transport import UDPTransport
 
 from .proto import test_server_pb2 as pb
@@ -26,8 +29,9 @@ class TestMode:
 class Runtime:
 
     class ProcessContext(Context):
-        def __init__(self, runtime):
+        def __init__(self, runtime, request_id=None):
             self._runtime = runtime
+            self._request_id = request_id
 
         def addr(self):
             return self._runtime._addr
@@ -36,9 +40,9 @@ class Runtime:
             assert self._runtime is not None, "context was destroyed"
             self._runtime._send(message, recepient)
 
-        def send_local(self, message):
+        def send_local(self, message, request_id=None):
             assert self._runtime is not None, "context was destroyed"
-            self._runtime._send_local(message)
+            self._runtime._send_local(message, request_id if request_id is not None else self._request_id)
 
         def set_timer(self, timer, interval):
             assert self._runtime is not None, "context was destroyed"
@@ -59,7 +63,7 @@ class Runtime:
             self._runtime = runtime
 
         def start(self):
-            tserver = rpc.TestServerStub(grpc.insecure_channel(self._server_addr))
+            tserver = rpc.TestServerStub(grpc.insecure_channel(self._server_addr, options=GRPC_OPTIONS))
             self._command_stream = tserver.AttachProcess(iter(self._events.get, None))
             threading.Thread(target=self._process_commands).start()
 
@@ -69,8 +73,10 @@ class Runtime:
         def on_process_stopped(self):
             self._send_event(pb.ProcessStoppedEvent())
 
-        def on_new_message(self, message_id, recepient, raw_message):
-            self._send_event(pb.NewMessageEvent(message_id=message_id, recepient=recepient, message=raw_message))
+        def on_new_message(self, message_id, recepient, raw_message, message_type, sender):
+            self._send_event(pb.NewMessageEvent(
+                message_id=message_id, recepient=recepient, message=raw_message,
+                message_type=message_type, is_local=(sender == 'local'), sender=sender))
 
         def on_message_received(self, message_id, raw_message=None):
             if raw_message is None:
@@ -78,8 +84,8 @@ class Runtime:
             else:
                 self._send_event(pb.MessageDataReceivedEvent(message_id=message_id, message=raw_message))
 
-        def on_message_processed(self, message_id):
-            self._send_event(pb.MessageProcessedEvent(message_id=message_id))
+        def on_message_processed(self, message_id, digest=''):
+            self._send_event(pb.MessageProcessedEvent(message_id=message_id, digest=digest))
 
         def on_new_timer(self, timer_id, name, interval):
             self._send_event(pb.NewTimerEvent(timer_id=timer_id, name=name, interval=interval))
@@ -87,38 +93,57 @@ class Runtime:
         def on_timer_fired(self, timer_id):
             self._send_event(pb.TimerFiredEvent(timer_id=timer_id))
 
-        def on_timer_processed(self, timer_id):
-            self._send_event(pb.TimerProcessedEvent(timer_id=timer_id))
+        def on_timer_processed(self, timer_id, digest=''):
+            self._send_event(pb.TimerProcessedEvent(timer_id=timer_id, digest=digest))
 
         def on_timer_canceled(self, timer_id):
             self._send_event(pb.TimerCanceledEvent(timer_id=timer_id))
 
+        def on_snapshot_taken(self, snapshot_id, state=None, error=None):
+            self._send_event(pb.SnapshotTakenEvent(snapshot_id=snapshot_id, state=state, error=error))
+
+        def on_state_restored(self, snapshot_id, error=None):
+            self._send_event(pb.StateRestoredEvent(snapshot_id=snapshot_id, error=error))
+
         def _process_commands(self):
+            profiler = self._runtime._profiler
             try:
                 for c in self._command_stream:
-                    if c.Is(pb.ReceiveLocalMessageCommand.DESCRIPTOR):
-                        command = pb.ReceiveLocalMessageCommand()
-                        c.Unpack(command)
-                        self._runtime._handle_receive_local_message(command.message)
-
-                    if c.Is(pb.ReceiveMessageCommand.DESCRIPTOR):
-                        command = pb.ReceiveMessageCommand()
-                        c.Unpack(command)
-                        self._runtime._handle_receive_message(command.message_id, command.sender, command.message)
-
-                    if c.Is(pb.FireTimerCommand.DESCRIPTOR):
-                        command = pb.FireTimerCommand()
-                        c.Unpack(command)
-                        self._runtime._handle_fire_timer(command.timer_id)
-
-                    if c.Is(pb.CrashCommand.DESCRIPTOR):
-                        self._runtime._handle_crash()
+                    with profiler.phase('command', c.type_url):
+                        if c.Is(pb.ReceiveLocalMessageCommand.DESCRIPTOR):
+                            command = pb.ReceiveLocalMessageCommand()
+                            c.Unpack(command)
+                            self._runtime._handle_receive_local_message(command.message)
+
+                        if c.Is(pb.ReceiveMessageCommand.DESCRIPTOR):
+                            command = pb.ReceiveMessageCommand()
+                            c.Unpack(command)
+                            self._runtime._handle_receive_message(command.message_id, command.sender, command.message)
+
+                        if c.Is(pb.FireTimerCommand.DESCRIPTOR):
+                            command = pb.FireTimerCommand()
+                            c.Unpack(command)
+                            self._runtime._handle_fire_timer(command.timer_id)
+
+                        if c.Is(pb.CrashCommand.DESCRIPTOR):
+                            self._runtime._handle_crash()
+
+                        if c.Is(pb.SnapshotCommand.DESCRIPTOR):
+                            command = pb.SnapshotCommand()
+                            c.Unpack(command)
+                            self._runtime._handle_snapshot(command.snapshot_id)
+
+                        if c.Is(pb.RestoreCommand.DESCRIPTOR):
+                            command = pb.RestoreCommand()
+                            c.Unpack(command)
+                            self._runtime._handle_restore(command.snapshot_id, command.state)
             except grpc.RpcError:
                 self._events.put(None)
 
         def _send_event(self, event):
-            e = Any()
-            e.Pack(event)
+            with self._runtime._profiler.phase('event pack'):
+                e = Any()
+                e.Pack(event)
             self._events.put(e)
 
 
@@ -133,6 +158,7 @@ class Runtime:
         self._timer_ids = {}
 
         self._stop_event = threading.Event()
+        self._profiler = Profiler()
         signal.signal(signal.SIGINT, self._stop_signal)
         signal.signal(signal.SIGTERM, self._stop_signal)
 
@@ -166,17 +192,18 @@ class Runtime:
             t.cancel()
         self._stop_event.set()
         self._trans.destroy()
+        self._profiler.report(self._proc.name)
 
     def send_local(self, message):
         if self._testing:
             self._tserver_client.on_message_received('local', message.marshall())
 
-        ctx = Runtime.ProcessContext(self)
+        ctx = Runtime.ProcessContext(self, message.request_id)
         self._proc.receive(ctx, message)
         ctx.destroy()
 
         if self._testing:
-            self._tserver_client.on_message_processed('local')
+            self._tserver_client.on_message_processed('local', self._digest())
 
     def receive_local(self):
         return self._local_outbox.get()
@@ -192,29 +219,34 @@ class Runtime:
         if self._testing:
             self._message_count += 1
             message_id = "%s-m%d" % (self._proc.name, self._message_count)
-            raw = message.marshall(self._addr, message_id)
-            self._tserver_client.on_new_message(message_id, recepient, raw)
+            with self._profiler.phase('marshall'):
+                raw = message.marshall(self._addr, message_id)
+            self._tserver_client.on_new_message(message_id, recepient, raw, message.type, self._addr)
         else:
-            raw = message.marshall(self._addr)
+            with self._profiler.phase('marshall'):
+                raw = message.marshall(self._addr)
 
         if not self._testing or self._test_mode == TestMode.WATCH:
             self._trans.send(raw, recepient)
 
-    def _send_local(self, message):
+    def _send_local(self, message, request_id=None):
         logging.debug("%s send to local: %s", self._proc.name, message)
         print('>>', message)
         self._local_outbox.put(message)
         if self._testing:
             message_id = sender = 'local'
+            if request_id is not None:
+                message = message.with_request_id(request_id)
             raw = message.marshall(sender, message_id)
-            self._tserver_client.on_new_message(message_id, sender, raw)
+            self._tserver_client.on_new_message(message_id, sender, raw, message.type, sender)
 
     def _receive_messages(self):
         while not self._stop_event.is_set():
             raw = self._trans.recv()
             if raw is None:
                 continue
-            message = Message.unmarshall(raw)
+            with self._profiler.phase('unmarshall'):
+                message = Message.unmarshall(raw)
             self._inbox.put(message)
 
     def _receive_local_messages(self):
@@ -241,12 +273,19 @@ class Runtime:
                 else:
                     self._tserver_client.on_message_received(message._id)
 
-            ctx = Runtime.ProcessContext(self)
-            self._proc.receive(ctx, message)
+            ctx = Runtime.ProcessContext(self, message.request_id if message.is_local() else None)
+            with self._profiler.phase('process receive'):
+                self._proc.receive(ctx, message)
             ctx.destroy()
 
             if self._testing:
-                self._tserver_client.on_message_processed(message._id)
+                self._tserver_client.on_message_processed(message._id, self._digest())
+
+    def _digest(self):
+        digest = self._proc.digest()
+        if digest is None:
+            return ''
+        return json.dumps(digest, sort_keys=True)
 
     # Timers
 
@@ -286,11 +325,12 @@ class Runtime:
             self._tserver_client.on_timer_fired(timer_id)
 
         ctx = Runtime.ProcessContext(self)
-        self._proc.on_timer(ctx, name)
+        with self._profiler.phase('process on_timer'):
+            self._proc.on_timer(ctx, name)
         ctx.destroy()
 
         if self._testing:
-            self._tserver_client.on_timer_processed(timer_id)
+            self._tserver_client.on_timer_processed(timer_id, self._digest())
         if not self._testing or self._test_mode == TestMode.WATCH:
             self._timers.pop(timer_id)
 
@@ -301,7 +341,8 @@ class Runtime:
         self.send_local(message)
 
     def _handle_receive_message(self, message_id, sender, raw_message):
-        message = Message.unmarshall(raw_message)
+        with self._profiler.phase('unmarshall'):
+            message = Message.unmarshall(raw_message)
         self._inbox.put(message)
 
     def _handle_fire_timer(self, timer_id):
@@ -312,6 +353,38 @@ class Runtime:
     def _handle_crash(self):
         os._exit(1)
 
+    def _handle_snapshot(self, snapshot_id):
+        if self._test_mode != TestMode.CONTROL:
+            self._tserver_client.on_snapshot_taken(snapshot_id, error='snapshots require CONTROL mode')
+            return
+        try:
+            state = pickle.dumps({
+                'process': self._proc.snapshot(),
+                'timer_ids': self._timer_ids,
+                'pending_timers': self._pending_timers,
+                'message_count': self._message_count,
+                'timer_count': self._timer_count,
+            })
+        except Exception as e:
+            logging.debug("%s snapshot failed: %s", self._proc.name, e)
+            self._tserver_client.on_snapshot_taken(snapshot_id, error=str(e))
+            return
+        self._tserver_client.on_snapshot_taken(snapshot_id, state)
+
+    def _handle_restore(self, snapshot_id, raw_state):
+        try:
+            state = pickle.loads(raw_state)
+            self._proc.restore(state['process'])
+        except Exception as e:
+            logging.debug("%s restore failed: %s", self._proc.name, e)
+            self._tserver_client.on_state_restored(snapshot_id, error=str(e))
+            return
+        self._timer_ids = state['timer_ids']
+        self._pending_timers = state['pending_timers']
+        self._message_count = state['message_count']
+        self._timer_count = state['timer_count']
+        self._tserver_client.on_state_restored(snapshot_id)
+
     # Misc
 
     def _stop_signal(self, signum, frame):
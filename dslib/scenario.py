@@ -0,0 +1,204 @@
+import json
+import logging
+import os
+
+from .message import Message
+from .network import NetworkModel, parse_rate, parse_time
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+
+class ScenarioError(Exception):
+    pass
+
+
+class ScenarioAction:
+    def __init__(self, at, name, arg):
+        self._at = at
+        self._name = name
+        self._arg = arg
+
+    @property
+    def at(self):
+        return self._at
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def arg(self):
+        return self._arg
+
+    def __str__(self):
+        return "t=%.3fs %s %s" % (self._at, self._name, json.dumps(self._arg))
+
+
+class Scenario:
+    # time-indexed fault injection actions, loaded from JSON or YAML (see the example in readme.md)
+
+    def __init__(self, name, actions, duration=None):
+        self._name = name
+        self._actions = sorted(actions, key=lambda a: a.at)
+        if duration is None:
+            duration = self._actions[-1].at if len(self._actions) > 0 else 0
+        self._duration = duration
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def actions(self):
+        return self._actions
+
+    @property
+    def duration(self):
+        return self._duration
+
+    @staticmethod
+    def from_dict(data, name=None):
+        actions = []
+        for item in data.get('actions', []):
+            item = dict(item)
+            if 'at' not in item:
+                raise ScenarioError("action without time: %s" % item)
+            at = parse_time(item.pop('at'))
+            if len(item) != 1:
+                raise ScenarioError("action should have exactly one command: %s" % item)
+            action_name, arg = item.popitem()
+            actions.append(ScenarioAction(at, action_name, arg))
+        duration = data.get('duration')
+        if duration is not None:
+            duration = parse_time(duration)
+        return Scenario(data.get('name', name), actions, duration)
+
+    @staticmethod
+    def load(path):
+        with open(path) as f:
+            if path.endswith('.yaml') or path.endswith('.yml'):
+                if yaml is None:
+                    raise ScenarioError("PyYAML is required to load %s" % path)
+                data = yaml.safe_load(f)
+            else:
+                data = json.load(f)
+        return Scenario.from_dict(data, name=os.path.splitext(os.path.basename(path))[0])
+
+
+def load_scenarios(path):
+    # loads a single scenario file or all scenario files from a directory
+    if not os.path.isdir(path):
+        return [Scenario.load(path)]
+    scenarios = []
+    for name in sorted(os.listdir(path)):
+        if os.path.splitext(name)[1] in ('.json', '.yaml', '.yml'):
+            scenarios.append(Scenario.load(os.path.join(path, name)))
+    return scenarios
+
+
+class ScenarioResult:
+    def __init__(self, scenario, error=None):
+        self.scenario = scenario
+        self.error = error
+
+    @property
+    def passed(self):
+        return self.error is None
+
+    def __str__(self):
+        if self.passed:
+            return "%s: OK" % self.scenario.name
+        return "%s: FAIL (%s)" % (self.scenario.name, self.error)
+
+
+class ScenarioRunner:
+    # executes scenarios by the test server clock, custom commands (e.g. restart of a crashed node,
+    # which depends on the harness) are supplied as handlers: {name: callable(ts, arg)}
+
+    def __init__(self, ts, handlers=None, step_timeout=1):
+        self._ts = ts
+        self._handlers = dict(handlers or {})
+        self._step_timeout = step_timeout
+
+    def run(self, scenario):
+        ts = self._ts
+        start = ts.now()
+        logging.debug("running scenario %s", scenario.name)
+        for action in scenario.actions:
+            if not ts.step_until_time(start + action.at, self._step_timeout):
+                raise ScenarioError("step timeout before %s" % action)
+            logging.debug("scenario action %s", action)
+            self._apply(action)
+        if not ts.step_until_time(start + scenario.duration, self._step_timeout):
+            raise ScenarioError("step timeout at the end of scenario")
+
+    def _apply(self, action):
+        ts = self._ts
+        name, arg = action.name, action.arg
+        if name in self._handlers:
+            self._handlers[name](ts, arg)
+        elif name == 'partition':
+            ts.partition_network(arg[0], arg[1])
+        elif name == 'reset_network':
+            ts.reset_network()
+        elif name == 'crash':
+            for process_id in _as_list(arg):
+                ts.crash_process(process_id)
+        elif name == 'disconnect':
+            for process_id in _as_list(arg):
+                ts.disconnect_process(process_id)
+        elif name == 'connect':
+            for process_id in _as_list(arg):
+                ts.connect_process(process_id)
+        elif name in ('drop_incoming', 'pass_incoming', 'drop_outgoing', 'pass_outgoing'):
+            for process_id in _as_list(arg):
+                getattr(ts, name)(process_id)
+        elif name in ('disable_link', 'enable_link'):
+            getattr(ts, name)(arg[0], arg[1])
+        elif name == 'drop_rate':
+            if isinstance(arg, dict):
+                ts.set_message_drop_rate(parse_rate(arg['rate']), sender=arg.get('from'))
+            else:
+                ts.set_message_drop_rate(parse_rate(arg))
+        elif name == 'delay':
+            if isinstance(arg, list):
+                ts.set_message_delay(parse_time(arg[0]), parse_time(arg[1]))
+            else:
+                ts.set_message_delay(parse_time(arg))
+        elif name == 'repeat_rate':
+            ts.set_repeat_rate(parse_rate(arg['rate']), arg.get('times', 1))
+        elif name == 'network':
+            ts.set_network_model(NetworkModel.from_dict(arg) if arg else None)
+        elif name == 'send_local':
+            message = Message(arg['type'], arg.get('body'))
+            ts.send_local_message(arg['to'], message, self._step_timeout)
+        else:
+            raise ScenarioError("unknown scenario command: %s" % name)
+
+
+def _as_list(arg):
+    if isinstance(arg, list):
+        return arg
+    return [arg]
+
+
+def run_batch(scenarios, setup, teardown, check=None, handlers=None, step_timeout=1):
+    # runs each scenario on a system started by setup() returning the test server,
+    # check(ts, scenario) raises AssertionError on misbehavior, teardown(ts) stops the system
+    results = []
+    for scenario in scenarios:
+        ts = setup()
+        try:
+            ScenarioRunner(ts, handlers, step_timeout).run(scenario)
+            if check is not None:
+                check(ts, scenario)
+            results.append(ScenarioResult(scenario))
+        except (AssertionError, ScenarioError) as e:
+            results.append(ScenarioResult(scenario, str(e)))
+        finally:
+            teardown(ts)
+        logging.info("%s", results[-1])
+    return results
@@ -0,0 +1,64 @@
+import json
+
+
+class Action:
+    DELIVER = 'deliver'
+    DROP = 'drop'
+    DISCARD = 'discard'
+    FIRE = 'fire'
+
+
+class ScheduleRecorder:
+
+    def __init__(self, path, seed=None):
+        self._path = path
+        self._file = open(path, 'w')
+        self._count = 0
+        self._write({'seed': seed})
+
+    @property
+    def path(self):
+        return self._path
+
+    def record(self, event_id, action, repeats=0):
+        entry = {'event': event_id, 'action': action}
+        if repeats > 0:
+            entry['repeats'] = repeats
+        self._write(entry)
+        self._count += 1
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+    def _write(self, entry):
+        # flush every entry so that the schedule survives a crashed test run
+        self._file.write(json.dumps(entry) + '\n')
+        self._file.flush()
+
+
+class SchedulePlayer:
+
+    def __init__(self, path):
+        with open(path) as f:
+            lines = [json.loads(line) for line in f if line.strip()]
+        self._seed = lines[0].get('seed') if len(lines) > 0 else None
+        self._entries = lines[1:]
+        self._pos = 0
+
+    @property
+    def seed(self):
+        return self._seed
+
+    def next(self):
+        if self._pos >= len(self._entries):
+            return None
+        entry = self._entries[self._pos]
+        self._pos += 1
+        return entry
+
+    def finished(self):
+        return self._pos >= len(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
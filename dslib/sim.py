@@ -0,0 +1,205 @@
+import importlib.util
+import itertools
+import logging
+import os
+import sys
+import threading
+import time
+
+from .test_server import TestMode
+
+
+_local = threading.local()
+
+
+def current_simulation():
+    # simulation running the program in the current thread, if any
+    return getattr(_local, 'simulation', None)
+
+
+class ProcessCrashed(BaseException):
+    # raised inside an in-process program when the test server crashes or stops it,
+    # not an Exception, so that "except Exception" in programs does not catch it
+    pass
+
+
+class _Handler:
+    # counterpart of TestServer.ProcessHandler which passes commands to the communicator directly
+
+    def __init__(self, comm):
+        self._comm = comm
+
+    def receive_local_message(self, raw_message):
+        self._comm._handle_receive_local_message(raw_message)
+
+    def receive_message(self, message_id, sender, raw_message):
+        self._comm._handle_receive_message(message_id, sender, raw_message)
+
+    def fire_timer(self, timer_id):
+        self._comm._handle_fire_timer(timer_id)
+
+    def crash(self):
+        self._comm._handle_crash()
+
+    def take_snapshot(self, snapshot_id):
+        self._comm._handle_snapshot(snapshot_id)
+
+    def restore(self, snapshot_id, state):
+        self._comm._handle_restore(snapshot_id, state)
+
+    def stop(self):
+        pass
+
+
+class _Client:
+    # replaces the gRPC client of Communicator, events are passed to the test server directly
+
+    def __init__(self, ts, comm):
+        self._ts = ts
+        self._comm = comm
+        self._handler = _Handler(comm)
+        self._process_id = None
+        self._active = True
+
+    @property
+    def process_id(self):
+        return self._process_id
+
+    @property
+    def active(self):
+        return self._active
+
+    def start(self):
+        pass
+
+    def deactivate(self):
+        # events of crashed or stopped programs are ignored, as if their connection was closed
+        self._active = False
+
+    def on_process_started(self, process_id, address):
+        self._process_id = process_id
+        self._ts._on_process_started(process_id, address, self._handler)
+
+    def on_process_stopped(self):
+        if self._active:
+            self._active = False
+            self._ts._on_process_stopped(self._process_id)
+
+    def on_new_message(self, message_id, recepient, raw_message, message_type, sender):
+        if self._active:
+            self._ts._on_new_message(
+                self._process_id, message_id, recepient, raw_message, message_type, sender == 'local', sender)
+
+    def on_message_received(self, message_id, raw_message=None):
+        if self._active:
+            self._ts._on_message_received(self._process_id, message_id, raw_message)
+
+    def on_message_processed(self, message_id, digest=''):
+        if self._active:
+            self._ts._on_message_processed(self._process_id, message_id, digest)
+
+    def on_new_timer(self, timer_id, name, interval):
+        if self._active:
+            self._ts._on_new_timer(self._process_id, timer_id, name, interval)
+
+    def on_timer_fired(self, timer_id):
+        if self._active:
+            self._ts._on_timer_fired(self._process_id, timer_id)
+
+    def on_timer_processed(self, timer_id, digest=''):
+        if self._active:
+            self._ts._on_timer_processed(self._process_id, timer_id, digest)
+
+    def on_timer_canceled(self, timer_id):
+        if self._active:
+            self._ts._on_timer_canceled(self._process_id, timer_id)
+
+    def on_snapshot_taken(self, snapshot_id, state=None, error=None):
+        if self._active:
+            self._ts._on_snapshot_taken(self._process_id, snapshot_id, state, error)
+
+    def on_state_restored(self, snapshot_id, error=None):
+        if self._active:
+            self._ts._on_state_restored(self._process_id, snapshot_id, error)
+
+
+class Simulation:
+    # runs Communicator-based programs as tasks in threads of the test process, their communicators
+    # talk to the test server directly, only one task runs at a time and recv(timeout) uses the test server clock
+
+    def __init__(self, ts, debug=False):
+        if ts._test_mode != TestMode.CONTROL:
+            raise ValueError("in-process programs require CONTROL test mode")
+        self._ts = ts
+        self._debug = debug
+        self._clients = []
+        self._tasks = []
+        self._addr_count = itertools.count(1)
+        self._module_count = itertools.count(1)
+        # command line arguments are global, so programs are started one by one
+        self._argv_lock = threading.Lock()
+
+    @property
+    def debug(self):
+        return self._debug
+
+    def new_addr(self):
+        return 'sim:%d' % next(self._addr_count)
+
+    def client(self, comm):
+        client = _Client(self._ts, comm)
+        self._clients.append(client)
+        return client
+
+    def spawn(self, process_id, target, *args, timeout=1):
+        # runs target(*args) as a new task and waits until it attaches as process_id
+        task = threading.Thread(target=self._run, args=(target, args), name=process_id, daemon=True)
+        self._tasks.append(task)
+        task.start()
+        deadline = time.time() + timeout
+        while process_id not in self._ts.running_processes():
+            if not task.is_alive() or time.time() >= deadline:
+                return False
+            time.sleep(.001)
+        return True
+
+    def run_program(self, path, args, process_id, timeout=1):
+        # loads the program as a separate module and runs its main() with given command line arguments
+        path = os.path.abspath(path)
+        program_dir = os.path.dirname(path)
+        if program_dir not in sys.path:
+            # programs import their sibling modules
+            sys.path.insert(0, program_dir)
+        name = '_sim_%s_%d' % (os.path.splitext(os.path.basename(path))[0], next(self._module_count))
+        spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        with self._argv_lock:
+            argv = sys.argv
+            sys.argv = [path] + list(args)
+            try:
+                return self.spawn(process_id, module.main, timeout=timeout)
+            finally:
+                sys.argv = argv
+
+    def crash(self, comm):
+        comm._tserver_client.deactivate()
+        # wakes up the task blocked in recv()
+        comm._inbox.put(None)
+
+    def stop(self):
+        for client in self._clients:
+            if client.active:
+                client.on_process_stopped()
+                client._comm._inbox.put(None)
+        for task in self._tasks:
+            task.join(.1)
+
+    def _run(self, target, args):
+        _local.simulation = self
+        try:
+            target(*args)
+        except (ProcessCrashed, SystemExit):
+            pass
+        except Exception:
+            logging.exception("in-process program %s failed", threading.current_thread().name)
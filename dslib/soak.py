@@ -0,0 +1,166 @@
+import json
+import logging
+import os
+import resource
+from collections import Counter
+
+from .schedule import Action
+from .stats import RollingWindow
+from .test_server import Event
+
+
+def _rss_kb():
+    # current resident set size of the test process, falls back to the peak value
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class SoakRunner:
+    # runs the system under local messages from load(ts, now) and crashes of random processes restarted
+    # by restart(process_id), appends JSON lines with statistics over the last `window` seconds to output
+
+    def __init__(self, ts, output, load=None, load_interval=1, on_reply=None,
+                 churn_interval=None, restart=None, restart_delay=5, protected=(),
+                 report_interval=10, window=60, step_timeout=1):
+        self._ts = ts
+        self._output = output
+        self._load = load
+        self._load_interval = load_interval
+        self._on_reply = on_reply
+        self._churn_interval = churn_interval
+        self._restart = restart
+        self._restart_delay = restart_delay
+        self._protected = set(protected)
+        self._report_interval = report_interval
+        self._window = window
+        self._step_timeout = step_timeout
+
+        self._delivered = RollingWindow(window)
+        self._dropped = RollingWindow(window)
+        self._discarded = RollingWindow(window)
+        self._requests = RollingWindow(window)
+        self._replies = RollingWindow(window)
+        self._totals = Counter()
+        self._restarts = {}
+
+    def run(self, duration):
+        ts = self._ts
+        start = ts.now()
+        next_load = start
+        next_churn = start + self._churn_interval if self._churn_interval is not None else None
+        next_report = start + self._report_interval
+        ts.add_event_listener(self._on_event)
+        try:
+            with open(self._output, 'w') as out:
+                reported = False
+                while True:
+                    now = ts.now()
+                    if now - start >= duration:
+                        break
+                    deadlines = [next_load, next_report, start + duration] + list(self._restarts.values())
+                    if next_churn is not None:
+                        deadlines.append(next_churn)
+                    if not ts.step_until_time(min(deadlines), self._step_timeout):
+                        self._totals['step_timeouts'] += 1
+                    now = ts.now()
+                    self._collect_replies(now)
+
+                    if self._load is not None and now >= next_load:
+                        self._send_load(now)
+                        next_load = max(next_load + self._load_interval, now)
+                    for process_id, restart_time in list(self._restarts.items()):
+                        if now >= restart_time:
+                            del self._restarts[process_id]
+                            logging.debug("soak: restarting %s", process_id)
+                            self._restart(process_id)
+                            self._totals['restarts'] += 1
+                    if next_churn is not None and now >= next_churn:
+                        self._churn(now)
+                        next_churn += self._churn_interval
+                    reported = now >= next_report
+                    if reported:
+                        self._report(out, now, start)
+                        next_report += self._report_interval
+                if not reported:
+                    self._report(out, ts.now(), start)
+        finally:
+            ts.remove_event_listener(self._on_event)
+        return dict(self._totals)
+
+    def _on_event(self, event, action, now):
+        if event.type != Event.MESSAGE:
+            return
+        if action == Action.DELIVER:
+            self._delivered.add(now, now - event.create_time)
+        elif action == Action.DROP:
+            self._dropped.add(now)
+        elif action == Action.DISCARD:
+            self._discarded.add(now)
+        self._totals[action] += 1
+
+    def _send_load(self, now):
+        running = set(self._ts.running_processes())
+        for process_id, message in self._load(self._ts, now):
+            if process_id not in running:
+                continue
+            self._ts.send_local_message(process_id, message, self._step_timeout)
+            self._requests.add(now)
+            self._totals['requests'] += 1
+
+    def _collect_replies(self, now):
+        # local messages are drained, so that they do not pile up in the test server
+        for process_id in self._ts.running_processes():
+            for message in self._ts.drain_local_messages(process_id):
+                self._replies.add(now)
+                self._totals['replies'] += 1
+                if self._on_reply is not None:
+                    self._on_reply(process_id, message, now)
+
+    def _churn(self, now):
+        candidates = [p for p in sorted(self._ts.running_processes())
+                      if p not in self._protected and p not in self._restarts]
+        if len(candidates) == 0:
+            return
+        process_id = self._ts.random.choice(candidates)
+        logging.debug("soak: crashing %s", process_id)
+        self._ts.crash_process(process_id)
+        self._totals['crashes'] += 1
+        if self._restart is not None:
+            self._restarts[process_id] = now + self._restart_delay
+
+    def _report(self, out, now, start):
+        queue_depth = Counter()
+        pending = self._ts.pending_events()
+        for event in pending:
+            queue_depth[event.recepient if event.type == Event.MESSAGE else event.process_id] += 1
+        # rates are averaged over the part of the window that has already passed
+        span = min(self._window, now - start) or 1
+        latency_p50 = self._delivered.percentile(now, 50)
+        latency_p99 = self._delivered.percentile(now, 99)
+        record = {
+            'time': now,
+            'elapsed': now - start,
+            'window': self._window,
+            'delivered_per_sec': self._delivered.count(now) / span,
+            'dropped': self._dropped.count(now),
+            'discarded': self._discarded.count(now),
+            'latency_p50_ms': latency_p50 * 1000 if latency_p50 is not None else None,
+            'latency_p99_ms': latency_p99 * 1000 if latency_p99 is not None else None,
+            'requests_per_sec': self._requests.count(now) / span,
+            'replies_per_sec': self._replies.count(now) / span,
+            'queue_depth': dict(queue_depth),
+            'pending_events': len(pending),
+            'running': len(self._ts.running_processes()),
+            'message_index': self._ts.message_stats()['entries'],
+            'rss_kb': _rss_kb(),
+            'totals': dict(self._totals),
+        }
+        out.write(json.dumps(record) + '\n')
+        out.flush()
+        logging.info("soak: %.0fs, %.1f msg/s, p99 %s ms, %d pending events, rss %d kB",
+                     record['elapsed'], record['delivered_per_sec'],
+                     '%.1f' % record['latency_p99_ms'] if latency_p99 is not None else '-',
+                     record['pending_events'], record['rss_kb'])
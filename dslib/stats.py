@@ -0,0 +1,134 @@
+import math
+import random
+from collections import deque
+
+
+def percentile(values, p):
+    # nearest-rank percentile, None for empty input
+    if len(values) == 0:
+        return None
+    values = sorted(values)
+    return values[max(int(math.ceil(p / 100 * len(values))) - 1, 0)]
+
+
+class RollingWindow:
+    # values observed during the last `window` seconds in buckets of `bucket` seconds,
+    # each bucket keeps a bounded uniform sample of values for percentiles
+
+    def __init__(self, window=60, bucket=1, max_samples=1000, seed=None):
+        self._window = window
+        self._bucket = bucket
+        self._max_samples = max_samples
+        self._random = random.Random(seed)
+        # [start time, count, sum of values, sampled values]
+        self._buckets = deque()
+
+    @property
+    def window(self):
+        return self._window
+
+    def add(self, t, value=0):
+        start = math.floor(t / self._bucket) * self._bucket
+        if len(self._buckets) == 0 or self._buckets[-1][0] < start:
+            self._buckets.append([start, 0, 0, []])
+        # observations arriving late are attributed to the last bucket
+        b = self._buckets[-1]
+        b[1] += 1
+        b[2] += value
+        if len(b[3]) < self._max_samples:
+            b[3].append(value)
+        else:
+            i = self._random.randrange(b[1])
+            if i < self._max_samples:
+                b[3][i] = value
+        self._expire(t)
+
+    def count(self, now):
+        self._expire(now)
+        return sum(b[1] for b in self._buckets)
+
+    def total(self, now):
+        self._expire(now)
+        return sum(b[2] for b in self._buckets)
+
+    def rate(self, now):
+        # observations per second over the window
+        return self.count(now) / self._window
+
+    def mean(self, now):
+        count = self.count(now)
+        if count == 0:
+            return None
+        return self.total(now) / count
+
+    def percentile(self, now, p):
+        self._expire(now)
+        return percentile([v for b in self._buckets for v in b[3]], p)
+
+    def _expire(self, now):
+        while len(self._buckets) > 0 and self._buckets[0][0] + self._bucket <= now - self._window:
+            self._buckets.popleft()
+
+
+class DistributionStats:
+    # incremental statistics of keys distribution over nodes, key lists are added one node (or chunk)
+    # at a time, copies of every key are counted to detect keys stored on several nodes
+
+    def __init__(self, nodes=()):
+        self._copies = {}
+        self._node_counts = {node: 0 for node in nodes}
+        self._records = 0
+        self._duplicates = 0
+
+    def add(self, node, keys):
+        copies = self._copies
+        for key in keys:
+            count = copies.get(key, 0)
+            if count == 1:
+                self._duplicates += 1
+            copies[key] = count + 1
+        self._node_counts[node] = self._node_counts.get(node, 0) + len(keys)
+        self._records += len(keys)
+
+    @property
+    def records(self):
+        # total number of stored records including copies
+        return self._records
+
+    @property
+    def unique_keys(self):
+        return len(self._copies)
+
+    @property
+    def duplicate_keys(self):
+        # number of keys stored on more than one node
+        return self._duplicates
+
+    @property
+    def node_counts(self):
+        return dict(self._node_counts)
+
+    def keys(self):
+        return self._copies.keys()
+
+    def missing(self, expected):
+        return [key for key in expected if key not in self._copies]
+
+    def unexpected(self, expected):
+        expected = set(expected)
+        return [key for key in self._copies if key not in expected]
+
+    def max_per_node(self):
+        return max(self._node_counts.values(), default=0)
+
+    def min_per_node(self):
+        return min(self._node_counts.values(), default=0)
+
+    def deviations(self, total=None):
+        # relative deviations of node counts from the even share of `total` keys
+        if total is None:
+            total = self.unique_keys
+        if total == 0 or len(self._node_counts) == 0:
+            return {}
+        target = total / len(self._node_counts)
+        return {node: abs(count - target) / target for node, count in self._node_counts.items()}
@@ -0,0 +1,349 @@
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+
+# crc32 of the rest of the record, key length, value length or -1 for deleted keys
+_HEADER = struct.Struct('>IIi')
+_SEGMENT_SUFFIX = '.log'
+# compacted segment written completely, it replaces all segments up to its id
+_COMPACTED_SUFFIX = '.compacted'
+_TMP_SUFFIX = '.tmp'
+
+
+class LogStore:
+    # bitcask-like storage: appends to segment files with an in-memory index, sealed segments are mmapped
+    # and compacted in background, fsync is batched per sync_every writes or sync_interval seconds
+
+    def __init__(self, path, segment_size=16 * 1024 * 1024, sync_every=100, sync_interval=0.1,
+                 compaction_ratio=0.5, background=True, encode=None, decode=None):
+        self._path = path
+        self._segment_size = segment_size
+        self._sync_every = sync_every
+        self._sync_interval = sync_interval
+        self._compaction_ratio = compaction_ratio
+        self._encode = encode
+        self._decode = decode
+        self._lock = threading.RLock()
+        self._compacting = threading.Lock()
+        # key -> (segment id, offset of the record, size of the record)
+        self._index = {}
+        # sealed segments: id -> [mmap or None for empty files, size, garbage bytes]
+        self._sealed = {}
+        self._active_id = None
+        self._active_fd = None
+        self._active_size = 0
+        self._active_garbage = 0
+        self._unsynced = 0
+        self._unsynced_since = None
+        self._syncs = 0
+        self._compactions = 0
+        self._closed = False
+        os.makedirs(path, exist_ok=True)
+        self._recover()
+
+        self._compaction_wanted = threading.Event()
+        self._compactor = None
+        if background:
+            self._compactor = threading.Thread(target=self._background_loop, name='logstore', daemon=True)
+            self._compactor.start()
+
+    @property
+    def path(self):
+        return self._path
+
+    # Mapping interface
+
+    def get(self, key, default=None):
+        with self._lock:
+            location = self._index.get(key)
+            if location is None:
+                return default
+            data = self._read_value(key, location)
+        return self._decode(data) if self._decode is not None else data
+
+    def put(self, key, value):
+        data = self._encode(value) if self._encode is not None else value
+        self._append(key, data)
+
+    def delete(self, key):
+        with self._lock:
+            if key not in self._index:
+                return False
+            self._append(key, None)
+            return True
+
+    def pop(self, key, *default):
+        with self._lock:
+            if key not in self._index:
+                if default:
+                    return default[0]
+                raise KeyError(key)
+            value = self.get(key)
+            self._append(key, None)
+        return value
+
+    def keys(self):
+        with self._lock:
+            return list(self._index)
+
+    def items(self):
+        return [(key, self.get(key)) for key in self.keys()]
+
+    def __getitem__(self, key):
+        with self._lock:
+            if key not in self._index:
+                raise KeyError(key)
+            return self.get(key)
+
+    def __setitem__(self, key, value):
+        self.put(key, value)
+
+    def __delitem__(self, key):
+        if not self.delete(key):
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def __iter__(self):
+        # over a copy of keys, so the store can be changed while iterating
+        return iter(self.keys())
+
+    # Durability and maintenance
+
+    def sync(self):
+        with self._lock:
+            if self._unsynced > 0:
+                os.fsync(self._active_fd)
+                self._syncs += 1
+                self._unsynced = 0
+                self._unsynced_since = None
+
+    def compact(self):
+        # rewrites live records of all sealed segments into one, returns the number of reclaimed bytes
+        with self._compacting:
+            if self._closed:
+                return 0
+            return self._compact()
+
+    def _compact(self):
+        with self._lock:
+            ids = sorted(self._sealed)
+            if len(ids) == 0:
+                return 0
+            target = ids[-1]
+            # locations of live records in the compacted segments, these segments do not
+            # change until they are replaced, since new records go to the active segment
+            live = {key: location for key, location in self._index.items() if location[0] in self._sealed}
+            before = sum(self._sealed[i][1] for i in ids)
+
+        tmp = os.path.join(self._path, '%08d%s' % (target, _TMP_SUFFIX))
+        moved = {}
+        offset = 0
+        with open(tmp, 'wb') as f:
+            for key, (segment_id, record_offset, size) in live.items():
+                f.write(self._sealed[segment_id][0][record_offset:record_offset + size])
+                moved[key] = (target, offset, size)
+                offset += size
+            f.flush()
+            os.fsync(f.fileno())
+        compacted = os.path.join(self._path, '%08d%s' % (target, _COMPACTED_SUFFIX))
+        os.rename(tmp, compacted)
+
+        with self._lock:
+            for segment_id in ids:
+                segment = self._sealed.pop(segment_id)
+                if segment[0] is not None:
+                    segment[0].close()
+                os.remove(self._segment_file(segment_id))
+            os.rename(compacted, self._segment_file(target))
+            self._sealed[target] = [self._map(target, offset), offset, 0]
+            for key, location in moved.items():
+                if self._index.get(key) == live[key]:
+                    self._index[key] = location
+                else:
+                    # overwritten or deleted while the segment was written
+                    self._sealed[target][2] += location[2]
+            self._compactions += 1
+        logging.debug("compacted %d segments of %s: %d -> %d bytes", len(ids), self._path, before, offset)
+        return before - offset
+
+    def stats(self):
+        with self._lock:
+            sealed = sum(segment[1] for segment in self._sealed.values())
+            garbage = sum(segment[2] for segment in self._sealed.values())
+            return {'keys': len(self._index), 'segments': len(self._sealed) + 1,
+                    'bytes': sealed + self._active_size, 'garbage_bytes': garbage + self._active_garbage,
+                    'syncs': self._syncs, 'compactions': self._compactions}
+
+    def close(self):
+        with self._compacting, self._lock:
+            if self._closed:
+                return
+            self.sync()
+            self._closed = True
+            os.close(self._active_fd)
+            for segment in self._sealed.values():
+                if segment[0] is not None:
+                    segment[0].close()
+        self._compaction_wanted.set()
+
+    # Internals
+
+    def _segment_file(self, segment_id):
+        return os.path.join(self._path, '%08d%s' % (segment_id, _SEGMENT_SUFFIX))
+
+    def _map(self, segment_id, size):
+        if size == 0:
+            return None
+        with open(self._segment_file(segment_id), 'rb') as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _recover(self):
+        names = os.listdir(self._path)
+        for name in names:
+            if name.endswith(_TMP_SUFFIX):
+                # compaction interrupted before its segment was complete
+                os.remove(os.path.join(self._path, name))
+        for name in sorted(names):
+            if name.endswith(_COMPACTED_SUFFIX):
+                # compaction interrupted while replacing segments, the compacted one is complete
+                target = int(name[:-len(_COMPACTED_SUFFIX)])
+                for other in names:
+                    if other.endswith(_SEGMENT_SUFFIX) and int(other[:-len(_SEGMENT_SUFFIX)]) <= target:
+                        os.remove(os.path.join(self._path, other))
+                os.rename(os.path.join(self._path, name), self._segment_file(target))
+        ids = sorted(int(name[:-len(_SEGMENT_SUFFIX)]) for name in os.listdir(self._path)
+                     if name.endswith(_SEGMENT_SUFFIX))
+
+        for segment_id in ids:
+            with open(self._segment_file(segment_id), 'rb') as f:
+                data = f.read()
+            size = self._scan(segment_id, data)
+            if size < len(data):
+                logging.warning("%s: dropping %d bytes of a torn record at the end of segment %d",
+                                self._path, len(data) - size, segment_id)
+                with open(self._segment_file(segment_id), 'r+b') as f:
+                    f.truncate(size)
+            self._sealed[segment_id] = [None, size, self._sealed.get(segment_id, [None, 0, 0])[2]]
+
+        # the last segment stays active, others are mapped
+        if len(ids) > 0 and self._sealed[ids[-1]][1] < self._segment_size:
+            self._active_id = ids[-1]
+            segment = self._sealed.pop(self._active_id)
+            self._active_size = segment[1]
+            self._active_garbage = segment[2]
+        else:
+            self._active_id = ids[-1] + 1 if len(ids) > 0 else 1
+        for segment_id, segment in self._sealed.items():
+            segment[0] = self._map(segment_id, segment[1])
+        self._active_fd = os.open(self._segment_file(self._active_id), os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+
+    def _scan(self, segment_id, data):
+        # adds records of the segment to the index, returns the size of its valid prefix
+        offset = 0
+        while offset + _HEADER.size <= len(data):
+            crc, key_size, value_size = _HEADER.unpack_from(data, offset)
+            size = _HEADER.size + key_size + max(value_size, 0)
+            if offset + size > len(data) or zlib.crc32(data[offset + 4:offset + size]) != crc:
+                break
+            key = data[offset + _HEADER.size:offset + _HEADER.size + key_size].decode()
+            self._forget(key)
+            if value_size >= 0:
+                self._index[key] = (segment_id, offset, size)
+            else:
+                self._garbage(segment_id, size)
+            offset += size
+        return offset
+
+    def _garbage(self, segment_id, size):
+        if segment_id == self._active_id:
+            self._active_garbage += size
+        else:
+            self._sealed.setdefault(segment_id, [None, 0, 0])[2] += size
+
+    def _forget(self, key):
+        # the previous record of the key becomes garbage
+        old = self._index.pop(key, None)
+        if old is not None:
+            self._garbage(old[0], old[2])
+
+    def _read_value(self, key, location):
+        segment_id, offset, size = location
+        start = _HEADER.size + len(key.encode())
+        if segment_id == self._active_id:
+            return os.pread(self._active_fd, size - start, offset + start)
+        return self._sealed[segment_id][0][offset + start:offset + size]
+
+    def _append(self, key, value):
+        key_data = key.encode()
+        body = _HEADER.pack(0, len(key_data), -1 if value is None else len(value))[4:] + key_data + (value or b'')
+        record = struct.pack('>I', zlib.crc32(body)) + body
+        with self._lock:
+            if self._closed:
+                raise ValueError("store is closed")
+            os.write(self._active_fd, record)
+            self._forget(key)
+            if value is not None:
+                self._index[key] = (self._active_id, self._active_size, len(record))
+            else:
+                self._active_garbage += len(record)
+            self._active_size += len(record)
+            self._unsynced += 1
+            if self._unsynced_since is None:
+                self._unsynced_since = time.monotonic()
+            if self._unsynced >= self._sync_every:
+                self.sync()
+            else:
+                self._sync_due()
+            if self._active_size >= self._segment_size:
+                self._seal()
+
+    def _seal(self):
+        self.sync()
+        os.close(self._active_fd)
+        self._sealed[self._active_id] = [self._map(self._active_id, self._active_size), self._active_size,
+                                         self._active_garbage]
+        self._active_id += 1
+        self._active_size = 0
+        self._active_garbage = 0
+        self._active_fd = os.open(self._segment_file(self._active_id), os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+        if self._needs_compaction():
+            self._compaction_wanted.set()
+
+    def _needs_compaction(self):
+        size = sum(segment[1] for segment in self._sealed.values())
+        garbage = sum(segment[2] for segment in self._sealed.values())
+        return len(self._sealed) > 1 and garbage > self._compaction_ratio * size
+
+    def _background_loop(self):
+        # compacts segments when asked and syncs writes which are not synced for sync_interval
+        while True:
+            wanted = self._compaction_wanted.wait(self._sync_interval)
+            if self._closed:
+                return
+            try:
+                self._sync_due()
+            except Exception:
+                logging.exception("sync of %s failed", self._path)
+            if not wanted:
+                continue
+            self._compaction_wanted.clear()
+            try:
+                self.compact()
+            except Exception:
+                logging.exception("compaction of %s failed", self._path)
+
+    def _sync_due(self):
+        with self._lock:
+            if (not self._closed and self._unsynced_since is not None
+                    and time.monotonic() - self._unsynced_since >= self._sync_interval):
+                self.sync()
@@ -1,5 +1,8 @@
 import argparse
+import copy
 import grpc
+import itertools
+import json
 import logging
 import os
 import queue
@@ -8,15 +11,26 @@ import signal
 import sys
 import threading
 import time
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
 from concurrent import futures
 from google.protobuf.any_pb2 import Any
 
 from .message import Message
+from .message_index import MessageIndex
+from .profiler import Profiler
+from .schedule import Action, SchedulePlayer, ScheduleRecorder
 from .proto import test_server_pb2 as pb
 from .proto import test_server_pb2_grpc as rpc
 
 
+# local messages such as key dumps of storage nodes can be much larger than the 4 MiB gRPC default
+MAX_GRPC_MESSAGE_SIZE = 256 * 2**20
+GRPC_OPTIONS = [
+    ('grpc.max_send_message_length', MAX_GRPC_MESSAGE_SIZE),
+    ('grpc.max_receive_message_length', MAX_GRPC_MESSAGE_SIZE),
+]
+
+
 class TestMode:
     WATCH = 'WATCH'
     CONTROL = 'CONTROL'
@@ -26,16 +40,22 @@ class Event:
     MESSAGE = 'message'
     TIMER = 'timer'
 
-    def __init__(self, event_id, event_type):
+    def __init__(self, event_id, event_type, create_time, seq=0):
         self._id = event_id
         self._type = event_type
-        self._create_time = time.time()
+        self._create_time = create_time
+        # order of creation, breaks ties of events with the same time
+        self._seq = seq
         self._time = None
 
     @property
     def id(self):
         return self._id
 
+    @property
+    def seq(self):
+        return self._seq
+
     @property
     def type(self):
         return self._type
@@ -54,17 +74,26 @@ class Event:
 
 
 class MessageEvent(Event):
-    def __init__(self, message_id, sender, recepient, raw_message):
-        super().__init__(message_id, Event.MESSAGE)
+    def __init__(self, message_id, sender, recepient, raw_message, create_time, message_type=None, seq=0,
+                 sender_addr=None):
+        super().__init__(message_id, Event.MESSAGE, create_time, seq)
         self._sender = sender
+        # address of the sender passed to the recepient, as reported by the sending client
+        self._sender_addr = sender_addr
         self._recepient = recepient
         self._raw_message = raw_message
+        self._message_type = message_type
+        self._message = None
         self._is_repeatable = True
 
     @property
     def sender(self):
         return self._sender
 
+    @property
+    def sender_addr(self):
+        return self._sender_addr
+
     @property
     def recepient(self):
         return self._recepient
@@ -73,10 +102,34 @@ class MessageEvent(Event):
     def raw_message(self):
         return self._raw_message
 
+    @property
+    def message_type(self):
+        if self._message_type is None:
+            return self.message.type
+        return self._message_type
+
+    @property
+    def message(self):
+        # payload is parsed only when inspected
+        if self._message is None:
+            self._message = Message.unmarshall(self._raw_message)
+        return self._message
+
+
+class _LazyMessage:
+    # formats raw message in log records only if they are emitted
+    __slots__ = ('_raw_message',)
+
+    def __init__(self, raw_message):
+        self._raw_message = raw_message
+
+    def __str__(self):
+        return str(Message.unmarshall(self._raw_message))
+
 
 class TimerEvent(Event):
-    def __init__(self, process_id, timer_id, name, interval):
-        super().__init__(timer_id, Event.TIMER)
+    def __init__(self, process_id, timer_id, name, interval, create_time, seq=0):
+        super().__init__(timer_id, Event.TIMER, create_time, seq)
         self._process_id = process_id
         self._name = name
         self._interval = interval
@@ -95,6 +148,27 @@ class TimerEvent(Event):
         return self._interval
 
 
+class Snapshot:
+    def __init__(self, processes, events, messages, local_messages, network, virtual_time, random_state):
+        self._processes = processes
+        self._events = events
+        self._messages = messages
+        self._local_messages = local_messages
+        self._network = network
+        self._virtual_time = virtual_time
+        self._random_state = random_state
+
+    @property
+    def processes(self):
+        # process id -> state returned by Process.snapshot()
+        return self._processes
+
+    @property
+    def local_messages(self):
+        # process id -> local messages not yet consumed by the test
+        return self._local_messages
+
+
 class TestServer(rpc.TestServerServicer):
 
     class ProcessHandler:
@@ -130,90 +204,128 @@ class TestServer(rpc.TestServerServicer):
             self._send_command(
                 pb.CrashCommand())
 
+        def take_snapshot(self, snapshot_id):
+            self._send_command(
+                pb.SnapshotCommand(
+                    snapshot_id=snapshot_id))
+
+        def restore(self, snapshot_id, state):
+            self._send_command(
+                pb.RestoreCommand(
+                    snapshot_id=snapshot_id,
+                    state=state))
+
         def stop(self):
             self._command_queue.put(None)
             self._context.cancel()
 
         def _process_events(self, stream):
+            profiler = self._server._profiler
             try:
                 for e in self._event_stream:
-                    if e.Is(pb.ProcessStartedEvent.DESCRIPTOR):
-                        event = pb.ProcessStartedEvent()
-                        e.Unpack(event)
-                        self._process_id = event.process_id
-                        self._server._on_process_started(self._process_id, event.address, self)
-
-                    if e.Is(pb.NewMessageEvent.DESCRIPTOR):
-                        event = pb.NewMessageEvent()
-                        e.Unpack(event)
-                        self._server._on_new_message(
-                            self._process_id, event.message_id, event.recepient, event.message)
-
-                    if e.Is(pb.MessageReceivedEvent.DESCRIPTOR):
-                        event = pb.MessageReceivedEvent()
-                        e.Unpack(event)
-                        self._server._on_message_received(self._process_id, event.message_id)
-
-                    if e.Is(pb.MessageDataReceivedEvent.DESCRIPTOR):
-                        event = pb.MessageDataReceivedEvent()
-                        e.Unpack(event)
-                        self._server._on_message_received(self._process_id, event.message_id, event.message)
-
-                    if e.Is(pb.MessageProcessedEvent.DESCRIPTOR):
-                        event = pb.MessageProcessedEvent()
-                        e.Unpack(event)
-                        self._server._on_message_processed(self._process_id, event.message_id)
-
-                    if e.Is(pb.NewTimerEvent.DESCRIPTOR):
-                        event = pb.NewTimerEvent()
-                        e.Unpack(event)
-                        self._server._on_new_timer(self._process_id, event.timer_id, event.name, event.interval)
-
-                    if e.Is(pb.TimerFiredEvent.DESCRIPTOR):
-                        event = pb.TimerFiredEvent()
-                        e.Unpack(event)
-                        self._server._on_timer_fired(self._process_id, event.timer_id)
-
-                    if e.Is(pb.TimerProcessedEvent.DESCRIPTOR):
-                        event = pb.TimerProcessedEvent()
-                        e.Unpack(event)
-                        self._server._on_timer_processed(self._process_id, event.timer_id)
-
-                    if e.Is(pb.TimerCanceledEvent.DESCRIPTOR):
-                        event = pb.TimerCanceledEvent()
-                        e.Unpack(event)
-                        self._server._on_timer_canceled(self._process_id, event.timer_id)
-
-                    if e.Is(pb.ProcessStoppedEvent.DESCRIPTOR):
-                        self._server._on_process_stopped(self._process_id)
-                        self._command_queue.put(None)
-                        return
+                    with profiler.phase('event', e.type_url):
+                        if e.Is(pb.ProcessStartedEvent.DESCRIPTOR):
+                            event = pb.ProcessStartedEvent()
+                            e.Unpack(event)
+                            self._process_id = event.process_id
+                            self._server._on_process_started(self._process_id, event.address, self)
+
+                        if e.Is(pb.NewMessageEvent.DESCRIPTOR):
+                            event = pb.NewMessageEvent()
+                            e.Unpack(event)
+                            self._server._on_new_message(
+                                self._process_id, event.message_id, event.recepient, event.message,
+                                event.message_type, event.is_local, event.sender)
+
+                        if e.Is(pb.MessageReceivedEvent.DESCRIPTOR):
+                            event = pb.MessageReceivedEvent()
+                            e.Unpack(event)
+                            self._server._on_message_received(self._process_id, event.message_id)
+
+                        if e.Is(pb.MessageDataReceivedEvent.DESCRIPTOR):
+                            event = pb.MessageDataReceivedEvent()
+                            e.Unpack(event)
+                            self._server._on_message_received(self._process_id, event.message_id, event.message)
+
+                        if e.Is(pb.MessageProcessedEvent.DESCRIPTOR):
+                            event = pb.MessageProcessedEvent()
+                            e.Unpack(event)
+                            self._server._on_message_processed(self._process_id, event.message_id, event.digest)
+
+                        if e.Is(pb.NewTimerEvent.DESCRIPTOR):
+                            event = pb.NewTimerEvent()
+                            e.Unpack(event)
+                            self._server._on_new_timer(self._process_id, event.timer_id, event.name, event.interval)
+
+                        if e.Is(pb.TimerFiredEvent.DESCRIPTOR):
+                            event = pb.TimerFiredEvent()
+                            e.Unpack(event)
+                            self._server._on_timer_fired(self._process_id, event.timer_id)
+
+                        if e.Is(pb.TimerProcessedEvent.DESCRIPTOR):
+                            event = pb.TimerProcessedEvent()
+                            e.Unpack(event)
+                            self._server._on_timer_processed(self._process_id, event.timer_id, event.digest)
+
+                        if e.Is(pb.TimerCanceledEvent.DESCRIPTOR):
+                            event = pb.TimerCanceledEvent()
+                            e.Unpack(event)
+                            self._server._on_timer_canceled(self._process_id, event.timer_id)
+
+                        if e.Is(pb.SnapshotTakenEvent.DESCRIPTOR):
+                            event = pb.SnapshotTakenEvent()
+                            e.Unpack(event)
+                            self._server._on_snapshot_taken(self._process_id, event.snapshot_id, event.state, event.error)
+
+                        if e.Is(pb.StateRestoredEvent.DESCRIPTOR):
+                            event = pb.StateRestoredEvent()
+                            e.Unpack(event)
+                            self._server._on_state_restored(self._process_id, event.snapshot_id, event.error)
+
+                        if e.Is(pb.ProcessStoppedEvent.DESCRIPTOR):
+                            self._server._on_process_stopped(self._process_id)
+                            self._command_queue.put(None)
+                            return
             except grpc.RpcError:
                 pass
 
         def _send_command(self, command):
-            c = Any()
-            c.Pack(command)
+            with self._server._profiler.phase('command pack'):
+                c = Any()
+                c.Pack(command)
             self._command_queue.put(c)
 
 
-    def __init__(self, addr):
+    def __init__(self, addr, seed=None):
         self._addr = addr
         self._test_mode = os.getenv('TEST_MODE', TestMode.CONTROL)
+        if seed is None:
+            seed = int(os.getenv('TEST_SEED', random.randrange(2**32)))
+        self._random = random.Random()
+        self._test_random = random.Random()
+        self._set_seed(seed)
+        logging.info("test server seed: %d", seed)
         self._processes = {}
         self._lookup = {}
         self._rev_lookup = {}
 
         self._events = []
-        self._messages = {}
+        self._messages = MessageIndex()
         self._processed_events = queue.Queue()
         self._local_messages = defaultdict(queue.Queue)
+        # futures of pipelined local messages waiting for replies: process -> request id -> future
+        self._local_waiters = defaultdict(OrderedDict)
+        self._local_requests = 0
+        self._local_lock = threading.Lock()
 
         self._real_time_mode = True
+        self._virtual_time = None
         self._event_reordering = False
         self._min_message_delay = 0
         self._max_message_delay = 0
         self._message_drop_rate = 0
+        self._sender_drop_rates = {}
+        self._network_model = None
         self._repeat_rate = 0
         self._repeat_event_times = 0
 
@@ -223,6 +335,20 @@ class TestServer(rpc.TestServerServicer):
         self._crashed_processes = set()
 
         self._message_count = 0
+        self._event_seq = itertools.count()
+
+        self._recorder = None
+        self._player = None
+
+        self._requests = {}
+        self._request_count = 0
+
+        self._server = None
+        self._profiler = Profiler()
+        self._event_listeners = []
+
+        # process id -> [raw digest, decoded digest, time of the last change]
+        self._digests = {}
 
         signal.signal(signal.SIGINT, self._stop_signal)
         signal.signal(signal.SIGTERM, self._stop_signal)
@@ -236,7 +362,7 @@ class TestServer(rpc.TestServerServicer):
     # Public
 
     def start(self, block=False):
-        self._server = grpc.server(futures.ThreadPoolExecutor(max_workers=64))
+        self._server = grpc.server(futures.ThreadPoolExecutor(max_workers=64), options=GRPC_OPTIONS)
         rpc.add_TestServerServicer_to_server(
             self, self._server)
         self._server.add_insecure_port(self._addr)
@@ -250,13 +376,39 @@ class TestServer(rpc.TestServerServicer):
             time.sleep(.01)
         return len(self._processes) == proc_count
 
+    @property
+    def seed(self):
+        return self._seed
+
+    @property
+    def random(self):
+        # tests should draw their random choices from here to be reproducible by seed
+        return self._test_random
+
+    def now(self):
+        if self._real_time_mode:
+            return time.time()
+        return self._virtual_time
+
     def set_real_time_mode(self, enabled):
+        if not enabled and self._real_time_mode:
+            self._virtual_time = time.time()
         self._real_time_mode = enabled
 
     def set_event_reordering(self, enabled):
         self._event_reordering = enabled
         if enabled:
-            self._real_time_mode = False
+            self.set_real_time_mode(False)
+
+    def record_schedule(self, path):
+        self._recorder = ScheduleRecorder(path, self._seed)
+
+    def replay_schedule(self, path):
+        self._player = SchedulePlayer(path)
+        if self._player.seed is not None:
+            self._set_seed(self._player.seed)
+        # timing is irrelevant during replay, the schedule defines the order
+        self.set_real_time_mode(False)
 
     def set_message_delay(self, min_delay, max_delay=None):
         self._min_message_delay = min_delay
@@ -265,93 +417,285 @@ class TestServer(rpc.TestServerServicer):
         else:
             self._max_message_delay = max_delay
 
-    def set_message_drop_rate(self, rate):
-        self._message_drop_rate = rate
+    def set_message_drop_rate(self, rate, sender=None):
+        if sender is None:
+            self._message_drop_rate = rate
+        else:
+            self._sender_drop_rates[sender] = rate
+
+    def set_network_model(self, model):
+        # per-link latency, bandwidth and loss (see dslib.network), overrides message delay settings
+        self._network_model = model
 
     def set_repeat_rate(self, rate, times):
         self._repeat_rate = rate
         self._repeat_event_times = times
 
+    def enable_profiling(self, cprofile=False, cprofile_path=None):
+        # phase timings (also enabled by DSLIB_PROFILE env variable) are printed at stop(),
+        # cprofile collects call statistics of step()
+        self._profiler.enable(cprofile, cprofile_path)
+
+    @property
+    def profiler(self):
+        return self._profiler
+
+    def set_message_index_limits(self, max_entries, max_bytes):
+        # bounds memory used for tracking messages in long runs
+        self._messages = MessageIndex(max_entries, max_bytes)
+
+    def message_stats(self):
+        # counters of message lifecycle: added, delivered, dropped, discarded, evicted, etc
+        return self._messages.stats()
+
+    def add_event_listener(self, listener):
+        # listener(event, action, time) is called for every processed event
+        self._event_listeners.append(listener)
+
+    def remove_event_listener(self, listener):
+        self._event_listeners.remove(listener)
+
+    def running_processes(self):
+        return list(self._processes)
+
+    def digest(self, process_id):
+        # the last state digest reported by the process (see Process.digest) or None
+        entry = self._digests.get(process_id)
+        return entry[1] if entry is not None else None
+
+    def step_until_stabilized(self, quiescent, timeout, processes=None, predicate=None):
+        # steps until state digests of the processes stop changing for `quiescent` seconds
+        # of test time and predicate(digests by process id) holds, nothing is sent to the
+        # processes. Returns False on timeout or if some process has not reported a digest.
+        if processes is None:
+            processes = self.running_processes()
+        deadline = time.time() + timeout
+        while True:
+            now = self.now()
+            entries = [self._digests.get(process_id) for process_id in processes]
+            stable_since = None
+            if all(entry is not None for entry in entries):
+                if predicate is None or predicate({p: e[1] for p, e in zip(processes, entries)}):
+                    stable_since = max(entry[2] for entry in entries)
+                    # compared with the same sum that step_until_time() moves the clock to,
+                    # the difference may be rounded below `quiescent`
+                    if now >= stable_since + quiescent:
+                        return True
+            next_time = self.next_event_time()
+            if next_time is None:
+                # no more events, digests cannot change anymore
+                return stable_since is not None
+            if time.time() >= deadline:
+                return False
+            if stable_since is not None and next_time > stable_since + quiescent:
+                self.step_until_time(stable_since + quiescent, deadline - time.time())
+            elif not self.step(max(deadline - time.time(), 0)):
+                return False
+
     def get_process_addr(self, proc_name):
         return self._lookup[proc_name]
 
     def step(self, timeout):
+        with self._profiler.phase('step'), self._profiler.profiled():
+            return self._step(timeout)
+
+    def _step(self, timeout):
         # stop if no pending events
         if len(self._events) == 0:
             logging.debug("no pending events")
             return False
 
-        # compute delays for new messages
-        for event in self._events:
-            if event.type == Event.MESSAGE and event.time is None:
-                if self._min_message_delay == 0 and self._max_message_delay == 0:
-                    if event.sender == event.recepient:
-                        delay = 0
-                    else:
-                        delay = .1
-                else:
-                    delay = self._min_message_delay + random.uniform(0, 1) * (self._max_message_delay - self._min_message_delay)
-                event.time = event.create_time + delay
-
-        # select next event
-        if not self._event_reordering:
-            # sort events by event time then select the earliest event
-            sorted_events = sorted(self._events, key=lambda e: e.time)
-            event = sorted_events[0]
-            self._events = sorted_events[1:]
-        else:
-            event = random.choice(self._events)
+        if self._player is not None:
+            return self._replay_step(timeout)
+
+        with self._profiler.phase('step select'):
+            self._assign_delays()
+            # messages sent by processes meanwhile get their delays on the next step
+            events = [e for e in self._events if e.time is not None]
+
+            # select next event
+            # (ties are broken by creation order, so messages with equal delays are delivered in send order)
+            if not self._event_reordering:
+                # a linear scan is enough, large batches of pipelined requests make sorting costly
+                event = min(events, key=lambda e: (e.time, e.seq))
+            else:
+                event = self._random.choice(sorted(events, key=lambda e: (e.time, e.seq)))
             self._events.remove(event)
 
         # process next event
         if self._real_time_mode:
             time_left = event.time - time.time()
             if time_left > 0:
-                time.sleep(time_left)
+                with self._profiler.phase('step sleep'):
+                    time.sleep(time_left)
+        elif event.time > self._virtual_time:
+            self._virtual_time = event.time
         logging.debug("next event %s", event.id)
 
         if event.type == Event.MESSAGE:
             message = event
             if message.recepient in self._crashed_processes:
-                logging.debug("discarded message %s to crashed process %s", message.id, message.recepient)
-                return True
-            if (
-                (message.sender not in self._drop_outgoing or message.sender == message.recepient)
-                and (message.recepient not in self._drop_incoming or message.sender == message.recepient)
-                and (message.sender, message.recepient) not in self._disabled_links
-                and random.uniform(0, 1) > self._message_drop_rate
-            ):
-                if event._is_repeatable and random.uniform(0, 1) < self._repeat_rate:
-                    for i in range(self._repeat_event_times):
-                        logging.debug("repeating message %s", message.id)
-                        event._is_repeatable = False
-                        self._events.append(event)
-                self._processes[message.recepient].receive_message(
-                        message.id, self._lookup[message.sender], message.raw_message)
-                try:
-                    while True:
-                        processed_id = self._processed_events.get(timeout=timeout)
-                        if processed_id == message.id:
-                            break
-                    return True
-                except queue.Empty:
-                    return False
+                action = Action.DISCARD
+            elif self._is_message_dropped(message):
+                action = Action.DROP
             else:
-                logging.debug("dropped message %s", message.id)
-                return True
+                action = Action.DELIVER
+            repeats = 0
+            if (action == Action.DELIVER and event._is_repeatable
+                    and self._random.uniform(0, 1) < self._repeat_rate):
+                repeats = self._repeat_event_times
+        else:
+            action = Action.FIRE
+            repeats = 0
 
-        elif event.type == Event.TIMER:
+        if self._recorder is not None:
+            self._recorder.record(event.id, action, repeats)
+        return self._process_event(event, action, repeats, timeout)
+
+    def next_event_time(self):
+        if len(self._events) == 0:
+            return None
+        self._assign_delays()
+        return min(e.time for e in self._events if e.time is not None)
+
+    def step_until_time(self, until, timeout):
+        # processes events scheduled before the given time, then moves the clock to it
+        while True:
+            next_time = self.next_event_time()
+            if next_time is None or next_time > until:
+                break
+            if not self.step(timeout):
+                return False
+        if self._real_time_mode:
+            time_left = until - time.time()
+            if time_left > 0:
+                time.sleep(time_left)
+        elif until > self._virtual_time:
+            self._virtual_time = until
+        return True
+
+    def pending_events(self):
+        return list(self._events)
+
+    def step_event(self, event_id, timeout):
+        event = self._wait_event(event_id, 0)
+        if event is None:
+            logging.debug("event %s is not pending", event_id)
+            return False
+        self._events.remove(event)
+        if not self._real_time_mode and event.time is not None and event.time > self._virtual_time:
+            self._virtual_time = event.time
+        logging.debug("next event %s (forced)", event.id)
+
+        if event.type == Event.MESSAGE:
+            if event.recepient in self._crashed_processes:
+                action = Action.DISCARD
+            else:
+                action = Action.DELIVER
+        else:
+            action = Action.FIRE
+        if self._recorder is not None:
+            self._recorder.record(event.id, action)
+        return self._process_event(event, action, 0, timeout)
+
+    def _replay_step(self, timeout):
+        entry = self._player.next()
+        if entry is None:
+            logging.debug("schedule replay finished")
+            self._player = None
+            return self._step(timeout)
+
+        event = self._wait_event(entry['event'], timeout)
+        if event is None:
+            logging.debug("replayed event %s did not occur", entry['event'])
+            return False
+        self._events.remove(event)
+        if not self._real_time_mode and event.time is not None and event.time > self._virtual_time:
+            self._virtual_time = event.time
+        logging.debug("next event %s (replay)", event.id)
+
+        if self._recorder is not None:
+            self._recorder.record(event.id, entry['action'], entry.get('repeats', 0))
+        return self._process_event(event, entry['action'], entry.get('repeats', 0), timeout)
+
+    def _wait_event(self, event_id, timeout):
+        # events are appended by the process handler threads and may lag behind
+        deadline = time.time() + timeout
+        while True:
+            for event in self._events:
+                if event.id == event_id:
+                    return event
+            if time.time() >= deadline:
+                return None
+            time.sleep(.001)
+
+    def _assign_delays(self):
+        # compute delays for new messages
+        for event in self._events:
+            if event.type == Event.MESSAGE and event.time is None:
+                event.time = event.create_time + self._message_delay(event)
+
+    def _message_delay(self, message):
+        if self._network_model is not None:
+            return self._network_model.delay(
+                message.sender, message.recepient, len(message.raw_message), message.create_time, self._random)
+        if self._min_message_delay == 0 and self._max_message_delay == 0:
+            if message.sender == message.recepient:
+                return 0
+            else:
+                return .1
+        return self._min_message_delay + self._random.uniform(0, 1) * (self._max_message_delay - self._min_message_delay)
+
+    def _is_message_dropped(self, message):
+        if message.sender == message.recepient:
+            return (message.sender, message.recepient) in self._disabled_links or \
+                self._random.uniform(0, 1) <= self._drop_rate(message)
+        return (
+            message.sender in self._drop_outgoing
+            or message.recepient in self._drop_incoming
+            or (message.sender, message.recepient) in self._disabled_links
+            or self._random.uniform(0, 1) <= self._drop_rate(message)
+            or (self._network_model is not None
+                and self._network_model.is_lost(message.sender, message.recepient, self._random))
+        )
+
+    def _drop_rate(self, message):
+        return self._sender_drop_rates.get(message.sender, self._message_drop_rate)
+
+    def _process_event(self, event, action, repeats, timeout):
+        for listener in self._event_listeners:
+            listener(event, action, self.now())
+
+        if action == Action.DISCARD:
+            logging.debug("discarded message %s to crashed process %s", event.id, event.recepient)
+            self._messages.mark_discarded(event.id)
+            return True
+
+        if action == Action.DROP:
+            logging.debug("dropped message %s", event.id)
+            self._messages.mark_dropped(event.id)
+            return True
+
+        if event.type == Event.MESSAGE:
+            message = event
+            for i in range(repeats):
+                logging.debug("repeating message %s", message.id)
+                event._is_repeatable = False
+                self._events.append(event)
+            self._processes[message.recepient].receive_message(message.id, message.sender_addr, message.raw_message)
+        else:
             timer = event
             self._processes[timer.process_id].fire_timer(timer.id)
-            try:
+
+        try:
+            with self._profiler.phase('step wait'):
                 while True:
                     processed_id = self._processed_events.get(timeout=timeout)
-                    if processed_id == timer.id:
+                    if processed_id == event.id:
                         break
-                return True
-            except queue.Empty:
-                return False
             return True
+        except queue.Empty:
+            return False
 
     def steps(self, count, timeout):
         for _ in range(0, count):
@@ -393,6 +737,49 @@ class TestServer(rpc.TestServerServicer):
                 return False
         return True
 
+    def send_local_messages(self, messages, timeout=1):
+        # pipelined version of send_local_message: submits (process id, message) pairs
+        # without waiting for each of them and returns futures resolved with replies
+        # in the same order. Messages carry request ids which replies echo (see Context.send_local),
+        # a reply without request id resolves the oldest pending future of its process.
+        pending = []
+        for recepient, message in messages:
+            logging.debug("sent local message to %s: %s", recepient, message)
+            future = futures.Future()
+            with self._local_lock:
+                self._local_requests += 1
+                request_id = self._local_requests
+                self._local_waiters[recepient][request_id] = future
+            self._processes[recepient].receive_local_message(
+                message.with_request_id(request_id).marshall(sender='local', message_id='local'))
+            pending.append(future)
+        if self._test_mode == TestMode.CONTROL:
+            deadline = time.time() + timeout
+            processed = 0
+            try:
+                while processed < len(pending):
+                    if self._processed_events.get(timeout=max(deadline - time.time(), 0)) == 'local':
+                        processed += 1
+            except queue.Empty:
+                logging.debug("%d of %d local messages were not processed in time", len(pending) - processed, len(pending))
+        return pending
+
+    def step_until_resolved(self, pending, timeout):
+        # steps until all futures returned by send_local_messages are resolved
+        deadline = time.time() + timeout
+        while not all(f.done() for f in pending):
+            time_left = deadline - time.time()
+            if time_left <= 0 or not self.step(time_left):
+                return False
+        return True
+
+    def drain_local_messages(self, process_id):
+        messages = []
+        q = self._local_messages[process_id]
+        while not q.empty():
+            messages.append(q.get())
+        return messages
+
     def wait_local_message(self, process_id, timeout):
         try:
             return self._local_messages[process_id].get(timeout=timeout)
@@ -442,17 +829,84 @@ class TestServer(rpc.TestServerServicer):
         time.sleep(.1)
         handler.stop()
         self._crashed_processes.add(process_id)
+        self._digests.pop(process_id, None)
         logging.debug("[%s] crashed", process_id)
+        with self._local_lock:
+            waiters = self._local_waiters.pop(process_id, {})
+        for future in waiters.values():
+            future.set_exception(RuntimeError("[%s] crashed before reply" % process_id))
         new_events = []
         for e in self._events:
             if e.type == Event.MESSAGE and (e.sender == process_id or e.recepient == process_id):
                 logging.debug("discarded message %s", e.id)
+                self._messages.mark_discarded(e.id)
             elif e.type == Event.TIMER and e.process_id == process_id:
                 logging.debug("discarded timer %s", e.id)
             else:
                 new_events.append(e)
         self._events = new_events
 
+    def snapshot_process(self, process_id, timeout=1):
+        request_id, future = self._new_request()
+        self._processes[process_id].take_snapshot(request_id)
+        return self._wait_request(request_id, future, timeout)
+
+    def restore_process(self, process_id, state, timeout=1):
+        request_id, future = self._new_request()
+        self._processes[process_id].restore(request_id, state)
+        self._wait_request(request_id, future, timeout)
+
+    def snapshot(self, timeout=1):
+        # should be taken between steps, when no process is handling an event
+        requests = {}
+        for process_id, handler in self._processes.items():
+            requests[process_id] = self._new_request()
+            handler.take_snapshot(requests[process_id][0])
+        states = {}
+        for process_id, (request_id, future) in requests.items():
+            states[process_id] = self._wait_request(request_id, future, timeout)
+        return Snapshot(
+            states,
+            copy.deepcopy(self._events),
+            self._messages.copy(),
+            {process_id: list(q.queue) for process_id, q in self._local_messages.items()},
+            self._network_state(),
+            self._virtual_time,
+            self._random.getstate())
+
+    def restore(self, snapshot, timeout=1):
+        # crashed processes should be restarted by the test before restoring
+        missing = [process_id for process_id in snapshot.processes if process_id not in self._processes]
+        if len(missing) > 0:
+            raise RuntimeError("cannot restore snapshot, processes are not running: %s" % ', '.join(missing))
+        requests = {}
+        for process_id, state in snapshot.processes.items():
+            requests[process_id] = self._new_request()
+            self._processes[process_id].restore(requests[process_id][0], state)
+        for process_id, (request_id, future) in requests.items():
+            self._wait_request(request_id, future, timeout)
+
+        self._events = copy.deepcopy(snapshot._events)
+        self._messages = snapshot._messages.copy()
+        with self._local_lock:
+            waiters = [f for q in self._local_waiters.values() for f in q.values()]
+            self._local_waiters.clear()
+        for future in waiters:
+            future.cancel()
+        self._local_messages.clear()
+        # digests are reported again when restored processes handle events
+        self._digests.clear()
+        for process_id, messages in snapshot._local_messages.items():
+            for message in messages:
+                self._local_messages[process_id].put(message)
+        while not self._processed_events.empty():
+            self._processed_events.get()
+        self._set_network_state(snapshot._network)
+        if snapshot._virtual_time is not None:
+            self._virtual_time = snapshot._virtual_time
+        self._random.setstate(snapshot._random_state)
+        logging.debug("restored snapshot of %d processes", len(snapshot.processes))
+
     def stop(self, wait_processes=True, wait_timeout=1):
         if wait_processes:
             start = time.time()
@@ -465,7 +919,62 @@ class TestServer(rpc.TestServerServicer):
         if not wait_processes:
             for handler in list(self._processes.values()):
                 handler.stop()
-        self._server.stop(None)
+        if self._recorder is not None:
+            self._recorder.close()
+        if self._server is not None:
+            # not started when all processes run in-process (see sim.Simulation)
+            self._server.stop(None)
+        logging.debug("message stats: %s", self._messages.stats())
+        self._profiler.report('test server')
+
+    def _new_request(self):
+        self._request_count += 1
+        request_id = 'snapshot-%d' % self._request_count
+        future = futures.Future()
+        self._requests[request_id] = future
+        return request_id, future
+
+    def _wait_request(self, request_id, future, timeout):
+        try:
+            return future.result(timeout=timeout)
+        except futures.TimeoutError:
+            raise RuntimeError("request %s timed out" % request_id)
+        finally:
+            self._requests.pop(request_id, None)
+
+    def _network_state(self):
+        return {
+            'min_message_delay': self._min_message_delay,
+            'max_message_delay': self._max_message_delay,
+            'message_drop_rate': self._message_drop_rate,
+            'sender_drop_rates': dict(self._sender_drop_rates),
+            'network_model': copy.deepcopy(self._network_model),
+            'repeat_rate': self._repeat_rate,
+            'repeat_event_times': self._repeat_event_times,
+            'event_reordering': self._event_reordering,
+            'disabled_links': set(self._disabled_links),
+            'drop_incoming': set(self._drop_incoming),
+            'drop_outgoing': set(self._drop_outgoing),
+        }
+
+    def _set_network_state(self, state):
+        self._min_message_delay = state['min_message_delay']
+        self._max_message_delay = state['max_message_delay']
+        self._message_drop_rate = state['message_drop_rate']
+        self._sender_drop_rates = dict(state['sender_drop_rates'])
+        self._network_model = copy.deepcopy(state['network_model'])
+        self._repeat_rate = state['repeat_rate']
+        self._repeat_event_times = state['repeat_event_times']
+        self._event_reordering = state['event_reordering']
+        self._disabled_links = set(state['disabled_links'])
+        self._drop_incoming = set(state['drop_incoming'])
+        self._drop_outgoing = set(state['drop_outgoing'])
+
+    def _set_seed(self, seed):
+        self._seed = seed
+        self._random.seed(seed)
+        # separate stream for tests, so that their choices do not depend on network randomness
+        self._test_random.seed(self._random.getrandbits(64))
 
     # Process Event Handlers
 
@@ -473,6 +982,9 @@ class TestServer(rpc.TestServerServicer):
         logging.debug("[%s] started on %s", process_id, address)
         if process_id in self._crashed_processes:
             self._crashed_processes.remove(process_id)
+        if process_id in self._lookup:
+            # restarted process numbers its messages from the start again
+            self._messages.forget_sender(process_id)
         self._processes[process_id] = handler
         self._lookup[process_id] = address
         self._rev_lookup[address] = process_id
@@ -482,62 +994,116 @@ class TestServer(rpc.TestServerServicer):
             logging.debug("[%s] stopped", process_id)
         del self._processes[process_id]
 
-    def _on_new_message(self, process_id, message_id, recepient, raw_message):
-        message = Message.unmarshall(raw_message)
-        if message.is_local():
+    def _on_new_message(self, process_id, message_id, recepient, raw_message, message_type='', is_local=False,
+                        sender=''):
+        message = None
+        if not message_type:
+            # client without routing fields
+            with self._profiler.phase('unmarshall'):
+                message = Message.unmarshall(raw_message)
+            message_type, is_local, sender = message.type, message.is_local(), message.sender
+        if is_local:
+            # local messages are inspected by tests anyway
+            if message is None:
+                with self._profiler.phase('unmarshall'):
+                    message = Message.unmarshall(raw_message)
             logging.debug("[%s] sent local message: %s", process_id, message)
-            self._local_messages[process_id].put(message)
+            request_id = message.request_id
+            message = message.without_request_id()
+            with self._local_lock:
+                waiters = self._local_waiters.get(process_id)
+                future = None
+                if waiters and request_id in waiters:
+                    future = waiters.pop(request_id)
+                elif waiters and request_id is None:
+                    future = waiters.popitem(last=False)[1]
+            if future is not None:
+                future.set_result(message)
+            else:
+                self._local_messages[process_id].put(message)
         else:
             recepient_id = self._rev_lookup[recepient]
-            logging.debug("[%s] sent message %s to %s: %s", process_id, message_id, recepient_id, message)
+            logging.debug("[%s] sent message %s to %s: %s",
+                          process_id, message_id, recepient_id, _LazyMessage(raw_message))
             if self._test_mode == TestMode.CONTROL:
-                event = MessageEvent(message_id, process_id, recepient_id, raw_message)
+                event = MessageEvent(message_id, process_id, recepient_id, raw_message, self.now(), message_type,
+                                     next(self._event_seq), sender)
                 self._events.append(event)
-                self._messages[message_id] = message
+                self._messages.add(message_id, raw_message, process_id)
             self._message_count += 1
 
     def _on_message_received(self, process_id, message_id, raw_message=None):
+        if raw_message is None:
+            raw_message = self._messages.get(message_id)
+        if message_id != 'local':
+            self._messages.mark_delivered(message_id)
         if raw_message is not None:
-            message = Message.unmarshall(raw_message)
-        else:
-            message = self._messages.pop(message_id, None)
-        if message is not None:
-            if message.is_local():
-                logging.debug("[%s] received local message: %s", process_id, message)
+            if message_id == 'local':
+                logging.debug("[%s] received local message: %s", process_id, _LazyMessage(raw_message))
             else:
-                logging.debug("[%s] received message %s: %s", process_id, message_id, message)
+                logging.debug("[%s] received message %s: %s", process_id, message_id, _LazyMessage(raw_message))
         else:
             if message_id == 'local':
                 logging.debug("[%s] received local message", process_id)
             else:
                 logging.debug("[%s] received message %s", process_id, message_id)
 
-    def _on_message_processed(self, process_id, message_id):
+    def _on_message_processed(self, process_id, message_id, digest=''):
         if message_id == 'local':
             logging.debug("[%s] processed local message", process_id)
         else:
             logging.debug("[%s] processed message %s", process_id, message_id)
+        self._update_digest(process_id, digest)
         self._processed_events.put(message_id)
 
     def _on_new_timer(self, process_id, timer_id, name, interval):
         if self._test_mode == TestMode.CONTROL:
             # set timer intervals to 1 during testing
             # interval = 1
-            event = TimerEvent(process_id, timer_id, name, interval)
+            event = TimerEvent(process_id, timer_id, name, interval, self.now(), next(self._event_seq))
             self._events.append(event)
         logging.debug("[%s] set timer %s: %s, %.1fs", process_id, timer_id, name, interval)
 
     def _on_timer_fired(self, process_id, timer_id):
         logging.debug("[%s] fired timer %s", process_id, timer_id)
 
-    def _on_timer_processed(self, process_id, timer_id):
+    def _on_timer_processed(self, process_id, timer_id, digest=''):
         logging.debug("[%s] processed timer %s", process_id, timer_id)
+        self._update_digest(process_id, digest)
         self._processed_events.put(timer_id)
 
+    def _update_digest(self, process_id, digest):
+        if not digest:
+            return
+        entry = self._digests.get(process_id)
+        if entry is None or entry[0] != digest:
+            logging.debug("[%s] state digest changed: %s", process_id, digest)
+            self._digests[process_id] = [digest, json.loads(digest), self.now()]
+
     def _on_timer_canceled(self, process_id, timer_id):
         logging.debug("[%s] canceled timer %s", process_id, timer_id)
         self._events = [e for e in self._events if e.id != timer_id]
 
+    def _on_snapshot_taken(self, process_id, snapshot_id, state, error):
+        logging.debug("[%s] took snapshot %s", process_id, snapshot_id)
+        future = self._requests.get(snapshot_id)
+        if future is None:
+            return
+        if error:
+            future.set_exception(RuntimeError("[%s] %s" % (process_id, error)))
+        else:
+            future.set_result(state)
+
+    def _on_state_restored(self, process_id, snapshot_id, error):
+        logging.debug("[%s] restored state from %s", process_id, snapshot_id)
+        future = self._requests.get(snapshot_id)
+        if future is None:
+            return
+        if error:
+            future.set_exception(RuntimeError("[%s] %s" % (process_id, error)))
+        else:
+            future.set_result(None)
+
     # Misc
 
     def _stop_signal(self, signum, frame):
@@ -4,6 +4,10 @@ import socket
 import time
 
 
+# maximum payload of a UDP datagram over IPv4
+MAX_DATAGRAM_SIZE = 65507
+
+
 class Transport:
 
     def __init__(self, addr):
@@ -53,7 +57,7 @@ class UDPTransport(Transport):
         while not self._stopped and (timeout is None or time.time() <= deadline):
             ready = select.select([self._sock], [], [], 0.1)
             if ready[0]:
-                data, _ = self._sock.recvfrom(4096)
+                data, _ = self._sock.recvfrom(MAX_DATAGRAM_SIZE)
                 return data
         return None
 
@@ -0,0 +1,251 @@
+import base64
+
+
+class Order:
+    BEFORE = 'before'
+    AFTER = 'after'
+    EQUAL = 'equal'
+    CONCURRENT = 'concurrent'
+
+
+class VectorClock:
+    # immutable vector clock, entries with zero counters are not stored, so equal clocks have equal entries
+
+    __slots__ = ('_entries',)
+
+    def __init__(self, entries=None):
+        self._entries = {node: counter for node, counter in (entries or {}).items() if counter > 0}
+
+    @property
+    def entries(self):
+        return dict(self._entries)
+
+    def get(self, node):
+        return self._entries.get(node, 0)
+
+    def increment(self, node):
+        entries = dict(self._entries)
+        entries[node] = entries.get(node, 0) + 1
+        return VectorClock(entries)
+
+    def merge(self, other):
+        entries = dict(self._entries)
+        for node, counter in other._entries.items():
+            if counter > entries.get(node, 0):
+                entries[node] = counter
+        return VectorClock(entries)
+
+    def descends(self, other):
+        # all events seen by other are seen by this clock
+        return all(self.get(node) >= counter for node, counter in other._entries.items())
+
+    def compare(self, other):
+        descends = self.descends(other)
+        descended = other.descends(self)
+        if descends and descended:
+            return Order.EQUAL
+        if descends:
+            return Order.AFTER
+        if descended:
+            return Order.BEFORE
+        return Order.CONCURRENT
+
+    def prune(self, max_entries):
+        # drops the entries with the smallest counters, a pruned clock no longer descends
+        # some versions, so they show up as siblings instead of being silently discarded
+        if len(self._entries) <= max_entries:
+            return self
+        kept = sorted(self._entries.items(), key=lambda e: (-e[1], e[0]))[:max_entries]
+        return VectorClock(dict(kept))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __eq__(self, other):
+        return isinstance(other, VectorClock) and self._entries == other._entries
+
+    def __hash__(self):
+        return hash(frozenset(self._entries.items()))
+
+    def __repr__(self):
+        return 'VectorClock(%r)' % self._entries
+
+
+class DottedVersionVector:
+    # causal context: a vector clock plus dots (node, counter) which are not contiguous with it,
+    # so concurrent writes coordinated by the same node are not mistaken for successive ones
+
+    __slots__ = ('_clock', '_dots')
+
+    def __init__(self, clock=None, dots=()):
+        entries = clock.entries if clock is not None else {}
+        pending = set()
+        for node, counter in dots:
+            if counter > entries.get(node, 0):
+                pending.add((node, counter))
+        for node, counter in sorted(pending):
+            if counter == entries.get(node, 0) + 1:
+                entries[node] = counter
+                pending.discard((node, counter))
+        self._clock = VectorClock(entries)
+        self._dots = frozenset((node, counter) for node, counter in pending if counter > entries.get(node, 0))
+
+    @property
+    def clock(self):
+        return self._clock
+
+    @property
+    def dots(self):
+        return self._dots
+
+    def covers(self, node, counter):
+        return counter <= self._clock.get(node) or (node, counter) in self._dots
+
+    def max_counter(self, node):
+        return max([self._clock.get(node)] + [c for n, c in self._dots if n == node])
+
+    def add(self, node, counter):
+        return DottedVersionVector(self._clock, self._dots | {(node, counter)})
+
+    def merge(self, other):
+        return DottedVersionVector(self._clock.merge(other._clock), self._dots | other._dots)
+
+    def encode(self):
+        # compact form for client responses, node names are written once and all numbers are varints
+        names = sorted(set(self._clock.entries) | {node for node, _ in self._dots})
+        index = {name: i for i, name in enumerate(names)}
+        out = bytearray()
+        _write_varint(out, len(names))
+        for name in names:
+            data = name.encode()
+            _write_varint(out, len(data))
+            out += data
+            _write_varint(out, self._clock.get(name))
+        _write_varint(out, len(self._dots))
+        for node, counter in sorted(self._dots):
+            _write_varint(out, index[node])
+            _write_varint(out, counter)
+        return base64.urlsafe_b64encode(bytes(out)).rstrip(b'=').decode()
+
+    @staticmethod
+    def decode(text):
+        if not text:
+            return DottedVersionVector()
+        data = base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+        pos = 0
+        count, pos = _read_varint(data, pos)
+        names = []
+        entries = {}
+        for _ in range(count):
+            size, pos = _read_varint(data, pos)
+            name = data[pos:pos + size].decode()
+            pos += size
+            entries[name], pos = _read_varint(data, pos)
+            names.append(name)
+        count, pos = _read_varint(data, pos)
+        dots = []
+        for _ in range(count):
+            i, pos = _read_varint(data, pos)
+            counter, pos = _read_varint(data, pos)
+            dots.append((names[i], counter))
+        return DottedVersionVector(VectorClock(entries), dots)
+
+    def __eq__(self, other):
+        return isinstance(other, DottedVersionVector) and self._clock == other._clock and self._dots == other._dots
+
+    def __hash__(self):
+        return hash((self._clock, self._dots))
+
+    def __repr__(self):
+        return 'DottedVersionVector(%r, %r)' % (self._clock.entries, sorted(self._dots))
+
+
+class Version:
+    # value written by the event dot (node, counter) with the causal context seen by the writer
+
+    __slots__ = ('_value', '_dot', '_context')
+
+    def __init__(self, value, node, counter, context=None):
+        self._value = value
+        self._dot = (node, counter)
+        self._context = context if context is not None else DottedVersionVector()
+
+    @property
+    def value(self):
+        return self._value
+
+    @property
+    def dot(self):
+        return self._dot
+
+    @property
+    def context(self):
+        return self._context
+
+    def clock(self):
+        # context of a write which has seen this version
+        return self._context.add(*self._dot)
+
+    def metadata(self):
+        return self.clock().encode()
+
+    def marshall(self):
+        return [self._value, self._dot[0], self._dot[1], self._context.encode()]
+
+    @staticmethod
+    def unmarshall(data):
+        value, node, counter, context = data
+        return Version(value, node, counter, DottedVersionVector.decode(context))
+
+    def __eq__(self, other):
+        return isinstance(other, Version) and self._dot == other._dot
+
+    def __hash__(self):
+        return hash(self._dot)
+
+    def __repr__(self):
+        return 'Version(%r, %r, %r)' % (self._value, self._dot, self._context)
+
+
+def reconcile(versions):
+    # returns versions not obsoleted by other ones (siblings) sorted by dot, contexts are merged
+    # into a maximum counter per node and a set of dots, so it takes linear time
+    unique = {}
+    for version in versions:
+        unique.setdefault(version.dot, version)
+    seen = {}
+    dots = set()
+    for version in unique.values():
+        for node, counter in version.context.clock.entries.items():
+            if counter > seen.get(node, 0):
+                seen[node] = counter
+        dots |= version.context.dots
+    return [version for dot, version in sorted(unique.items())
+            if dot[1] > seen.get(dot[0], 0) and dot not in dots]
+
+
+def join(versions):
+    # context covering all given versions, a write with it supersedes all of them
+    context = DottedVersionVector()
+    for version in versions:
+        context = context.merge(version.clock())
+    return context
+
+
+def _write_varint(out, value):
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, pos):
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
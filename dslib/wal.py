@@ -0,0 +1,182 @@
+import json
+import logging
+import os
+import struct
+import threading
+import zlib
+
+
+# crc32 and length of the JSON body of a record
+_HEADER = struct.Struct('>II')
+_SNAPSHOT = 'snapshot.json'
+
+
+class WriteAheadLog:
+    # durable log of JSON records with group commit: the first writer waiting in commit() writes and syncs
+    # the whole buffer for all, the log is split into segments which are removed when covered by a snapshot
+
+    def __init__(self, path, group_commit=True):
+        self._path = path
+        self._group_commit = group_commit
+        self._cond = threading.Condition()
+        self._pending = bytearray()
+        self._flushing = False
+        self._seq = 0
+        self._durable = 0
+        self._syncs = 0
+        self._snapshots = 0
+        self._closed = False
+        # the first IO error, after it the log refuses appends and commits, since records of the failed
+        # group may be partly on disk and fsync errors are not reported again
+        self._error = None
+        os.makedirs(path, exist_ok=True)
+        self._snapshot_seq, self._snapshot_state, self._records = self._load()
+        if len(self._records) > 0:
+            self._seq = self._records[-1][0]
+        self._seq = self._durable = max(self._seq, self._snapshot_seq)
+        self._fd = self._open_segment(self._seq + 1)
+
+    @property
+    def seq(self):
+        return self._seq
+
+    def recover(self):
+        # returns the state of the last snapshot (or None) and the records appended after it
+        return self._snapshot_state, [record for _, record in self._records]
+
+    def append(self, record):
+        with self._cond:
+            if self._closed:
+                raise ValueError("log is closed")
+            self._check()
+            self._seq += 1
+            body = json.dumps([self._seq, record]).encode()
+            data = _HEADER.pack(zlib.crc32(body), len(body)) + body
+            if self._group_commit:
+                self._pending += data
+            else:
+                try:
+                    os.write(self._fd, data)
+                    os.fsync(self._fd)
+                except OSError as e:
+                    self._error = e
+                    raise
+                self._syncs += 1
+                self._durable = self._seq
+            return self._seq
+
+    def commit(self, seq):
+        # waits until the record with the given sequence number and all records before it are on disk
+        with self._cond:
+            while self._durable < seq:
+                self._check()
+                if self._flushing:
+                    self._cond.wait()
+                    continue
+                self._flush()
+
+    def rotate(self):
+        # starts a new segment, returns the sequence number of the last record of the previous one
+        with self._cond:
+            while self._flushing:
+                self._cond.wait()
+            self._check()
+            if len(self._pending) > 0:
+                self._flush()
+            os.close(self._fd)
+            self._fd = self._open_segment(self._seq + 1)
+            return self._seq
+
+    def snapshot(self, state, seq):
+        # state must include all records up to seq and none after it, see rotate()
+        tmp = os.path.join(self._path, _SNAPSHOT + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump({'seq': seq, 'state': state}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp, os.path.join(self._path, _SNAPSHOT))
+        segments = self._segments()
+        for i, first in enumerate(segments[:-1]):
+            # a segment is covered if the next one starts after the snapshot
+            if segments[i + 1] <= seq + 1:
+                os.remove(self._segment_file(first))
+        with self._cond:
+            self._snapshots += 1
+        logging.debug("%s: snapshot at record %d", self._path, seq)
+
+    def stats(self):
+        with self._cond:
+            return {'records': self._seq, 'syncs': self._syncs, 'snapshots': self._snapshots,
+                    'segments': len(self._segments())}
+
+    def close(self):
+        try:
+            self.commit(self._seq)
+        finally:
+            with self._cond:
+                if not self._closed:
+                    self._closed = True
+                    os.close(self._fd)
+
+    def _check(self):
+        if self._error is not None:
+            raise OSError("%s: log failed: %s" % (self._path, self._error))
+
+    def _flush(self):
+        # called with the lock held by the leader of a group, the lock is released for IO,
+        # so that other writers can append records to the next group meanwhile
+        data = self._pending
+        seq = self._seq
+        fd = self._fd
+        self._pending = bytearray()
+        self._flushing = True
+        self._cond.release()
+        try:
+            os.write(fd, data)
+            os.fsync(fd)
+        except OSError as e:
+            self._error = e
+            raise
+        finally:
+            self._cond.acquire()
+            self._flushing = False
+            self._cond.notify_all()
+        self._syncs += 1
+        self._durable = seq
+
+    def _segment_file(self, first):
+        return os.path.join(self._path, '%012d.wal' % first)
+
+    def _segments(self):
+        return sorted(int(name[:-4]) for name in os.listdir(self._path) if name.endswith('.wal'))
+
+    def _open_segment(self, first):
+        return os.open(self._segment_file(first), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+
+    def _load(self):
+        snapshot_seq, state = 0, None
+        snapshot = os.path.join(self._path, _SNAPSHOT)
+        if os.path.exists(snapshot):
+            with open(snapshot) as f:
+                data = json.load(f)
+            snapshot_seq, state = data['seq'], data['state']
+        records = []
+        for first in self._segments():
+            with open(self._segment_file(first), 'rb') as f:
+                data = f.read()
+            offset = 0
+            while offset + _HEADER.size <= len(data):
+                crc, size = _HEADER.unpack_from(data, offset)
+                body = data[offset + _HEADER.size:offset + _HEADER.size + size]
+                if len(body) < size or zlib.crc32(body) != crc:
+                    break
+                seq, record = json.loads(body)
+                if seq > snapshot_seq:
+                    records.append((seq, record))
+                offset += _HEADER.size + size
+            if offset < len(data):
+                # a torn write of the last group, none of its records were acknowledged
+                logging.warning("%s: dropping %d bytes at the end of segment %d", self._path, len(data) - offset, first)
+                with open(self._segment_file(first), 'r+b') as f:
+                    f.truncate(offset)
+        return snapshot_seq, state, records
@@ -3,13 +3,14 @@
 import argparse
 import logging
 import os
-import random
 import subprocess
 import sys
 import threading
 import unittest
 
+from dslib.explorer import Explorer, Model
 from dslib.message import Message
+from dslib.sim import Simulation
 from dslib.test_server import TestMode, TestServer
 
 
@@ -32,17 +33,20 @@ def run_peer(impl_dir, name, addr, peer_list, ts_addr, debug):
 
 
 class BaseTestCase(unittest.TestCase):
-    def __init__(self, impl_dir, debug=False):
+    def __init__(self, impl_dir, debug=False, in_process=False):
         super(BaseTestCase, self).__init__()
         self.impl_dir = impl_dir
         self.debug = debug
+        self.in_process = in_process
 
     def setUp(self):
         super(BaseTestCase, self).setUp()
         sys.stderr.write("\n\n" + self.__class__.__name__ + " " + "-" * 60 + "\n\n")
 
         self.ts = TestServer(TEST_SERVER_ADDR)
-        self.ts.start()
+        self.sim = Simulation(self.ts, self.debug) if self.in_process else None
+        if self.sim is None:
+            self.ts.start()
         self.peers = []
         self.peer_processes = []
         peer_list = []
@@ -52,15 +56,21 @@ class BaseTestCase(unittest.TestCase):
         for i in range(5):
             peer_name = PEER_NAMES[i]
             self.peers.append(peer_name)
+            if self.sim is not None:
+                self.sim.run_program(os.path.join(self.impl_dir, 'peer.py'),
+                                     ['-n', peer_name, '-l', peer_list[i], '-p', ','.join(peer_list)], peer_name)
+                continue
             proc = run_peer(self.impl_dir, peer_name, peer_list[i], peer_list, TEST_SERVER_ADDR, self.debug)
             self.peer_processes.append(proc)
 
     def tearDown(self):
-        for i in range(5):
-            self.peer_processes[i].terminate()
+        if self.sim is not None:
+            self.sim.stop()
+        for proc in self.peer_processes:
+            proc.terminate()
         self.ts.stop()
-        for i in range(5):
-            self.peer_processes[i].kill()
+        for proc in self.peer_processes:
+            proc.kill()
 
 
 class BasicTestCase(BaseTestCase):
@@ -219,19 +229,19 @@ class TwoCrashesRandomTestCase(BaseTestCase):
         # send message from Eve
         self.ts.send_local_message(self.peers[4], Message('SEND', 'Hello'))
 
-        for _ in range(random.randint(0,10)):
+        for _ in range(self.ts.random.randint(0,10)):
             self.ts.step(1)
 
         # crash Alice
         self.ts.crash_process(self.peers[0])
 
-        for _ in range(random.randint(0,10)):
+        for _ in range(self.ts.random.randint(0,10)):
             self.ts.step(1)
 
         # crash Bob
         self.ts.crash_process(self.peers[1])
 
-        for _ in range(random.randint(0,10)):
+        for _ in range(self.ts.random.randint(0,10)):
             self.ts.step(1)
         
         # deliver the message
@@ -269,19 +279,19 @@ class ThreeCrashesRandomTestCase(BaseTestCase):
         # send message from Eve
         self.ts.send_local_message(self.peers[4], Message('SEND', 'Hello'))
 
-        for _ in range(random.randint(0,10)):
+        for _ in range(self.ts.random.randint(0,10)):
             self.ts.step(1)
 
         # crash Alice
         self.ts.crash_process(self.peers[0])
 
-        for _ in range(random.randint(0,10)):
+        for _ in range(self.ts.random.randint(0,10)):
             self.ts.step(1)
 
         # crash Bob
         self.ts.crash_process(self.peers[1])
 
-        for _ in range(random.randint(0,10)):
+        for _ in range(self.ts.random.randint(0,10)):
             self.ts.step(1)
         
         # crash Carl
@@ -313,29 +323,78 @@ class ThreeCrashesRandomTestCase(BaseTestCase):
             "Agreement property is not satisfied: correct - " + str(correct_delivered) + "/2, crashed - " + str(crashed_delivered) + "/3")
 
 
+class OrderedModel(Model):
+    # Carl sends two messages, every peer should deliver them in the sent order
+    # whatever the order of message deliveries
+
+    def __init__(self, impl_dir, peers=3):
+        self.impl_dir = impl_dir
+        self.peers = peers
+
+    def setup(self, worker):
+        ts_addr = '127.0.0.1:%d' % (9800 + worker)
+        peer_list = ['127.0.0.1:%d' % (9810 + worker * 10 + i) for i in range(self.peers)]
+        ts = TestServer(ts_addr)
+        ts.start()
+        ts.set_real_time_mode(False)
+        ts.peer_processes = [run_peer(self.impl_dir, PEER_NAMES[i], peer_list[i], peer_list, ts_addr, False)
+                             for i in range(self.peers)]
+        assert ts.wait_processes(self.peers, 5), "Startup timeout"
+        ts.send_local_message('Carl', Message('SEND', 'Hello'))
+        ts.send_local_message('Carl', Message('SEND', 'How are you?'))
+        return ts
+
+    def teardown(self, ts):
+        for proc in ts.peer_processes:
+            proc.terminate()
+        ts.stop(wait_timeout=.2)
+        for proc in ts.peer_processes:
+            proc.kill()
+
+    def check(self, ts):
+        for peer in PEER_NAMES[:self.peers]:
+            delivered = [msg.body for msg in ts.drain_local_messages(peer)]
+            assert delivered == ['Carl: Hello', 'Carl: How are you?'], \
+                "%s delivered %s" % (peer, delivered)
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument(dest='impl_dir', metavar='DIRECTORY',
                         help="directory with implementation to test")
     parser.add_argument('-d', dest='debug', action='store_true',
                         help="include debugging output from implementation")
+    parser.add_argument('--in-process', action='store_true',
+                        help="run programs as tasks of the test process instead of separate processes")
+    parser.add_argument('--explore', type=int, metavar='DEPTH',
+                        help="check message ordering in all delivery orders up to the given depth instead of tests")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="number of processes exploring delivery orders")
     args = parser.parse_args()
 
     logging.basicConfig(format="%(asctime)s - %(message)s", level=logging.DEBUG)
 
+    if args.explore is not None:
+        explorer = Explorer(OrderedModel(args.impl_dir), max_depth=args.explore, workers=args.workers)
+        result = explorer.run()
+        print(result)
+        for violation in result.violations:
+            print(violation)
+        return 1 if len(result.violations) > 0 else 0
+
     tests = [
         BasicTestCase(
-            args.impl_dir, args.debug),
+            args.impl_dir, args.debug, args.in_process),
         ReliableTestCase(
-            args.impl_dir, args.debug),
+            args.impl_dir, args.debug, args.in_process),
         UniformReliableTestCase(
-            args.impl_dir, args.debug),
+            args.impl_dir, args.debug, args.in_process),
         OrderedTestCase(
-            args.impl_dir, args.debug),
+            args.impl_dir, args.debug, args.in_process),
         TwoCrashesTestCase(
-            args.impl_dir, args.debug),
+            args.impl_dir, args.debug, args.in_process),
         TwoCrashesRandomTestCase(
-            args.impl_dir, args.debug),
+            args.impl_dir, args.debug, args.in_process),
         # uncomment to see what happens when 3 of 5 processes fail
         # ThreeCrashesRandomTestCase(
         #     args.impl_dir, args.debug),
@@ -9,6 +9,7 @@ import threading
 import unittest
 
 from dslib.message import Message
+from dslib.sim import Simulation
 from dslib.test_server import TestMode, TestServer
 
 
@@ -45,21 +46,32 @@ def run_sender(impl_dir, receiver_addr, ts_addr, debug):
 
 
 class BaseTestCase(unittest.TestCase):
-    def __init__(self, impl_dir, debug=False):
+    def __init__(self, impl_dir, debug=False, in_process=False):
         super(BaseTestCase, self).__init__()
         self.impl_dir = impl_dir
         self.debug = debug
+        self.in_process = in_process
 
     def setUp(self):
         super(BaseTestCase, self).setUp()
         sys.stderr.write("\n\n" + self.__class__.__name__ + " " + "-" * 60 + "\n\n")
 
         self.ts = TestServer(TEST_SERVER_ADDR)
+        if self.in_process:
+            self.sim = Simulation(self.ts, self.debug)
+            self.sim.run_program(os.path.join(self.impl_dir, 'receiver.py'), ['-l', SERVER_ADDR], 'receiver')
+            self.sim.run_program(os.path.join(self.impl_dir, 'sender.py'), [], 'sender')
+            return
+        self.sim = None
         self.ts.start()
         self.receiver = run_receiver(self.impl_dir, SERVER_ADDR, TEST_SERVER_ADDR, self.debug)
         self.sender = run_sender(self.impl_dir, SERVER_ADDR, TEST_SERVER_ADDR, self.debug)
 
     def tearDown(self):
+        if self.sim is not None:
+            self.sim.stop()
+            self.ts.stop()
+            return
         self.sender.terminate()
         self.receiver.terminate()
         self.ts.stop()
@@ -255,27 +267,29 @@ def main():
     parser.add_argument('-d', dest='debug', action='store_true',
                         help="include debugging output from implementation")
     parser.add_argument('-n', default='1', type=int)
+    parser.add_argument('--in-process', action='store_true',
+                        help="run programs as tasks of the test process instead of separate processes")
     args = parser.parse_args()
 
     logging.basicConfig(format="%(asctime)s - %(message)s", level=logging.DEBUG)
 
     tests = [
         BasicTestCase(
-            args.impl_dir, args.debug),
+            args.impl_dir, args.debug, args.in_process),
         BasicBiggerRepeatedTestCase(
-            args.impl_dir, args.debug),
+            args.impl_dir, args.debug, args.in_process),
         BasicRepeatedTestCase(
-            args.impl_dir, args.debug),
+            args.impl_dir, args.debug, args.in_process),
         BasicDroppedTestCase(
-            args.impl_dir, args.debug),
+            args.impl_dir, args.debug, args.in_process),
         MoreThanOnceTestCase(
-            args.impl_dir, args.debug),
+            args.impl_dir, args.debug, args.in_process),
         MoreThanOnceMessageDropTestCase(
-            args.impl_dir, args.debug),
+            args.impl_dir, args.debug, args.in_process),
         ExactlyOnceTestCase(
-            args.impl_dir, args.debug),
+            args.impl_dir, args.debug, args.in_process),
         RandomDropsTestCase(
-            args.impl_dir, args.debug)
+            args.impl_dir, args.debug, args.in_process)
     ]
 
     for i in range(args.n):
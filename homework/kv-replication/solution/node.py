@@ -1,14 +1,94 @@
 #!/usr/bin/env python3
 
 import argparse
+import itertools
+import json
 import logging
+import os
+import random
 
 from dslib import Message, Process, Runtime
+from dslib.hints import HintLog
+from dslib.merkle import MerkleTree
+from dslib.ring import HashRing
+from dslib.stats import RollingWindow
+from dslib.storage import LogStore
+from dslib.versioning import DottedVersionVector, Version, join, reconcile
+
+
+VNODES = 128
+REPLICAS = 3
+GOSSIP_INTERVAL = 1
+# requests resend messages to silent nodes every interval, replicas silent for an interval
+# are suspected and replaced by fallback nodes
+REQUEST_RETRY_INTERVAL = 0.5
+REQUEST_RETRIES = 20
+# records moved after the change of the ring are sent in batches
+PUSH_BATCH_RECORDS = 500
+# hints are replayed in batches, one batch in flight per target, and at most at the given
+# rate per node, so that a recovered node is not flooded by all its fallbacks at once
+HINT_BATCH_RECORDS = 200
+HINT_REPLAY_RATE = 1000
+# leaves of Merkle trees compared by anti-entropy, 2**depth ranges of keys
+MERKLE_DEPTH = 10
+# reads go to `quorum` replicas first and to the rest of them (hedged) if the replies take longer
+# than the given percentile of recent read latencies, bounded by the limits below
+HEDGE_PERCENTILE = 95
+HEDGE_MIN_DELAY = 0.01
+HEDGE_MAX_DELAY = REQUEST_RETRY_INTERVAL
+HEDGE_MIN_SAMPLES = 20
+# timers are the only clock of the node which follows the test server time, so reads are timed
+# in ticks of the hedge timer running while there are reads waiting for hedging or for timed replies
+HEDGE_TICK = 0.01
+LATENCY_WINDOW = 10
 
 
 class Node(Process):
-    def __init__(self, name):
+    def __init__(self, name, hedge_percentile=HEDGE_PERCENTILE, data_dir=None):
         super().__init__(name)
+        # key -> list of sibling versions
+        self._storage = {}
+        # versions written to the node as a fallback for unavailable replicas
+        self._hints = HintLog(merge=lambda old, new: reconcile(old + new))
+        # number of hinted records which can be replayed until the next gossip interval
+        self._replay_budget = 0
+        self._stats = {'hinted_writes': 0, 'hints_replayed': 0, 'hint_probes': 0,
+                       'reads': 0, 'hedged_reads': 0, 'read_repairs': 0}
+        # latencies of replies to reads, None disables hedging and reads go to all replicas at once,
+        # they are measured in ticks of the hedge timer (see HEDGE_TICK) and kept in seconds
+        self._hedge_percentile = hedge_percentile
+        self._latencies = RollingWindow(LATENCY_WINDOW, max_samples=100, seed=name)
+        self._hedge_timer_set = False
+        self._ticks = 0
+        # last counter of the node in dots of each key, so that two versions never get the same dot
+        self._counters = {}
+        if data_dir is not None:
+            # records survive restarts of the node, and so do counters, otherwise a restarted
+            # node could issue the dots of versions it wrote before
+            path = os.path.join(data_dir, name)
+            self._storage = LogStore(os.path.join(path, 'records'), encode=_encode_versions,
+                                     decode=_decode_versions)
+            self._counters = LogStore(os.path.join(path, 'counters'), encode=lambda c: str(c).encode(),
+                                      decode=int)
+            logging.info("%s: loaded %d records from %s", name, len(self._storage), path)
+        # name -> [address, status ('alive' or 'left'), incarnation]
+        self._members = {}
+        self._ring = HashRing(VNODES)
+        self._joined = False
+        self._requests = {}
+        self._request_ids = itertools.count(1)
+        self._retry_timer_set = False
+        # replicas which did not answer recent requests, they are replaced by fallbacks at once
+        self._suspected = set()
+        # nodes which sent anything since the previous retry, a busy node is not suspected
+        # and does not get duplicate messages
+        self._heard = set()
+        # unacknowledged batches of records: id -> {'target', 'records', 'drop', 'hint'}, where hint
+        # is the sequence number in the hint log acknowledged by the batch
+        self._pushes = {}
+        self._push_ids = itertools.count(1)
+        # Merkle trees of records replicated both here and on other nodes: name -> tree
+        self._trees = {}
 
     def receive(self, ctx, msg):
 
@@ -20,51 +100,80 @@ class Node(Process):
             # - request body: address of some existing node
             # - response: none
             if msg.type == 'JOIN':
-                pass
+                seed = msg.body
+                incarnation = self._members[self._name][2] + 1 if self._name in self._members else 0
+                self._members[self._name] = [ctx.addr(), 'alive', incarnation]
+                self._joined = True
+                self._update_ring(ctx)
+                if seed != ctx.addr():
+                    ctx.send(Message('JOIN_REQ', {'name': self._name, 'members': self._members}), seed)
+                ctx.set_timer('gossip', GOSSIP_INTERVAL)
 
             # Remove node from the system
             # - request body: none
             # - response: none
             elif msg.type == 'LEAVE':
-                pass
+                if not self._joined:
+                    return
+                self._members[self._name] = [ctx.addr(), 'left', self._members[self._name][2] + 1]
+                self._gossip(ctx, self._alive_addrs())
+                # the ring without the local node tells where all records go
+                self._update_ring(ctx)
+                self._joined = False
 
             # Get a list of nodes in the system
             # - request body: none
             # - response: MEMBERS message, body contains the list of all known alive nodes
             elif msg.type == 'GET_MEMBERS':
-                pass
+                ctx.send_local(Message('MEMBERS', self._alive_names()))
 
             # Get key value
-            # - request body: 
+            # - request body:
             #   - key: key (string)
             #   - quorum: quorum size for reading (int)
-            # - reponse: GET_RESP message, body contains 
+            # - reponse: GET_RESP message, body contains
             #   - values: list of value versions (empty list if record is not found)
             #   - metadata: list of metadata (for each values[i] its metadata is provided in metadata[i])
             elif msg.type == 'GET':
-                pass
+                self._new_request(ctx, 'GET', msg.body['key'], msg.body['quorum'], msg.request_id)
 
             # Store value for the key
-            # - request body: 
+            # - request body:
             #   - key: key (string)
             #   - value: value (string)
             #   - metadata: metadata of previously read or written value version (optional)
             #   - quorum: quorum size for writing (int)
             # - response: PUT_RESP message, body contains metadata of written version
             elif msg.type == 'PUT':
-                pass
+                key = msg.body['key']
+                context = DottedVersionVector.decode(msg.body.get('metadata'))
+                counter = max(self._counters.get(key, 0), context.max_counter(self._name),
+                              self._max_counter(self._storage.get(key, ()))) + 1
+                self._counters[key] = counter
+                version = Version(msg.body['value'], self._name, counter, context)
+                self._new_request(ctx, 'PUT', key, msg.body['quorum'], msg.request_id, version)
 
             # Get nodes responsible for the key
             # - request body: key (string)
             # - response: LOOKUP_RESP message, body contains list with [node_name, node_address] elements
             elif msg.type == 'LOOKUP':
-                pass
+                replicas = self._ring.preference_list(msg.body, REPLICAS)
+                ctx.send_local(Message('LOOKUP_RESP', [[name, self._members[name][0]] for name in replicas]))
 
             # Get number of records stored on the node
             # - request body: none
             # - response: COUNT_RECORDS_RESP message, body contains the number of stored records
             elif msg.type == 'COUNT_RECORDS':
-                pass
+                ctx.send_local(Message('COUNT_RECORDS_RESP', len(self._storage)))
+
+            # Get counters of the node
+            # - request body: none
+            # - response: STATS message, body contains a dict of counters, hint_backlog is the number
+            #   of hinted records waiting for each unavailable replica
+            elif msg.type == 'GET_STATS':
+                stats = dict(self._stats, hint_backlog=self._hints.backlog(), hint_log=self._hints.stats(),
+                             hedge_delay=self._hedge_delay())
+                ctx.send_local(Message('STATS', stats))
 
             else:
                 err = Message('ERROR', 'unknown command: %s' % msg.type)
@@ -74,31 +183,501 @@ class Node(Process):
 
             # Node-to-Node messages ***************************************************************
 
-            # You can introduce any messages for node-to-node communcation
-            if msg.type == 'SOME_MESSAGE':
-                pass
+            if isinstance(msg.body, dict) and 'name' in msg.body:
+                # any message proves that the node is reachable again
+                self._suspected.discard(msg.body['name'])
+                self._heard.add(msg.body['name'])
+
+            if msg.type == 'JOIN_REQ':
+                if self._merge(ctx, msg.body['members']):
+                    self._gossip(ctx, self._alive_addrs())
+                else:
+                    self._gossip(ctx, [msg.sender])
+
+            elif msg.type == 'GOSSIP':
+                if self._merge(ctx, msg.body['members']):
+                    # changes are spread to everyone at once, periodic gossip only repairs lost updates
+                    self._gossip(ctx, self._alive_addrs())
+
+            # Read of the key by a coordinator, a fallback node also returns its hinted versions
+            elif msg.type == 'READ':
+                body = {'id': msg.body['id'], 'name': self._name,
+                        'versions': [v.marshall() for v in self._read(msg.body['key'])]}
+                ctx.send(Message('READ_RESP', body), msg.sender)
+
+            # Versions written by a coordinator or read repair, stored as hints for the given
+            # replica if the node is its fallback
+            elif msg.type == 'WRITE':
+                versions = [Version.unmarshall(v) for v in msg.body['versions']]
+                self._write(msg.body['key'], versions, msg.body['hint'])
+                if msg.body['id'] is not None:
+                    ctx.send(Message('WRITE_ACK', {'id': msg.body['id'], 'name': self._name}), msg.sender)
+
+            elif msg.type == 'READ_RESP':
+                req = self._requests.get(msg.body['id'])
+                if req is not None:
+                    if msg.body['name'] in req['timed']:
+                        # replies of hedged reads count too, otherwise slow replies would never raise the delay
+                        req['timed'].discard(msg.body['name'])
+                        self._latencies.add(self._ticks * HEDGE_TICK, (self._ticks - req['start']) * HEDGE_TICK)
+                    self._on_reply(ctx, msg.body['id'], req, msg.body['name'],
+                                   [Version.unmarshall(v) for v in msg.body['versions']])
+
+            elif msg.type == 'WRITE_ACK':
+                req = self._requests.get(msg.body['id'])
+                if req is not None:
+                    self._on_reply(ctx, msg.body['id'], req, msg.body['name'], None)
+
+            # Batch of records moved to the node after the change of the ring or hinted versions
+            # delivered by its fallback
+            elif msg.type == 'PUSH':
+                for key, versions in msg.body['records'].items():
+                    self._write(key, [Version.unmarshall(v) for v in versions])
+                ctx.send(Message('PUSH_ACK', {'id': msg.body['id'], 'name': self._name}), msg.sender)
+
+            elif msg.type == 'PUSH_ACK':
+                self._on_push_acked(ctx, msg.body['id'])
+
+            # Anti-entropy: hashes of nodes of the Merkle tree of records shared with the sender
+            elif msg.type == 'TREE':
+                sender = msg.body['name']
+                if sender not in self._ring:
+                    return
+                tree = self._tree(sender)
+                level = msg.body['level']
+                differ = tree.differ(level, msg.body['hashes'])
+                if len(differ) == 0:
+                    return
+                if level == tree.depth:
+                    self._send_leaves(ctx, sender, differ, True)
+                else:
+                    body = {'name': self._name, 'level': level + 1, 'hashes': tree.children(level, differ)}
+                    ctx.send(Message('TREE', body), msg.sender)
+
+            # Anti-entropy: records of differing leaves, the receiver answers with its own ones
+            elif msg.type == 'LEAVES':
+                sender = msg.body['name']
+                if sender not in self._ring:
+                    return
+                for key, versions in msg.body['records'].items():
+                    self._write(key, [Version.unmarshall(v) for v in versions])
+                if msg.body['reply']:
+                    self._send_leaves(ctx, sender, msg.body['leaves'], False)
 
             else:
                 err = Message('ERROR', 'unknown message: %s' % msg.type)
                 ctx.send(err, msg.sender)
 
+    def digest(self):
+        return {'members': self._alive_names(), 'records': len(self._storage)}
+
     def on_timer(self, ctx, timer):
         # type: (Context, str) -> None
-        pass
+        if timer == 'gossip':
+            # a leaving node keeps running until all its records are moved
+            if not self._joined and len(self._storage) == 0 and len(self._pushes) == 0 and len(self._hints) == 0:
+                return
+            for push_id, push in self._pushes.items():
+                if push['hint'] is None:
+                    self._send_push(ctx, push_id, push)
+            self._replay_hints(ctx)
+            others = self._alive_addrs()
+            if len(others) > 0:
+                self._gossip(ctx, [random.choice(others)])
+            if self._joined:
+                self._anti_entropy(ctx)
+            ctx.set_timer('gossip', GOSSIP_INTERVAL)
+
+        elif timer == 'retry':
+            # a single timer for all requests
+            self._retry_timer_set = False
+            for req_id, req in list(self._requests.items()):
+                req['retries'] += 1
+                if req['retries'] > REQUEST_RETRIES:
+                    del self._requests[req_id]
+                    if not req['replied']:
+                        ctx.send_local(Message('ERROR', 'request timeout: %s %s' % (req['op'], req['key'])),
+                                       req['request_id'])
+                    continue
+                if req['op'] == 'GET' and not req['replied'] and not req['hedged'] and self._hedge_percentile:
+                    self._hedge(ctx, req_id, req)
+                    if req_id not in self._requests:
+                        continue
+                if req['retries'] >= 2:
+                    # silent for at least one full interval
+                    for replica, node in list(req['targets'].items()):
+                        if node not in req['replies'] and node not in self._heard:
+                            self._suspected.add(node)
+                            self._use_fallback(req, replica)
+                # messages to nodes which are heard from are resent less often in case they were lost
+                self._send_request(ctx, req_id, req, () if req['retries'] % 4 == 0 else self._heard)
+            self._heard = set()
+            self._set_retry_timer(ctx)
+
+        elif timer == 'hedge':
+            self._hedge_timer_set = False
+            self._ticks += 1
+            delay = self._hedge_delay()
+            waiting = False
+            for req_id, req in list(self._requests.items()):
+                if req['op'] != 'GET':
+                    continue
+                if not req['replied'] and not req['hedged'] and (self._ticks - req['start']) * HEDGE_TICK >= delay:
+                    self._hedge(ctx, req_id, req)
+                # the clock goes on until the timed replicas answer, hedged reads included
+                if len(req['timed']) > 0 or (not req['replied'] and not req['hedged']):
+                    waiting = True
+            if waiting:
+                self._set_hedge_timer(ctx)
+
+    # Requests
+
+    def _new_request(self, ctx, op, key, quorum, request_id, version=None):
+        req_id = '%s-%d' % (self._name, next(self._request_ids))
+        # replica -> node asked instead of it, the replica itself or a fallback node
+        replicas = self._ring.preference_list(key, REPLICAS)
+        req = {'op': op, 'key': key, 'quorum': quorum, 'version': version, 'request_id': request_id, 'retries': 0,
+               'targets': {replica: replica for replica in replicas}, 'replies': {}, 'replied': False,
+               'asked': set(replicas), 'hedged': False, 'start': self._ticks, 'timed': set()}
+        self._requests[req_id] = req
+        for replica in replicas:
+            if replica in self._suspected:
+                self._use_fallback(req, replica)
+        if op == 'GET':
+            self._stats['reads'] += 1
+            if self._hedge_percentile is not None:
+                # the local replica answers at once, others are taken in the order of the preference list
+                ordered = sorted(replicas, key=lambda replica: req['targets'][replica] != self._name)
+                req['asked'] = set(ordered[:quorum])
+                # latencies are taken from the replicas asked first
+                req['timed'] = {req['targets'][replica] for replica in req['asked']} - {self._name}
+                self._set_hedge_timer(ctx)
+        self._send_request(ctx, req_id, req)
+        self._set_retry_timer(ctx)
+
+    def _set_retry_timer(self, ctx):
+        if not self._retry_timer_set and len(self._requests) > 0:
+            ctx.set_timer('retry', REQUEST_RETRY_INTERVAL)
+            self._retry_timer_set = True
+
+    def _set_hedge_timer(self, ctx):
+        if not self._hedge_timer_set:
+            ctx.set_timer('hedge', HEDGE_TICK)
+            self._hedge_timer_set = True
+
+    def _hedge_delay(self):
+        now = self._ticks * HEDGE_TICK
+        if self._latencies.count(now) < HEDGE_MIN_SAMPLES:
+            # a percentile of a few samples is about their maximum
+            return HEDGE_MAX_DELAY
+        delay = self._latencies.percentile(now, self._hedge_percentile or 100)
+        return min(max(delay, HEDGE_MIN_DELAY), HEDGE_MAX_DELAY)
+
+    def _hedge(self, ctx, req_id, req):
+        # speculative reads from the replicas which were not asked yet
+        logging.debug("%s: hedging read of %s", self._name, req['key'])
+        self._stats['hedged_reads'] += 1
+        req['asked'] = set(req['targets'])
+        req['hedged'] = True
+        self._send_request(ctx, req_id, req)
+
+    def _use_fallback(self, req, replica):
+        # the next node after the replicas in the preference list which is not used by the request
+        # yet, suspected nodes are used only if there are no others
+        if req['targets'][replica] != replica:
+            return
+        used = set(req['targets'].values())
+        candidates = [name for name in self._ring.preference_list(req['key'], len(self._ring))
+                      if name not in req['targets'] and name not in used]
+        for name in sorted(candidates, key=lambda name: name in self._suspected):
+            req['targets'][replica] = name
+            return
+
+    def _send_request(self, ctx, req_id, req, skip=()):
+        for replica, node in list(req['targets'].items()):
+            if node in req['replies'] or node in skip or replica not in req['asked']:
+                continue
+            hint = replica if node != replica else None
+            if node == self._name:
+                if req['op'] == 'GET':
+                    self._on_reply(ctx, req_id, req, node, self._read(req['key']))
+                else:
+                    self._write(req['key'], [req['version']], hint)
+                    self._on_reply(ctx, req_id, req, node, None)
+                if req_id not in self._requests:
+                    return
+            elif req['op'] == 'GET':
+                ctx.send(Message('READ', {'id': req_id, 'key': req['key'], 'name': self._name}),
+                         self._members[node][0])
+            else:
+                body = {'id': req_id, 'key': req['key'], 'versions': [req['version'].marshall()],
+                        'hint': hint, 'name': self._name}
+                ctx.send(Message('WRITE', body), self._members[node][0])
+
+    def _on_reply(self, ctx, req_id, req, node, versions):
+        if node in req['replies'] or (node not in req['targets'] and node not in req['targets'].values()):
+            return
+        req['replies'][node] = versions
+        if not req['replied'] and len(req['replies']) >= req['quorum']:
+            req['replied'] = True
+            if req['op'] == 'GET':
+                self._reply_get(ctx, req)
+            else:
+                ctx.send_local(Message('PUT_RESP', req['version'].metadata()), req['request_id'])
+        if req['op'] == 'GET' and req['replied']:
+            self._read_repair(ctx, req)
+        if all(req['targets'][replica] in req['replies'] for replica in req['asked']):
+            # all asked replicas or their fallbacks have answered, nothing left to repair or hand off
+            del self._requests[req_id]
+
+    def _reply_get(self, ctx, req):
+        versions = reconcile(v for replied in req['replies'].values() for v in replied)
+        req['result'] = versions
+        if req['key'].startswith('cart') and len(versions) > 1:
+            # conflicting carts are merged into a single value superseding all of them
+            items = []
+            for version in versions:
+                for item in version.value.split(','):
+                    if item not in items:
+                        items.append(item)
+            body = {'values': [','.join(items)], 'metadata': [join(versions).encode()]}
+        else:
+            body = {'values': [v.value for v in versions], 'metadata': [v.metadata() for v in versions]}
+        ctx.send_local(Message('GET_RESP', body), req['request_id'])
+
+    def _read_repair(self, ctx, req):
+        # replicas which returned stale versions get the reconciled ones, replicas answering
+        # after the client got the result are repaired when they answer
+        result = req['result']
+        dots = {v.dot for v in result}
+        repaired = req.setdefault('repaired', set())
+        for replica, node in req['targets'].items():
+            if node != replica or node not in req['replies'] or node in repaired:
+                continue
+            repaired.add(node)
+            if {v.dot for v in req['replies'][node]} == dots:
+                continue
+            self._stats['read_repairs'] += 1
+            if node == self._name:
+                self._write(req['key'], result)
+            else:
+                body = {'id': None, 'key': req['key'], 'versions': [v.marshall() for v in result],
+                        'hint': None, 'name': self._name}
+                ctx.send(Message('WRITE', body), self._members[node][0])
+
+    # Storage
+
+    def _read(self, key):
+        versions = list(self._storage.get(key, ()))
+        for hinted in self._hints.get(key):
+            versions += hinted
+        return reconcile(versions)
+
+    def _write(self, key, versions, hint=None):
+        if hint is not None and hint != self._name:
+            self._hints.append(hint, key, versions)
+            self._stats['hinted_writes'] += 1
+            return
+        self._storage[key] = reconcile(self._storage.get(key, []) + versions)
+        self._update_trees(key)
+
+    # Anti-entropy
+
+    def _tree(self, name):
+        if name not in self._trees:
+            self._trees[name] = MerkleTree(MERKLE_DEPTH)
+        return self._trees[name]
+
+    def _update_trees(self, key):
+        # a record is in the trees of its other replicas, its hash covers the dots of its versions
+        versions = self._storage.get(key)
+        digest = ','.join('%s:%d' % v.dot for v in versions) if versions else None
+        for replica in self._ring.preference_list(key, REPLICAS):
+            if replica != self._name:
+                self._tree(replica).set(key, digest)
+
+    def _anti_entropy(self, ctx):
+        # compares records with a random node, the exchange descends from the roots of the trees
+        # only into differing subtrees and ends with records of differing leaves
+        peers = [name for name in self._alive_names() if name != self._name]
+        if len(peers) == 0:
+            return
+        peer = random.choice(peers)
+        tree = self._tree(peer)
+        body = {'name': self._name, 'level': 0, 'hashes': [[0, tree.root()]]}
+        ctx.send(Message('TREE', body), self._members[peer][0])
+
+    def _send_leaves(self, ctx, name, leaves, reply):
+        keys = self._tree(name).keys(leaves)
+        logging.debug("%s: anti-entropy with %s, %d leaves differ, sending %d records",
+                      self._name, name, len(leaves), len(keys))
+        records = {key: [v.marshall() for v in self._storage[key]] for key in keys}
+        body = {'name': self._name, 'leaves': leaves, 'records': records, 'reply': reply}
+        ctx.send(Message('LEAVES', body), self._members[name][0])
+
+    def _max_counter(self, versions):
+        # the largest counter of the node in dots and contexts of versions
+        counters = [0]
+        for version in versions:
+            counters.append(version.context.max_counter(self._name))
+            if version.dot[0] == self._name:
+                counters.append(version.dot[1])
+        return max(counters)
+
+    # Membership
+
+    def _alive_names(self):
+        return sorted(name for name, (_, status, _) in self._members.items() if status == 'alive')
+
+    def _alive_addrs(self):
+        return [self._members[name][0] for name in self._alive_names() if name != self._name]
+
+    def _gossip(self, ctx, addrs):
+        message = Message('GOSSIP', {'name': self._name, 'members': self._members})
+        for addr in addrs:
+            ctx.send(message, addr)
+
+    def _merge(self, ctx, members):
+        # newer incarnations win, for the same incarnation left overrides alive
+        changed = False
+        for name, (addr, status, incarnation) in members.items():
+            if name == self._name:
+                continue
+            known = self._members.get(name)
+            if (known is None or incarnation > known[2]
+                    or (incarnation == known[2] and known[1] == 'alive' and status != 'alive')):
+                self._members[name] = [addr, status, incarnation]
+                changed = True
+        if changed:
+            self._update_ring(ctx)
+        return changed
+
+    # Rebalancing
+
+    def _update_ring(self, ctx):
+        alive = set(self._alive_names())
+        removed = [name for name in self._ring.members if name not in alive]
+        added = [name for name in alive if name not in self._ring]
+        if len(removed) == 0 and len(added) == 0:
+            return
+        before = {key: self._ring.preference_list(key, REPLICAS) for key in self._storage}
+        for name in removed:
+            self._ring.remove(name)
+        for name in added:
+            self._ring.add(name)
+
+        # records are sent to their new replicas, a node which is no longer a replica of
+        # a record sends it to all of them and drops it when they acknowledge it
+        moves = {}
+        for key, old in before.items():
+            new = self._ring.preference_list(key, REPLICAS)
+            drop = self._name not in new
+            for name in new:
+                if name != self._name and (drop or name not in old):
+                    moves.setdefault((name, drop), []).append(key)
+        for (target, drop), keys in moves.items():
+            for i in range(0, len(keys), PUSH_BATCH_RECORDS):
+                records = {key: self._storage[key] for key in keys[i:i + PUSH_BATCH_RECORDS]}
+                self._start_push(ctx, target, records, drop)
+
+        # records shared with each node change with the ring
+        self._trees = {}
+        for key in self._storage:
+            self._update_trees(key)
+
+    def _start_push(self, ctx, target, records, drop=False, hint=None):
+        push_id = '%s-%d' % (self._name, next(self._push_ids))
+        push = {'target': target, 'records': records, 'drop': drop, 'hint': hint}
+        self._pushes[push_id] = push
+        logging.debug("%s: pushing %d records to %s (batch %s)", self._name, len(records), target, push_id)
+        self._send_push(ctx, push_id, push)
+
+    def _send_push(self, ctx, push_id, push):
+        if push['target'] not in self._members:
+            return
+        records = {key: [v.marshall() for v in versions] for key, versions in push['records'].items()}
+        body = {'id': push_id, 'records': records, 'name': self._name}
+        ctx.send(Message('PUSH', body), self._members[push['target']][0])
+
+    def _on_push_acked(self, ctx, push_id):
+        push = self._pushes.pop(push_id, None)
+        if push is None:
+            return
+        if push['hint'] is not None:
+            self._hints.ack(push['target'], push['hint'])
+            self._stats['hints_replayed'] += len(push['records'])
+            # the target is alive, its backlog is replayed as fast as the budget allows
+            self._replay_to(ctx, push['target'])
+            return
+        for key in push['records']:
+            if push['drop'] and self._name not in self._ring.preference_list(key, REPLICAS):
+                self._storage.pop(key, None)
+                self._update_trees(key)
+
+    def _replay_hints(self, ctx):
+        # hinted versions are sent to their replicas until acknowledged, replicas which left
+        # are replaced by the current replicas of the keys
+        self._replay_budget = HINT_REPLAY_RATE * GOSSIP_INTERVAL
+        for push_id, push in list(self._pushes.items()):
+            if push['hint'] is not None:
+                # not acknowledged in a whole interval, the hints stay in the log and the target
+                # is probed with a single record until it answers
+                del self._pushes[push_id]
+                self._suspected.add(push['target'])
+        for target in self._hints.targets():
+            if self._members.get(target, [None, 'left'])[1] != 'alive':
+                for key, versions in self._hints.drop(target).items():
+                    for replica in self._ring.preference_list(key, REPLICAS):
+                        if replica == self._name:
+                            self._write(key, versions)
+                        else:
+                            self._start_push(ctx, replica, {key: versions})
+            else:
+                self._replay_to(ctx, target)
+
+    def _replay_to(self, ctx, target):
+        if any(push['hint'] is not None and push['target'] == target for push in self._pushes.values()):
+            return
+        if target in self._suspected:
+            limit = 1
+            self._stats['hint_probes'] += 1
+        else:
+            limit = min(HINT_BATCH_RECORDS, self._replay_budget)
+        if limit <= 0:
+            return
+        seq, records = self._hints.batch(target, limit)
+        if len(records) == 0:
+            return
+        self._replay_budget -= len(records)
+        self._start_push(ctx, target, records, hint=seq)
+
+
+def _encode_versions(versions):
+    return json.dumps([v.marshall() for v in versions]).encode()
+
+
+def _decode_versions(data):
+    return [Version.unmarshall(v) for v in json.loads(data)]
 
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument('-n', dest='name', 
+    parser.add_argument('-n', dest='name',
                         help='node name (should be unique)', default='1')
-    parser.add_argument('-l', dest='addr', metavar='host:port', 
+    parser.add_argument('-l', dest='addr', metavar='host:port',
                         help='listen on specified address', default='127.0.0.1:9701')
+    parser.add_argument('-s', dest='hedge_percentile', type=float, default=HEDGE_PERCENTILE,
+                        help='send speculative reads to other replicas after this percentile of read '
+                             'latency, 0 sends reads to all replicas at once')
+    parser.add_argument('-f', dest='data_dir', metavar='DIR',
+                        help='keep records in files in this directory to restore them after restart, '
+                             'by default they are kept in memory')
     parser.add_argument('-d', dest='log_level', action='store_const', const=logging.DEBUG,
                         help='print debugging info', default=logging.WARNING)
     args = parser.parse_args()
     logging.basicConfig(format="%(asctime)s - %(message)s", level=args.log_level)
 
-    node = Node(args.name)
+    node = Node(args.name, None if args.hedge_percentile == 0 else args.hedge_percentile, args.data_dir)
     Runtime(node, args.addr).start()
 
 
@@ -3,7 +3,6 @@
 import argparse
 import logging
 import os
-import random
 import string
 import subprocess
 import sys
@@ -12,7 +11,9 @@ import threading
 import unittest
 from functools import reduce
 
+from dslib.loadgen import ReplicationApi, add_load_arguments, run_load
 from dslib.message import Message
+from dslib.network import LinkModel, NetworkModel
 from dslib.test_server import TestMode, TestServer
 
 
@@ -76,9 +77,20 @@ class BaseTestCase(unittest.TestCase):
 
         self.step_until_stabilized(group=group, expect_keys=0)
 
-    def step_until_stabilized(self, steps=10, timeout=10, group=None, expect_keys=None):
+    def step_until_stabilized(self, steps=10, timeout=10, group=None, expect_keys=None, quiescent=.3):
         if group is None:
             group = self.nodes
+        if all(self.ts.digest(node) is not None for node in group):
+            # nodes report members and number of records as state digests, so there is no need to poll them
+            members = sorted(group)
+
+            def converged(digests):
+                return (all(sorted(d['members']) == members for d in digests.values())
+                        and (expect_keys is None or sum(d['records'] for d in digests.values()) == expect_keys))
+
+            stabilized = self.ts.step_until_stabilized(quiescent, timeout, group, converged)
+            self.assertTrue(stabilized, "Members lists or keys are not stabilized")
+            return
         synced_nodes = set()
         counts = [0] * len(group)
 
@@ -113,7 +125,7 @@ class BaseTestCase(unittest.TestCase):
             self.assertEqual(sum(counts), expect_keys, "Keys are not stabilized")
 
     def random_str(self):
-        return ''.join(random.choices(string.ascii_lowercase, k=8))
+        return ''.join(self.ts.random.choices(string.ascii_lowercase, k=8))
 
     def send_join(self, node, seed):
         seed_addr = self.ts.get_process_addr(seed)
@@ -526,16 +538,60 @@ class NodeLeaveTestCase(BaseTestCase):
             self.assertFalse(leaved in replicas, 'Absent node is responsible for some key')
 
 
+class HedgeDelayTestCase(BaseTestCase):
+
+    def runTest(self):
+        self.assertTrue(self.ts.wait_processes(self.node_count, 5), "Startup timeout")
+
+        self.init_cluster()
+        self.ts.set_real_time_mode(False)
+        client = self.nodes[0]
+        keys = [self.random_str() for _ in range(10)]
+        for key in keys:
+            self.send_put(client, key, self.random_str())
+
+        network = NetworkModel(LinkModel(latency=.005))
+        self.ts.set_network_model(network)
+        for i in range(40):
+            self.send_get(client, keys[i % len(keys)])
+        fast_delay = self.get_stats(client)['hedge_delay']
+
+        # replies of the other replicas get slower than the hedge delay, it has to follow them
+        for node in self.nodes[1:]:
+            network.set_link(client, node, LinkModel(latency=.1))
+        for i in range(40):
+            self.send_get(client, keys[i % len(keys)])
+        slow_delay = self.get_stats(client)['hedge_delay']
+        self.assertGreater(slow_delay, .1, "Hedge delay %.3f is not raised by slow replica (was %.3f)" %
+                           (slow_delay, fast_delay))
+
+    def get_stats(self, node):
+        self.ts.send_local_message(node, Message('GET_STATS'))
+        msg = self.ts.step_until_local_message(node, 1)
+        self.assertIsNotNone(msg, "GET_STATS response is not received")
+        self.assertEqual(msg.type, 'STATS')
+        return msg.body
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('-v', dest='verbose', action='store_true',
                         help="print messages and other info from tests")
     parser.add_argument('-d', dest='debug', action='store_true',
                         help="include debugging output from simplementation")
+    add_load_arguments(parser, 'GET=0.8,PUT=0.2')
+    parser.add_argument('--quorum', type=int, default=2,
+                        help="quorum of client requests")
     parser.add_argument(dest='impl_dir', metavar='DIRECTORY',
                         help="directory with implementation to test")
     args = parser.parse_args()
 
+    if args.load is not None:
+        logging.basicConfig(format="%(asctime)s - %(message)s", level=logging.INFO)
+        def start_node(name, addr):
+            return run_node(args.impl_dir, name, addr, TEST_SERVER_ADDR, args.debug)
+        return run_load(args, start_node, ReplicationApi(args.quorum), TEST_SERVER_ADDR)
+
     if args.verbose:
         logging.basicConfig(format="%(asctime)s - %(message)s", level=logging.DEBUG)
     else:
@@ -561,7 +617,9 @@ def main():
         NodeJoinTestCase(
             args.impl_dir, 6, debug=args.debug),
         NodeLeaveTestCase(
-            args.impl_dir, 6, debug=args.debug)
+            args.impl_dir, 6, debug=args.debug),
+        HedgeDelayTestCase(
+            args.impl_dir, 3, debug=args.debug)
         ]
     suite = unittest.TestSuite()
     suite.addTests(tests)
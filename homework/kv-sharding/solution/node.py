@@ -1,15 +1,67 @@
 #!/usr/bin/env python3
 
 import argparse
+import itertools
 import logging
-import random
+import os
 
 from dslib import Message, Process, Runtime
+from dslib.ring import BoundedLoad, hash_key, make_placement
+from dslib.storage import LogStore
+
+
+# virtual nodes per member, enough to keep every node within 20% of the even share
+VNODES = 512
+GOSSIP_INTERVAL = 1
+# members are considered dead after this number of gossip intervals without messages from them
+FAILURE_TICKS = 3
+REQUEST_RETRY_INTERVAL = 0.5
+REQUEST_RETRIES = 10
+# limit for forwarding of requests between nodes with different views of the ring
+FORWARD_TTL = 5
+# records are moved in batches limited to fit into a UDP datagram, several batches are sent
+# without waiting for acknowledgements
+HANDOFF_BATCH_RECORDS = 1000
+HANDOFF_BATCH_BYTES = 32 * 1024
+HANDOFF_WINDOW = 16
+HANDOFF_RETRY_INTERVAL = 0.5
+# state of incoming transfers is forgotten after this number of gossip intervals without batches
+HANDOFF_EXPIRE_TICKS = 10
 
 
 class Node(Process):
-    def __init__(self, name):
+    def __init__(self, name, placement='ring', epsilon=None, data_dir=None):
         super().__init__(name)
+        self._storage = {}
+        if data_dir is not None:
+            # records survive restarts of the node
+            path = os.path.join(data_dir, name)
+            self._storage = LogStore(path, encode=str.encode, decode=bytes.decode)
+            logging.info("%s: loaded %d records from %s", name, len(self._storage), path)
+        # name -> [address, status ('alive', 'left' or 'dead'), incarnation]
+        self._members = {}
+        self._silent_ticks = {}
+        # the token ring by default, rendezvous hashing has no token ranges to track
+        # incoming records, so reads of records in flight are not forwarded to their previous owner
+        self._ring = make_placement(placement, **({'vnodes': VNODES} if placement == 'ring' else {}))
+        # with bounded loads a key is stored on one of its two candidates, new keys overflow from
+        # the first one when it holds more than (1 + epsilon) times the average number of records
+        self._bounded = BoundedLoad(self._ring, epsilon) if epsilon is not None else None
+        # numbers of records reported by other nodes in gossip and requests
+        self._loads = {}
+        self._requests = {}
+        self._request_ids = itertools.count(1)
+        self._retry_timer_set = False
+        self._joined = False
+        # outgoing transfers: id -> {'target', 'batches' (lists of keys), 'acked', 'next', 'rebalance'}
+        self._transfers = {}
+        self._transfer_ids = itertools.count(1)
+        # key -> id of the transfer moving it, such records are still served here until acknowledged
+        self._in_flight = {}
+        # incoming transfers: id -> {'seqs', 'idle'}
+        self._incoming = {}
+        # previous owners of ranges moved to the node: name -> {'ranges', 'written', 'idle'}
+        self._expected = {}
 
     def receive(self, ctx, msg):
 
@@ -21,55 +73,73 @@ class Node(Process):
             # - request body: address of some existing node
             # - response: none
             if msg.type == 'JOIN':
-                pass
+                seed = msg.body
+                incarnation = self._members[self._name][2] + 1 if self._name in self._members else 0
+                self._members[self._name] = [ctx.addr(), 'alive', incarnation]
+                self._joined = True
+                self._update_ring(ctx)
+                if seed != ctx.addr():
+                    ctx.send(Message('JOIN_REQ', {'name': self._name, 'members': self._members}), seed)
+                ctx.set_timer('gossip', GOSSIP_INTERVAL)
 
             # Remove node from the system
             # - request body: none
             # - response: none
             elif msg.type == 'LEAVE':
-                pass
+                if not self._joined:
+                    return
+                self._members[self._name] = [ctx.addr(), 'left', self._members[self._name][2] + 1]
+                self._gossip(ctx, self._alive_addrs())
+                # the ring without the local node tells where all records go
+                self._update_ring(ctx)
+                self._joined = False
 
             # Get a list of nodes in the system
             # - request body: none
             # - response: MEMBERS message, body contains the list of all known alive nodes
             elif msg.type == 'GET_MEMBERS':
-                pass
+                ctx.send_local(Message('MEMBERS', self._alive_names()))
 
             # Get key value
             # - request body: key
             # - reponse: GET_RESP message, body contains value or empty string if record is not found
             elif msg.type == 'GET':
-                pass
+                self._request(ctx, 'GET', msg.body, None, msg.request_id)
 
             # Store value for the key
             # - request body: string "key=value"
             # - response: PUT_RESP message, body is empty
             elif msg.type == 'PUT':
-                pass
+                key, value = msg.body.split('=', 1)
+                self._request(ctx, 'PUT', key, value, msg.request_id)
 
             # Delete value for the key
             # - request body: key
             # - response: DELETE_RESP message, body is empty
             elif msg.type == 'DELETE':
-                pass
+                self._request(ctx, 'DELETE', msg.body, None, msg.request_id)
 
             # Get node responsible for the key
             # - request body: key
             # - response: LOOKUP_RESP message, body contains the node name
             elif msg.type == 'LOOKUP':
-                pass
+                if self._bounded is None:
+                    ctx.send_local(Message('LOOKUP_RESP', self._ring.lookup(msg.body)))
+                else:
+                    # the key may be on any of its candidates, the first one asks the other
+                    self._request(ctx, 'LOOKUP', msg.body, None, msg.request_id)
 
             # Get number of records stored on the node
             # - request body: none
             # - response: COUNT_RECRODS_RESP message, body contains the number of stored records
             elif msg.type == 'COUNT_RECORDS':
-                pass
+                ctx.send_local(Message('COUNT_RECORDS_RESP', len(self._storage)))
 
             # Get keys of records stored on the node
             # - request body: none
             # - response: DUMP_KEYS_RESP message, body contains the list of stored keys
             elif msg.type == 'DUMP_KEYS':
-                pass
+                ctx.send_local(Message('DUMP_KEYS_RESP', list(self._storage)))
 
             else:
                 err = Message('ERROR', 'unknown command: %s' % msg.type)
@@ -79,31 +149,476 @@ class Node(Process):
 
             # Node-to-Node messages ***************************************************************
 
-            # You can introduce any messages for node-to-node communcation
-            if msg.type == 'SOME_MESSAGE':
-                pass
+            if msg.type == 'JOIN_REQ':
+                self._heard(msg.body['name'])
+                if self._merge(ctx, msg.body['members']):
+                    self._gossip(ctx, self._alive_addrs())
+                else:
+                    self._gossip(ctx, [msg.sender])
+
+            elif msg.type == 'GOSSIP':
+                sender = msg.body['name']
+                self._heard(sender)
+                self._loads[sender] = msg.body['records']
+                if self._merge(ctx, msg.body['members']):
+                    # changes are spread to everyone at once, periodic gossip only repairs lost updates
+                    self._gossip(ctx, self._alive_addrs())
+                if self._members[sender][1] == 'dead' and msg.body['members'][sender][1] == 'alive':
+                    # let the node falsely considered dead know about it
+                    self._gossip(ctx, [msg.sender])
+
+            # Request forwarded to the owner of the key
+            elif msg.type == 'REQ':
+                req = msg.body
+                self._loads[req['sender']] = req['load']
+                reply = (req['origin'], req['id'])
+                if req['direct'] and req['op'] == 'PUT':
+                    # write offered by the first candidate of the key, the record is stored here
+                    # if it is already here or if the first candidate is full
+                    stored = req['key'] in self._storage or req['place']
+                    if stored:
+                        self._execute('PUT', req['key'], req['value'])
+                    self._reply(ctx, reply, 'PUT', stored)
+                elif req['direct']:
+                    # request to another candidate of the key or read of a record which
+                    # may be still in flight to its new owner
+                    self._reply(ctx, reply, req['op'], self._execute(req['op'], req['key'], req['value']))
+                else:
+                    self._route(ctx, req['op'], req['key'], req['value'], reply, req['ttl'])
+
+            elif msg.type == 'RESP':
+                self._loads[msg.body['sender']] = msg.body['load']
+                req = self._requests.pop(msg.body['id'], None)
+                if req is not None:
+                    result = msg.body['result']
+                    if req['direct'] is not None and req['op'] == 'PUT':
+                        if not result:
+                            # another candidate has no record and room for it
+                            self._execute('PUT', req['key'], req['value'])
+                        result = None
+                    elif req['direct'] is not None and result == '':
+                        # the record could arrive while the other node was answering
+                        result = self._storage.get(req['key'], '')
+                    elif req['op'] == 'LOOKUP' and result is None:
+                        result = self._lookup(req['key'])
+                    self._reply(ctx, req['reply'], req['op'], result)
+
+            # Batch of records moved to the node after the change of the ring
+            elif msg.type == 'HANDOFF':
+                self._receive_batch(msg.body)
+                ack = Message('HANDOFF_ACK', {'transfer': msg.body['transfer'], 'seq': msg.body['seq']})
+                ctx.send(ack, msg.sender)
+
+            elif msg.type == 'HANDOFF_ACK':
+                self._on_batch_acked(ctx, msg.body['transfer'], msg.body['seq'])
 
             else:
                 err = Message('ERROR', 'unknown message: %s' % msg.type)
                 ctx.send(err, msg.sender)
 
+    def digest(self):
+        return {'members': self._alive_names(), 'records': len(self._storage)}
+
     def on_timer(self, ctx, timer):
         # type: (Context, str) -> None
-        pass
+        if timer == 'gossip':
+            # a leaving node keeps running until all its records are moved
+            if not self._joined and len(self._storage) == 0 and len(self._transfers) == 0:
+                return
+            for name in self._alive_names():
+                if name == self._name:
+                    continue
+                self._silent_ticks[name] = self._silent_ticks.get(name, 0) + 1
+                if self._silent_ticks[name] >= FAILURE_TICKS:
+                    logging.debug("%s: %s is dead", self._name, name)
+                    self._members[name][1] = 'dead'
+            self._update_ring(ctx)
+            # records put by nodes with a stale view of the ring are moved to their owners
+            self._handoff(ctx)
+            self._expire_handoff_state()
+            self._gossip(ctx, self._alive_addrs())
+            ctx.set_timer('gossip', GOSSIP_INTERVAL)
+
+        elif timer == 'retry':
+            # a single timer for all requests, so that thousands of pipelined requests
+            # do not create as many timers
+            self._retry_timer_set = False
+            for req_id, req in list(self._requests.items()):
+                req['ticks'] += 1
+                if req['ticks'] < 2:
+                    # sent less than the retry interval ago
+                    continue
+                req['ticks'] = 0
+                req['retries'] += 1
+                if req['retries'] > REQUEST_RETRIES:
+                    del self._requests[req_id]
+                    if req['reply'][0] == 'local':
+                        ctx.send_local(Message('ERROR', 'request timeout: %s %s' % (req['op'], req['key'])),
+                                       req['reply'][1])
+                    continue
+                # the owner may have changed since the previous attempt
+                self._forward(ctx, req_id, req)
+            self._set_retry_timer(ctx)
+
+        elif timer.startswith('handoff:'):
+            transfer_id = timer[8:]
+            transfer = self._transfers.get(transfer_id)
+            if transfer is None:
+                return
+            # resend batches which are not acknowledged yet, the receiver ignores duplicates
+            for seq in range(transfer['next']):
+                if seq not in transfer['acked']:
+                    self._send_batch(ctx, transfer_id, transfer, seq)
+            ctx.set_timer(timer, HANDOFF_RETRY_INTERVAL)
+
+    # Requests
+
+    def _request(self, ctx, op, key, value=None, request_id=None):
+        self._route(ctx, op, key, value, ('local', request_id), FORWARD_TTL)
+
+    def _route(self, ctx, op, key, value, reply, ttl):
+        # reply is ('local', request id of the client) for local clients
+        # and (address, request id) for requests of other nodes
+        owner = self._ring.lookup(key)
+        if owner is None or owner == self._name or ttl == 0:
+            self._serve(ctx, op, key, value, reply)
+        elif reply[0] == 'local':
+            self._new_request(ctx, op, key, value, reply)
+        else:
+            body = {'id': reply[1], 'op': op, 'key': key, 'value': value, 'origin': reply[0], 'ttl': ttl - 1,
+                    'direct': False, 'sender': self._name, 'load': len(self._storage)}
+            ctx.send(Message('REQ', body), self._members[owner][0])
+
+    def _serve(self, ctx, op, key, value, reply):
+        if self._bounded is not None:
+            other = self._other_candidate(key)
+            if op == 'LOOKUP' and other is not None and key not in self._storage:
+                self._new_request(ctx, op, key, value, reply, other)
+                return
+            if op == 'LOOKUP':
+                self._reply(ctx, reply, op, self._lookup(key))
+                return
+            if other is not None:
+                if op == 'GET' and key not in self._storage:
+                    self._new_request(ctx, op, key, value, reply, other)
+                    return
+                if op == 'PUT' and key not in self._storage:
+                    place = self._bounded.choose(key, self._load_view()) == other
+                    self._new_request(ctx, op, key, value, reply, other, place)
+                    return
+                if op == 'DELETE':
+                    self._execute(op, key, value)
+                    self._new_request(ctx, op, key, value, reply, other)
+                    return
+        if op == 'GET' and key not in self._storage:
+            source = self._expected_source(key)
+            if source is not None:
+                # the record may be still in flight from the previous owner, which serves it until then
+                self._new_request(ctx, op, key, value, reply, source)
+                return
+        self._reply(ctx, reply, op, self._execute(op, key, value))
+
+    def _reply(self, ctx, reply, op, result):
+        if reply[0] == 'local':
+            ctx.send_local(Message(op + '_RESP', result), reply[1])
+        else:
+            body = {'id': reply[1], 'result': result, 'sender': self._name, 'load': len(self._storage)}
+            ctx.send(Message('RESP', body), reply[0])
+
+    def _new_request(self, ctx, op, key, value, reply, direct=None, place=False):
+        req_id = '%s-%d' % (self._name, next(self._request_ids))
+        self._requests[req_id] = {'op': op, 'key': key, 'value': value, 'ticks': 0, 'retries': 0,
+                                  'reply': reply, 'direct': direct, 'place': place}
+        self._forward(ctx, req_id, self._requests[req_id])
+        self._set_retry_timer(ctx)
+
+    def _set_retry_timer(self, ctx):
+        if not self._retry_timer_set and len(self._requests) > 0:
+            ctx.set_timer('retry', REQUEST_RETRY_INTERVAL)
+            self._retry_timer_set = True
+
+    def _forward(self, ctx, req_id, req):
+        if req['direct'] is not None:
+            target = req['direct'] if self._members[req['direct']][1] != 'dead' else None
+        else:
+            target = self._ring.lookup(req['key'])
+        if target is None or target == self._name:
+            del self._requests[req_id]
+            if req['direct'] is not None and req['op'] == 'LOOKUP':
+                self._reply(ctx, req['reply'], req['op'], self._lookup(req['key']))
+            elif req['direct'] is not None:
+                self._reply(ctx, req['reply'], req['op'], self._execute(req['op'], req['key'], req['value']))
+            else:
+                self._serve(ctx, req['op'], req['key'], req['value'], req['reply'])
+            return
+        body = {'id': req_id, 'op': req['op'], 'key': req['key'], 'value': req['value'],
+                'origin': ctx.addr(), 'ttl': FORWARD_TTL, 'direct': req['direct'] is not None,
+                'place': req['place'], 'sender': self._name, 'load': len(self._storage)}
+        ctx.send(Message('REQ', body), self._members[target][0])
+
+    def _execute(self, op, key, value):
+        if op == 'GET':
+            return self._storage.get(key, '')
+        if op == 'LOOKUP':
+            # asked by the other candidate of the key with bounded loads
+            return self._name if key in self._storage else None
+        if len(self._expected) > 0:
+            source = self._expected_source(key)
+            if source is not None:
+                # records arriving from the previous owner must not override newer writes
+                self._expected[source]['written'].add(key)
+        if op == 'PUT':
+            self._storage[key] = value
+        else:
+            self._storage.pop(key, None)
+        return None
+
+    # Membership
+
+    def _alive_names(self):
+        return sorted(name for name, (_, status, _) in self._members.items() if status == 'alive')
+
+    def _alive_addrs(self):
+        return [self._members[name][0] for name in self._alive_names() if name != self._name]
+
+    def _heard(self, name):
+        self._silent_ticks[name] = 0
+
+    def _gossip(self, ctx, addrs):
+        message = Message('GOSSIP', {'name': self._name, 'members': self._members, 'records': len(self._storage)})
+        for addr in addrs:
+            ctx.send(message, addr)
+
+    def _merge(self, ctx, members):
+        # newer incarnations win, for the same incarnation left and dead override alive
+        changed = False
+        for name, (addr, status, incarnation) in members.items():
+            known = self._members.get(name)
+            if name == self._name:
+                if known is not None and known[1] == 'alive' and status != 'alive' and incarnation >= known[2]:
+                    # refute a false suspicion by a newer incarnation
+                    known[2] = incarnation + 1
+                    changed = True
+                continue
+            if (known is None or incarnation > known[2]
+                    or (incarnation == known[2] and known[1] == 'alive' and status != 'alive')):
+                self._members[name] = [addr, status, incarnation]
+                self._silent_ticks[name] = 0
+                changed = True
+        if changed:
+            self._update_ring(ctx)
+        return changed
+
+    # Rebalancing
+
+    def _update_ring(self, ctx):
+        alive = set(self._alive_names())
+        changes = [self._ring.remove(name) for name in self._ring.members if name not in alive]
+        changes += [self._ring.add(name) for name in alive if name not in self._ring]
+        # placements without token ranges return None, then all records are checked
+        unknown = self._bounded is not None or any(ranges is None for ranges in changes)
+        moved = [r for ranges in changes if ranges is not None for r in ranges]
+
+        for transfer_id, transfer in list(self._transfers.items()):
+            if transfer['target'] not in self._ring:
+                # records stay here and are moved to the new owners by the next sweep
+                logging.debug("%s: transfer %s to %s is aborted", self._name, transfer_id, transfer['target'])
+                self._finish_transfer(transfer_id)
+        for r in moved:
+            if r.target == self._name and r.source is not None and r.source != self._name:
+                expected = self._expected.setdefault(r.source, {'ranges': [], 'written': set(), 'idle': 0})
+                expected['ranges'].append(r)
+                expected['idle'] = 0
+        for source in list(self._expected):
+            # records of crashed nodes are lost
+            if self._members[source][1] == 'dead':
+                del self._expected[source]
+
+        targets = {r.target for r in moved if r.source == self._name and r.target is not None}
+        if len(targets) > 0 or unknown:
+            self._handoff(ctx, targets)
+
+    def _handoff(self, ctx, targets=()):
+        # moves records owned by other nodes, a transfer is started for each of `targets`
+        # even without records to let them know that the moved ranges are complete
+        if self._bounded is not None:
+            keys = self._bounded_moves()
+        else:
+            keys = {}
+            for key in self._storage:
+                if key in self._in_flight:
+                    continue
+                owner = self._ring.lookup(key)
+                if owner is not None and owner != self._name:
+                    keys.setdefault(owner, []).append(key)
+        for owner in set(keys) | set(targets):
+            self._start_transfer(ctx, owner, keys.get(owner, []), owner in targets)
+
+    def _bounded_moves(self):
+        # a record belongs to the first of its candidates if it has room for it, so records return
+        # to the first candidate (e.g. a new node) and overflow from nodes above the limit
+        loads = self._load_view()
+        limit = self._bounded.limit(loads)
+        keys = {}
+
+        def move(key, target):
+            keys.setdefault(target, []).append(key)
+            loads[target] = loads.get(target, 0) + 1
+            if self._name in loads:
+                loads[self._name] -= 1
+
+        for key in self._storage:
+            if key in self._in_flight:
+                continue
+            candidates = self._bounded.candidates(key)
+            if len(candidates) == 0 or candidates[0] == self._name:
+                continue
+            if self._name not in candidates:
+                move(key, self._bounded.choose(key, loads))
+            elif loads.get(candidates[0], 0) + 1 < limit:
+                move(key, candidates[0])
+        if loads.get(self._name, 0) >= limit:
+            moving = {key for batch in keys.values() for key in batch}
+            for key in self._storage:
+                if loads[self._name] < limit:
+                    break
+                if key in self._in_flight or key in moving:
+                    continue
+                other = self._other_candidate(key)
+                if other is not None and loads.get(other, 0) + 1 < limit:
+                    move(key, other)
+        return keys
+
+    def _is_home(self, key, name):
+        if self._bounded is not None:
+            return name in self._bounded.candidates(key)
+        return self._ring.lookup(key) == name
+
+    def _other_candidate(self, key):
+        for candidate in self._bounded.candidates(key):
+            if candidate != self._name:
+                return candidate
+        return None
+
+    def _lookup(self, key):
+        # with bounded loads: this node if it holds the key, otherwise the candidate a new key would go to
+        if key in self._storage:
+            return self._name
+        return self._bounded.choose(key, self._load_view())
+
+    def _load_view(self):
+        loads = {name: self._loads.get(name, 0) for name in self._ring.members}
+        if self._name in loads:
+            loads[self._name] = len(self._storage)
+        return loads
+
+    def _start_transfer(self, ctx, target, keys, rebalance):
+        batches = [[]]
+        size = 0
+        for key in keys:
+            record_size = len(key) + len(self._storage[key]) + 8
+            if len(batches[-1]) > 0 and (len(batches[-1]) >= HANDOFF_BATCH_RECORDS
+                                         or size + record_size > HANDOFF_BATCH_BYTES):
+                batches.append([])
+                size = 0
+            batches[-1].append(key)
+            size += record_size
+        transfer_id = '%s-%d' % (self._name, next(self._transfer_ids))
+        transfer = {'target': target, 'batches': batches, 'acked': set(), 'next': 0, 'rebalance': rebalance}
+        self._transfers[transfer_id] = transfer
+        for key in keys:
+            self._in_flight[key] = transfer_id
+        logging.debug("%s: moving %d records to %s in %d batches (transfer %s)",
+                      self._name, len(keys), target, len(batches), transfer_id)
+        self._send_window(ctx, transfer_id, transfer)
+        ctx.set_timer('handoff:' + transfer_id, HANDOFF_RETRY_INTERVAL)
+
+    def _send_window(self, ctx, transfer_id, transfer):
+        unacked = transfer['next'] - len(transfer['acked'])
+        while transfer['next'] < len(transfer['batches']) and unacked < HANDOFF_WINDOW:
+            self._send_batch(ctx, transfer_id, transfer, transfer['next'])
+            transfer['next'] += 1
+            unacked += 1
+
+    def _send_batch(self, ctx, transfer_id, transfer, seq):
+        records = {key: self._storage[key] for key in transfer['batches'][seq] if key in self._storage}
+        body = {'transfer': transfer_id, 'source': self._name, 'seq': seq, 'total': len(transfer['batches']),
+                'rebalance': transfer['rebalance'], 'records': records}
+        ctx.send(Message('HANDOFF', body), self._members[transfer['target']][0])
+
+    def _on_batch_acked(self, ctx, transfer_id, seq):
+        transfer = self._transfers.get(transfer_id)
+        if transfer is None or seq in transfer['acked']:
+            return
+        transfer['acked'].add(seq)
+        for key in transfer['batches'][seq]:
+            if self._in_flight.get(key) == transfer_id:
+                del self._in_flight[key]
+                if self._is_home(key, transfer['target']):
+                    self._storage.pop(key, None)
+        if len(transfer['acked']) == len(transfer['batches']):
+            del self._transfers[transfer_id]
+        else:
+            self._send_window(ctx, transfer_id, transfer)
+
+    def _finish_transfer(self, transfer_id):
+        transfer = self._transfers.pop(transfer_id)
+        for batch in transfer['batches']:
+            for key in batch:
+                if self._in_flight.get(key) == transfer_id:
+                    del self._in_flight[key]
+
+    def _receive_batch(self, batch):
+        incoming = self._incoming.setdefault(batch['transfer'], {'seqs': set(), 'idle': 0})
+        incoming['idle'] = 0
+        if batch['seq'] in incoming['seqs']:
+            return
+        incoming['seqs'].add(batch['seq'])
+        expected = self._expected.get(batch['source'])
+        written = expected['written'] if expected is not None else ()
+        for key, value in batch['records'].items():
+            if key not in written:
+                self._storage[key] = value
+        if batch['rebalance'] and len(incoming['seqs']) == batch['total']:
+            # all records of the moved ranges are here
+            self._expected.pop(batch['source'], None)
+
+    def _expected_source(self, key):
+        token = hash_key(key)
+        for source, expected in self._expected.items():
+            if any(r.contains(token) for r in expected['ranges']):
+                return source
+        return None
+
+    def _expire_handoff_state(self):
+        for states in (self._incoming, self._expected):
+            for name, state in list(states.items()):
+                state['idle'] += 1
+                if state['idle'] > HANDOFF_EXPIRE_TICKS:
+                    del states[name]
 
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument('-n', dest='name', 
+    parser.add_argument('-n', dest='name',
                         help='node name (should be unique)', default='1')
-    parser.add_argument('-l', dest='addr', metavar='host:port', 
+    parser.add_argument('-l', dest='addr', metavar='host:port',
                         help='listen on specified address', default='127.0.0.1:9701')
+    # jump hashing is not offered, its buckets depend on the order in which members were added,
+    # and nodes learning members by gossip would place keys differently
+    parser.add_argument('-p', dest='placement', choices=['rendezvous', 'ring'], default='ring',
+                        help='key placement strategy')
+    parser.add_argument('-e', dest='epsilon', type=float,
+                        help='bound loads of nodes by (1 + epsilon) times the average number of records')
+    parser.add_argument('-f', dest='data_dir', metavar='DIR',
+                        help='keep records in files in this directory to restore them after restart, '
+                             'by default they are kept in memory')
     parser.add_argument('-d', dest='log_level', action='store_const', const=logging.DEBUG,
                         help='print debugging info', default=logging.WARNING)
     args = parser.parse_args()
     logging.basicConfig(format="%(asctime)s - %(message)s", level=args.log_level)
 
-    node = Node(args.name)
+    node = Node(args.name, args.placement, args.epsilon, args.data_dir)
     Runtime(node, args.addr).start()
 
 
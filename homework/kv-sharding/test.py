@@ -3,26 +3,26 @@
 import argparse
 import logging
 import os
-import random
 import string
 import subprocess
 import sys
 import time
 import threading
 import unittest
-from functools import reduce
 
+from dslib.loadgen import ShardingApi, add_load_arguments, run_load
 from dslib.message import Message
+from dslib.stats import DistributionStats
 from dslib.test_server import TestMode, TestServer
 
 
 TEST_SERVER_ADDR = '127.0.0.1:9746'
 
 
-def run_node(impl_dir, name, addr, ts_addr, debug):
+def run_node(impl_dir, name, addr, ts_addr, debug, node_args=()):
     env = os.environ.copy()
     env['TEST_SERVER'] = ts_addr
-    cmd = ['python3', os.path.join(impl_dir, 'node.py'), '-n', name, '-l', addr]
+    cmd = ['python3', os.path.join(impl_dir, 'node.py'), '-n', name, '-l', addr] + list(node_args)
     if debug:
         cmd.append('-d')
         out = None
@@ -35,12 +35,14 @@ def run_node(impl_dir, name, addr, ts_addr, debug):
 
 class BaseTestCase(unittest.TestCase):
 
-    def __init__(self, impl_dir, node_count, debug=False):
+    def __init__(self, impl_dir, node_count, debug=False, node_args=()):
         super(BaseTestCase, self).__init__()
         self.impl_dir = impl_dir
         self.node_count = node_count
         self.keys_count = None
         self.debug = debug
+        # extra command line arguments of nodes, e.g. placement options of the reference solution
+        self.node_args = node_args
 
     def setUp(self):
         super(BaseTestCase, self).setUp()
@@ -54,7 +56,7 @@ class BaseTestCase(unittest.TestCase):
             name = 'node%02d' % (i+1)
             addr = '127.0.0.1:97%02d' % (i+1)
             self.nodes.append(name)
-            proc = run_node(self.impl_dir, name, addr, TEST_SERVER_ADDR, self.debug)
+            proc = run_node(self.impl_dir, name, addr, TEST_SERVER_ADDR, self.debug, self.node_args)
             self.node_processes.append(proc)
 
     def tearDown(self):
@@ -73,16 +75,16 @@ class BaseTestCase(unittest.TestCase):
 
         weights = []
         for i in range(len(string.ascii_lowercase)):
-            weights.append(random.randint(0, i^2))
-        random.shuffle(weights)
+            weights.append(self.ts.random.randint(0, i^2))
+        self.ts.random.shuffle(weights)
         while True:
-            self.keys = list(''.join(random.choices(string.ascii_lowercase, weights=weights, k=8)) for i in range(self.keys_count))
+            self.keys = list(''.join(self.ts.random.choices(string.ascii_lowercase, weights=weights, k=8)) for i in range(self.keys_count))
             if len(self.keys) == len(set(self.keys)):
                 break
         self.values = {
-            self.keys[i] : ''.join(random.choices(string.ascii_lowercase, k=8)) for i in range(self.keys_count)
+            self.keys[i] : ''.join(self.ts.random.choices(string.ascii_lowercase, k=8)) for i in range(self.keys_count)
         }
-        random.shuffle(self.keys)
+        self.ts.random.shuffle(self.keys)
 
         seed_addr = self.ts.get_process_addr(group[0])
         for node in group:
@@ -90,37 +92,44 @@ class BaseTestCase(unittest.TestCase):
 
         self.step_until_stabilized(group=group, expect_keys=0)
 
-        for i in range(self.keys_count):
-            node = random.choice(group)
-            self.ts.send_local_message(node, Message('PUT', f"{str(self.keys[i])}={self.values[self.keys[i]]}"))
-            msg = self.ts.step_until_local_message(node, 1)
-            self.assertIsNotNone(msg, "PUT response is not received")
-            self.assertEqual(msg.type, 'PUT_RESP')
+        # keys are loaded by a single pipelined batch instead of one request at a time
+        batch = [(self.ts.random.choice(group), Message('PUT', f"{key}={self.values[key]}")) for key in self.keys]
+        pending = self.ts.send_local_messages(batch, 10)
+        self.ts.step_until_resolved(pending, 10 + len(batch) / 100)
+        for future in pending:
+            self.assertTrue(future.done(), "PUT response is not received")
+            self.assertEqual(future.result().type, 'PUT_RESP')
 
     def snapshot(self):
+        # all nodes are queried at once, their key lists are returned in the order of self.nodes
+        pending = self.ts.send_local_messages([(node, Message('DUMP_KEYS')) for node in self.nodes])
+        self.ts.step_until_resolved(pending, 2)
         dumped_keys = []
-        for node in self.nodes:
-            self.ts.send_local_message(node, Message('DUMP_KEYS'))
-            msg = self.ts.step_until_local_message(node, 2)
+        for node, future in zip(self.nodes, pending):
+            self.assertTrue(future.done(), f"DUMP_KEYS response is not received from {node}")
+            msg = future.result()
             self.assertEqual(msg.type, 'DUMP_KEYS_RESP')
             dumped_keys.append(msg.body)
         return dumped_keys
 
     def check_distribution(self):
         snapshot = self.snapshot()
-        stored_keys = reduce(lambda a, b: set(a) | set(b), snapshot)
-        all_keys_are_stored = (set(self.keys) == stored_keys)
-        total_records = sum(map(len, snapshot))
-        max_keys_per_node = max(map(len, snapshot))
-        min_keys_per_node = min(map(len, snapshot))
+        stats = DistributionStats(self.nodes)
+        for node, keys in zip(self.nodes, snapshot):
+            stats.add(node, keys)
+        keys_are_unique = stats.duplicate_keys == 0
+        all_keys_are_stored = stats.unique_keys == len(self.keys) and len(stats.missing(self.keys)) == 0
+        max_keys_per_node = stats.max_per_node()
+        min_keys_per_node = stats.min_per_node()
         if len(self.keys) > 0:
             target_keys_per_node = len(self.keys) / len(self.nodes)
-            average_deviation = sum(map(lambda x: abs(len(x) - target_keys_per_node) / target_keys_per_node, snapshot)) / len(self.nodes)
-            max_deviation = max(map(lambda x: abs(len(x) - target_keys_per_node) / target_keys_per_node, snapshot))
+            deviations = stats.deviations(len(self.keys)).values()
+            average_deviation = sum(deviations) / len(self.nodes)
+            max_deviation = max(deviations)
 
         logging.info(
             "FINAL SNAPSHOT STATS:\n" +
-            f" - keys are unique: " + ("OK" if total_records == len(stored_keys) else "FAIL") + '\n' +
+            f" - keys are unique: " + ("OK" if keys_are_unique else "FAIL") + '\n' +
             f" - all keys are stored: " + ("OK" if all_keys_are_stored else "FAIL") + '\n' +
             f" - max keys per node: {max_keys_per_node}\n" +
             f" - min keys per node: {min_keys_per_node}\n" + 
@@ -129,20 +138,31 @@ class BaseTestCase(unittest.TestCase):
                 f" - average deviation from target: {average_deviation*100:.2f}%\n" +
                 f" - max deviation from target: {max_deviation*100:.2f}%\n"
             ) +
-            ("" if len(stored_keys) > 100 else ''.join(
+            ("" if stats.unique_keys > 100 else ''.join(
                 f" - - {self.nodes[i]}: {sorted(snapshot[i])}\n" for i in range(len(self.nodes))
             ))
         )
-        self.assertTrue(total_records == len(stored_keys), "Keys are not unique!")
+        self.assertTrue(keys_are_unique, "Keys are not unique!")
         self.assertTrue(all_keys_are_stored, "Some keys are missing!")
-        if len(stored_keys) > 100:
+        if stats.unique_keys > 100:
             self.assertTrue(max_deviation <= 0.2, "Key distribution is not balanced")
 
-    def step_until_stabilized(self, steps=10, timeout=10, group=None, expect_keys=None):
+    def step_until_stabilized(self, steps=10, timeout=10, group=None, expect_keys=None, quiescent=.3):
         if group is None:
             group = self.nodes
         if expect_keys is None:
             expect_keys = len(self.keys)
+        if all(self.ts.digest(node) is not None for node in group):
+            # nodes report members and number of records as state digests, so there is no need to poll them
+            members = sorted(group)
+
+            def converged(digests):
+                return (all(sorted(d['members']) == members for d in digests.values())
+                        and (expect_keys is None or sum(d['records'] for d in digests.values()) == expect_keys))
+
+            stabilized = self.ts.step_until_stabilized(quiescent, timeout, group, converged)
+            self.assertTrue(stabilized, "Members lists or keys are not stabilized")
+            return
         synced_nodes = set()
         counts = [0] * len(group)
 
@@ -187,11 +207,11 @@ class BasicTestCase(BaseTestCase):
         self.step_until_stabilized(expect_keys=0)
 
         self.keys_count = self.node_count
-        self.keys = list(''.join(random.choices(string.ascii_lowercase, k=8)) for i in range(self.keys_count))
+        self.keys = list(''.join(self.ts.random.choices(string.ascii_lowercase, k=8)) for i in range(self.keys_count))
         self.values = {
-            self.keys[i] : ''.join(random.choices(string.ascii_lowercase, k=8)) for i in range(self.keys_count)
+            self.keys[i] : ''.join(self.ts.random.choices(string.ascii_lowercase, k=8)) for i in range(self.keys_count)
         }
-        random.shuffle(self.keys)
+        self.ts.random.shuffle(self.keys)
 
         for i in range(self.node_count):
             self.ts.send_local_message(self.nodes[i], Message('PUT', f"{str(self.keys[i])}={self.values[self.keys[i]]}"))
@@ -203,7 +223,7 @@ class BasicTestCase(BaseTestCase):
         for i in range(0, self.node_count):
             for k, v in self.values.items():
                 tests.append([i, k, v])
-        random.shuffle(tests)
+        self.ts.random.shuffle(tests)
 
         for nodeid, key, value in tests:
             self.ts.send_local_message(self.nodes[nodeid], Message('GET', key))
@@ -223,10 +243,10 @@ class DeleteTestCase(BaseTestCase):
         self.keys_count = 10
         self.init_cluster()
 
-        random.shuffle(self.keys)
+        self.ts.random.shuffle(self.keys)
         for k in self.keys:
-            request_node = random.choice(self.nodes)
-            delete_node = random.choice(self.nodes)
+            request_node = self.ts.random.choice(self.nodes)
+            delete_node = self.ts.random.choice(self.nodes)
 
             self.ts.send_local_message(request_node, Message('GET', k))
             msg = self.ts.step_until_local_message(request_node, 1)
@@ -260,7 +280,7 @@ class LeaveTestCase(BaseTestCase):
         self.keys_count = 100
         self.init_cluster()
 
-        leave_node = random.choice(self.nodes)
+        leave_node = self.ts.random.choice(self.nodes)
         self.ts.send_local_message(leave_node, Message('COUNT_RECORDS'))
         msg = self.ts.step_until_local_message(leave_node, 1)
 
@@ -285,7 +305,7 @@ class SwingTestCase(BaseTestCase):
         group = self.nodes[:5]
         self.init_cluster(group=group)
 
-        seed_addr = self.ts.get_process_addr(random.choice(self.nodes[:5]))
+        seed_addr = self.ts.get_process_addr(self.ts.random.choice(self.nodes[:5]))
         for node in self.nodes[5:]:
             self.ts.send_local_message(node, Message('JOIN', seed_addr))
             group.append(node)
@@ -310,7 +330,7 @@ class CrashTestCase(BaseTestCase):
         self.keys_count = 100
         self.init_cluster()
 
-        victim = random.choice(self.nodes)
+        victim = self.ts.random.choice(self.nodes)
         self.ts.send_local_message(victim, Message('DUMP_KEYS'))
         msg = self.ts.step_until_local_message(victim, 1)
         self.assertIsNotNone(msg, "DUMP_KEYS response is not received")
@@ -325,7 +345,7 @@ class CrashTestCase(BaseTestCase):
         self.keys_count -= len(victim_keys)
         self.step_until_stabilized()
 
-        query_node = random.choice(self.nodes)
+        query_node = self.ts.random.choice(self.nodes)
         self.ts.send_local_message(query_node, Message('GET', list(victim_keys)[0]))
         msg = self.ts.step_until_local_message(query_node, 10)
         self.assertIsNotNone(msg, "GET response is not received")
@@ -355,7 +375,7 @@ class BalancedJoinCase(BaseTestCase):
         self.init_cluster(group=group)
         s1 = self.snapshot()
 
-        seed_addr = self.ts.get_process_addr(random.choice(self.nodes[:-1]))
+        seed_addr = self.ts.get_process_addr(self.ts.random.choice(self.nodes[:-1]))
         node = self.nodes[-1]
         self.ts.send_local_message(node, Message('JOIN', seed_addr))
         self.step_until_stabilized()
@@ -379,7 +399,7 @@ class BalancedLeaveCase(BaseTestCase):
         self.init_cluster()
         s1 = self.snapshot()
 
-        node = random.choice(self.nodes)
+        node = self.ts.random.choice(self.nodes)
         s1.pop(self.nodes.index(node))
         self.ts.send_local_message(node, Message('LEAVE'))
         self.nodes.remove(node)
@@ -395,16 +415,36 @@ class BalancedLeaveCase(BaseTestCase):
         self.assertTrue(deviation <= 20, "Deviation from target is more than 20%")
 
 
+def node_args(args):
+    result = []
+    if args.placement is not None:
+        result += ['-p', args.placement]
+    if args.bounded_load is not None:
+        result += ['-e', str(args.bounded_load)]
+    return result
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('-v', dest='verbose', action='store_true',
                         help="print messages and other info from tests")
     parser.add_argument('-d', dest='debug', action='store_true',
                         help="include debugging output from simplementation")
+    parser.add_argument('--placement',
+                        help="key placement strategy passed to nodes with -p (ring or rendezvous)")
+    parser.add_argument('--bounded-load', type=float, metavar='EPSILON',
+                        help="bound loads of nodes by (1 + EPSILON) times the average, passed to nodes with -e")
+    add_load_arguments(parser, 'GET=0.8,PUT=0.15,DELETE=0.05')
     parser.add_argument(dest='impl_dir', metavar='DIRECTORY',
                         help="directory with implementation to test")
     args = parser.parse_args()
 
+    if args.load is not None:
+        logging.basicConfig(format="%(asctime)s - %(message)s", level=logging.INFO)
+        def start_node(name, addr):
+            return run_node(args.impl_dir, name, addr, TEST_SERVER_ADDR, args.debug, node_args(args))
+        return run_load(args, start_node, ShardingApi(), TEST_SERVER_ADDR)
+
     if args.verbose:
         logging.basicConfig(format="%(asctime)s - %(message)s", level=logging.DEBUG)
     else:
@@ -412,21 +452,21 @@ def main():
 
     tests = [
         BasicTestCase(
-            args.impl_dir, 5, debug=args.debug),
+            args.impl_dir, 5, debug=args.debug, node_args=node_args(args)),
         DeleteTestCase(
-            args.impl_dir, 5, debug=args.debug),
+            args.impl_dir, 5, debug=args.debug, node_args=node_args(args)),
         LeaveTestCase(
-            args.impl_dir, 5, debug=args.debug),
+            args.impl_dir, 5, debug=args.debug, node_args=node_args(args)),
         SwingTestCase(
-            args.impl_dir, 10, debug=args.debug),
+            args.impl_dir, 10, debug=args.debug, node_args=node_args(args)),
         CrashTestCase(
-            args.impl_dir, 5, debug=args.debug),
+            args.impl_dir, 5, debug=args.debug, node_args=node_args(args)),
         BalancedStaticCase(
-            args.impl_dir, 5, debug=args.debug),
+            args.impl_dir, 5, debug=args.debug, node_args=node_args(args)),
         BalancedJoinCase(
-            args.impl_dir, 6, debug=args.debug),
+            args.impl_dir, 6, debug=args.debug, node_args=node_args(args)),
         BalancedLeaveCase(
-            args.impl_dir, 5, debug=args.debug),
+            args.impl_dir, 5, debug=args.debug, node_args=node_args(args)),
         ]
     suite = unittest.TestSuite()
     suite.addTests(tests)
@@ -53,6 +53,11 @@ class Node(Process):
                 err = Message('ERROR', 'unknown message: %s' % msg.type)
                 ctx.send(err, msg.sender)
 
+    def digest(self):
+        # Optional: return the sorted list of known alive nodes (as in MEMBERS response),
+        # then tests detect convergence of the group without polling nodes with GET_MEMBERS
+        return None
+
     def on_timer(self, ctx, timer):
         # type: (Context, str) -> None
         pass
@@ -3,7 +3,6 @@
 import argparse
 import logging
 import os
-import random
 import subprocess
 import sys
 import time
@@ -11,6 +10,7 @@ import threading
 import unittest
 
 from dslib.message import Message
+from dslib.soak import SoakRunner
 from dslib.test_server import TestMode, TestServer
 
 
@@ -63,9 +63,16 @@ class BaseTestCase(unittest.TestCase):
             except OSError:
                 pass
 
-    def step_until_stabilized(self, steps=10, timeout=10, group=None):
+    def step_until_stabilized(self, steps=10, timeout=10, group=None, quiescent=.3):
         if group is None:
             group = self.nodes
+        if all(self.ts.digest(node) is not None for node in group):
+            # nodes report their members lists as state digests, so there is no need to poll them
+            members = sorted(group)
+            stabilized = self.ts.step_until_stabilized(
+                quiescent, timeout, group, lambda digests: all(sorted(d) == members for d in digests.values()))
+            self.assertTrue(stabilized, "Members lists are not stabilized")
+            return
         synced_nodes = set()
         start = time.time()
         while time.time() - start < timeout and len(synced_nodes) < len(group):
@@ -117,7 +124,7 @@ class RandomSeedTestCase(BaseTestCase):
             if len(members) == 0:
                 seed_addr = self.ts.get_process_addr(self.nodes[0])
             else:
-                seed_addr = self.ts.get_process_addr(random.choice(tuple(members)))
+                seed_addr = self.ts.get_process_addr(self.ts.random.choice(sorted(members)))
             self.ts.send_local_message(node, Message('JOIN', seed_addr))
             members.add(node)
 
@@ -134,7 +141,7 @@ class NodeJoinTestCase(BaseTestCase):
         self.assertTrue(self.ts.wait_processes(self.node_count, self.node_count), "Startup timeout")
 
         # select node which will join the group later
-        new_node = random.choice(self.nodes)
+        new_node = self.ts.random.choice(self.nodes)
         self.nodes.remove(new_node)
 
         # add nodes to the group (seed is first node)
@@ -172,7 +179,7 @@ class NodeLeaveTestCase(BaseTestCase):
         init_message_count = self.ts._message_count
 
         # node leaves the group
-        left_node = random.choice(self.nodes)
+        left_node = self.ts.random.choice(self.nodes)
         self.ts.send_local_message(left_node, Message('LEAVE'))
         self.nodes.remove(left_node)
 
@@ -198,7 +205,7 @@ class NodeCrashTestCase(BaseTestCase):
         init_message_count = self.ts._message_count
 
         # node crashes
-        crashed_node = random.choice(self.nodes)
+        crashed_node = self.ts.random.choice(self.nodes)
         self.ts.crash_process(crashed_node)
         self.nodes.remove(crashed_node)
 
@@ -223,7 +230,7 @@ class NodeCrashRecoverTestCase(BaseTestCase):
         self.step_until_stabilized(steps=10, timeout=10)
 
         # node crashes
-        crashed_node = random.choice(self.nodes)
+        crashed_node = self.ts.random.choice(self.nodes)
         self.ts.crash_process(crashed_node)
         self.nodes.remove(crashed_node)
 
@@ -234,7 +241,7 @@ class NodeCrashRecoverTestCase(BaseTestCase):
         # crashed node recovers
         self.restart_node(crashed_node)
         time.sleep(1)
-        seed_addr = seed_addr = self.ts.get_process_addr(random.choice(tuple(self.nodes)))
+        seed_addr = self.ts.get_process_addr(self.ts.random.choice(self.nodes))
         self.ts.send_local_message(crashed_node, Message('JOIN', seed_addr))
         self.nodes.append(crashed_node)
 
@@ -260,7 +267,7 @@ class NodeOfflineTestCase(BaseTestCase):
         init_message_count = self.ts._message_count
 
         # node disconnects
-        offline_node = random.choice(self.nodes)
+        offline_node = self.ts.random.choice(self.nodes)
         self.ts.disconnect_process(offline_node)
         self.nodes.remove(offline_node)
 
@@ -286,7 +293,7 @@ class NodeOfflineRecoverTestCase(BaseTestCase):
         init_message_count = self.ts._message_count
 
         # node disconnects
-        offline_node = random.choice(self.nodes)
+        offline_node = self.ts.random.choice(self.nodes)
         self.ts.disconnect_process(offline_node)
         self.nodes.remove(offline_node)
 
@@ -381,7 +388,7 @@ class NodeCannotReceiveTestCase(BaseTestCase):
         init_message_count = self.ts._message_count
 
         # node cannot receive messages
-        blocked_node = random.choice(self.nodes)
+        blocked_node = self.ts.random.choice(self.nodes)
         self.ts.drop_incoming(blocked_node)
         self.nodes.remove(blocked_node)
 
@@ -407,8 +414,8 @@ class NodesDisconnectedTestCase(BaseTestCase):
         init_message_count = self.ts._message_count
 
         # disconnect two nodes from each other
-        node1 = random.choice(self.nodes)
-        node2 = random.choice(self.nodes)
+        node1 = self.ts.random.choice(self.nodes)
+        node2 = self.ts.random.choice(self.nodes)
         self.ts.disable_link(node1, node2)
         self.ts.disable_link(node2, node1)
 
@@ -498,7 +505,7 @@ class FlakyNetworkCrashTestCase(BaseTestCase):
 
         # make network unreliable and crash one node
         self.ts.set_message_drop_rate(0.5)
-        crashed_node = random.choice(self.nodes)
+        crashed_node = self.ts.random.choice(self.nodes)
         self.ts.crash_process(crashed_node)
         self.nodes.remove(crashed_node)
 
@@ -515,16 +522,83 @@ class FlakyNetworkCrashTestCase(BaseTestCase):
         logging.debug("MESSAGE COUNT: %d" % (self.ts._message_count - init_message_count))
 
 
+def run_soak(args):
+    ts = TestServer(TEST_SERVER_ADDR)
+    ts.start()
+    # memory of long runs should not depend on their length
+    ts.set_message_index_limits(10000, 16 * 2**20)
+    nodes = ['node%02d' % (i+1) for i in range(args.node_count)]
+    processes = {}
+
+    def start_node(node):
+        addr = '127.0.0.1:%d' % (9700 + int(node.replace('node', '')))
+        processes[node] = run_node(args.impl_dir, node, addr, TEST_SERVER_ADDR, args.debug)
+
+    def join(node):
+        members = [n for n in ts.running_processes() if n != node]
+        seed = ts.random.choice(members) if len(members) > 0 else node
+        ts.send_local_message(node, Message('JOIN', ts.get_process_addr(seed)))
+
+    def restart(node):
+        start_node(node)
+        deadline = time.time() + 5
+        while node not in ts.running_processes() and time.time() < deadline:
+            time.sleep(.01)
+        if node in ts.running_processes():
+            join(node)
+
+    def load(ts, now):
+        running = ts.running_processes()
+        if len(running) == 0:
+            # all nodes are crashed by churn
+            return []
+        return [(ts.random.choice(running), Message('GET_MEMBERS'))]
+
+    try:
+        for node in nodes:
+            start_node(node)
+        if not ts.wait_processes(len(nodes), len(nodes)):
+            logging.error("Startup timeout")
+            return 1
+        for node in nodes:
+            join(node)
+        runner = SoakRunner(
+            ts, args.soak_output, load=load, load_interval=1,
+            churn_interval=args.churn_interval, restart=restart, restart_delay=5,
+            report_interval=10, window=60)
+        totals = runner.run(args.soak)
+        logging.info("soak finished: %s", totals)
+    finally:
+        for process in processes.values():
+            process.terminate()
+        ts.stop(wait_processes=False)
+        for process in processes.values():
+            try:
+                process.kill()
+            except OSError:
+                pass
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('-n', dest='node_count', type=int, default=10,
                         help="number of nodes")
     parser.add_argument('-d', dest='debug', action='store_true',
                         help="include debugging output from implementation")
+    parser.add_argument('--soak', type=float, metavar='SECONDS',
+                        help="instead of tests run the group under load and churn for given time")
+    parser.add_argument('--soak-output', default='soak.jsonl',
+                        help="file for soak statistics")
+    parser.add_argument('--churn-interval', type=float, default=60,
+                        help="interval between node crashes during soak run")
     parser.add_argument(dest='impl_dir', metavar='DIRECTORY',
                         help="directory with implementation to test")
     args = parser.parse_args()
 
+    if args.soak is not None:
+        logging.basicConfig(format="%(asctime)s - %(message)s", level=logging.INFO)
+        return run_soak(args)
+
     logging.basicConfig(format="%(asctime)s - %(message)s", level=logging.DEBUG)
 
     tests = [
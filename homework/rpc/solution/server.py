@@ -2,8 +2,10 @@
 
 import argparse
 import logging
+import threading
 
 from dslib import Communicator, Message
+from dslib.wal import WriteAheadLog
 
 from common import Store
 
@@ -41,6 +43,91 @@ class StoreImpl(Store):
             return self._data.pop(key)
 
 
+class DurableStore(Store):
+    """Store wrapper which makes changes durable with a write-ahead log"""
+
+    def __init__(self, store, path, snapshot_every=10000, group_commit=True):
+        self._store = store
+        self._wal = WriteAheadLog(path, group_commit)
+        self._snapshot_every = snapshot_every
+        self._lock = threading.Lock()
+        self._snapshotting = threading.Lock()
+        # the Store interface has no listing of keys, so they are tracked for snapshots
+        self._keys = set()
+        self._changes = 0
+        state, records = self._wal.recover()
+        for key, value in (state or {}).items():
+            self._apply(['put', key, value])
+        for record in records:
+            self._apply(record)
+        logging.debug("restored %d keys from %s", len(self._keys), path)
+
+    def put(self, key, value, overwrite):
+        with self._lock:
+            if key in self._keys and not overwrite:
+                return False
+            seq = self._log(['put', key, value])
+            self._store.put(key, value, True)
+        self._commit(seq)
+        return True
+
+    def get(self, key):
+        return self._store.get(key)
+
+    def append(self, key, value):
+        with self._lock:
+            if key not in self._keys:
+                # nothing to log, the store raises its error for a missing key
+                return self._store.append(key, value)
+            seq = self._log(['append', key, value])
+            result = self._store.append(key, value)
+        self._commit(seq)
+        return result
+
+    def remove(self, key):
+        with self._lock:
+            if key not in self._keys:
+                return self._store.remove(key)
+            seq = self._log(['remove', key])
+            result = self._store.remove(key)
+        self._commit(seq)
+        return result
+
+    def close(self):
+        self._wal.close()
+
+    def _apply(self, record):
+        if record[0] == 'put':
+            self._store.put(record[1], record[2], True)
+            self._keys.add(record[1])
+        elif record[0] == 'append':
+            self._store.append(record[1], record[2])
+        elif record[0] == 'remove':
+            self._store.remove(record[1])
+            self._keys.discard(record[1])
+
+    def _log(self, record):
+        seq = self._wal.append(record)
+        if record[0] == 'put':
+            self._keys.add(record[1])
+        elif record[0] == 'remove':
+            self._keys.discard(record[1])
+        self._changes += 1
+        return seq
+
+    def _commit(self, seq):
+        self._wal.commit(seq)
+        if self._changes >= self._snapshot_every and self._snapshotting.acquire(blocking=False):
+            try:
+                with self._lock:
+                    state = {key: self._store.get(key) for key in self._keys}
+                    seq = self._wal.rotate()
+                    self._changes = 0
+                self._wal.snapshot(state, seq)
+            finally:
+                self._snapshotting.release()
+
+
 class RpcServer:
     """This is server-side RPC implementation"""
 
@@ -59,6 +146,8 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('-l', dest='addr', metavar='host:port', 
                         help='listen on specified address', default='127.0.0.1:9701')
+    parser.add_argument('-f', dest='data_dir', metavar='DIR',
+                        help='keep a write-ahead log of changes in this directory to restore them after restart')
     parser.add_argument('-d', dest='log_level', action='store_const', const=logging.DEBUG,
                         help='print debugging info', default=logging.WARNING)
     args = parser.parse_args()
@@ -66,6 +155,8 @@ def main():
     args = parser.parse_args()
 
     store = StoreImpl()
+    if args.data_dir is not None:
+        store = DurableStore(store, args.data_dir)
     server = RpcServer(args.addr, store)
     server.run()
 
@@ -8,6 +8,7 @@ import threading
 import unittest
 
 from dslib.message import Message
+from dslib.sim import Simulation
 from dslib.test_server import TestMode, TestServer
 
 
@@ -44,22 +45,33 @@ def run_server(impl_dir, serv_addr, ts_addr, debug):
 
 
 class BaseTestCase(unittest.TestCase):
-    def __init__(self, impl_dir, debug=False):
+    def __init__(self, impl_dir, debug=False, in_process=False):
         super(BaseTestCase, self).__init__()
         self.impl_dir = impl_dir
         self.debug = debug
+        self.in_process = in_process
 
     def setUp(self):
         super(BaseTestCase, self).setUp()
         sys.stderr.write("\n\n" + self.__class__.__name__ + " " + "-" * 60 + "\n\n")
 
         self.ts = TestServer(TEST_SERVER_ADDR)
+        if self.in_process:
+            self.sim = Simulation(self.ts, self.debug)
+            self.sim.run_program(os.path.join(self.impl_dir, 'server.py'), ['-l', SERVER_ADDR], 'server')
+            self.sim.run_program(os.path.join(self.impl_dir, 'client.py'), ['-s', SERVER_ADDR], 'client')
+            return
+        self.sim = None
         self.ts.start()
         self.server = run_server(self.impl_dir, SERVER_ADDR, TEST_SERVER_ADDR, self.debug)
         self.user = run_client(self.impl_dir, SERVER_ADDR, TEST_SERVER_ADDR, self.debug)
         
 
     def tearDown(self):
+        if self.sim is not None:
+            self.sim.stop()
+            self.ts.stop()
+            return
         self.server.terminate()
         self.user.terminate()
         self.ts.stop()
@@ -308,23 +320,25 @@ def main():
     parser.add_argument('-d', dest='debug', action='store_true',
                         help="include debugging output from implementation")
     parser.add_argument('-n', default='1', type=int)
+    parser.add_argument('--in-process', action='store_true',
+                        help="run programs as tasks of the test process instead of separate processes")
     args = parser.parse_args()
 
     logging.basicConfig(format="%(asctime)s - %(message)s", level=logging.DEBUG)
 
     tests = [
         BasicPutTestCase(
-            args.impl_dir, args.debug),
+            args.impl_dir, args.debug, args.in_process),
         BasicGetTestCase(
-            args.impl_dir, args.debug),
+            args.impl_dir, args.debug, args.in_process),
         BasicAppendTestCase(
-            args.impl_dir, args.debug),
+            args.impl_dir, args.debug, args.in_process),
         BasicRemoveTestCase(
-            args.impl_dir, args.debug),
+            args.impl_dir, args.debug, args.in_process),
         BasicTimeoutTestCase(
-            args.impl_dir, args.debug),
+            args.impl_dir, args.debug, args.in_process),
         CheckRepeatedCallsTestCase(
-            args.impl_dir, args.debug)
+            args.impl_dir, args.debug, args.in_process)
     ]
 
     for i in range(args.n):